@@ -1,3 +1,5 @@
+import os
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
@@ -40,7 +42,11 @@ external_js = ["https://code.jquery.com/jquery-3.2.1.min.js"]
 
 # app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 app = dash.Dash(
-    name="ribopod", external_scripts=external_js, external_stylesheets=external_css
+    name="ribopod",
+    external_scripts=external_js,
+    external_stylesheets=external_css,
+    # Clientside callbacks, independent of the working directory
+    assets_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"),
 )  # title="ribopod : Visualizing ribo-seq datasets")
 app.title = "ribopod : Visualizing ribo-seq datasets"
 server = app.server
@@ -17,14 +17,13 @@ from init import build_to_species
 import pandas as pd
 from plotly.graph_objs import Bar, Figure, Layout
 
-datasets_counts = __DATASETS__.index.value_counts().to_dict()
-datasets_counts = {
-    build_to_species(key): value for key, value in datasets_counts.items()
-}
-datasets_counts = pd.Series(datasets_counts).sort_values()
-
 
 def display_bar_plot():  # , state, n_clicks):
+    datasets_counts = __DATASETS__.species_counts()
+    datasets_counts = {
+        build_to_species(key): value for key, value in datasets_counts.items()
+    }
+    datasets_counts = pd.Series(datasets_counts).sort_values()
     trace = Bar(
         x=datasets_counts.index.tolist(),
         y=datasets_counts.values.tolist(),
@@ -127,6 +126,12 @@ layout = html.Div(
 )
 
 
+@app.callback(Output("dataset-distribution", "figure"), [Input("url", "pathname")])
+def update_bar_plot(pathname):
+    # Pick up projects added since the server started
+    return display_bar_plot()
+
+
 @app.callback(
     Output("species-data", "children"), [Input("dataset-distribution", "selectedData")]
 )
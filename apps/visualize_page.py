@@ -1,7 +1,16 @@
+from collections import OrderedDict
+import functools
+import hmac
+import json
+import os
+
+import dash
 import dash_core_components as dcc
 import dash_html_components as html
 
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from dash import no_update
 import flask
 from flask import send_file
 
@@ -9,29 +18,141 @@ from init import __DATASETS__
 from init import __SPECIES__
 
 from app_multipage import app
-from dash_helper import generate_table, path_leaf
+from cache_helper import (
+    cache_stats,
+    get_cached_figure,
+    get_fresh_figure,
+    get_precomputed_matrix,
+    get_project_bam_summary_paths,
+    get_project_metagene_page,
+    get_project_metagene_paths,
+    get_project_metagenes,
+    get_project_read_length_matrix,
+    get_project_table,
+    invalidate_projects,
+    prerender_figure,
+)
+from dash_helper import (
+    filter_table,
+    generate_datatable,
+    path_leaf,
+    sort_table,
+    table_page,
+)
+from job_helper import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    background_jobs_enabled,
+    cancel_job,
+    job_status,
+    submit_job,
+)
 from fragment_length_helper import (
-    parse_ribotricer_bam_summary,
-    project_summary_read_length_creator,
     plot_read_length_distribution,
+    matrix_to_read_length_distributions,
+    read_read_length_matrix,
 )
 from metagene_helper import (
-    project_summary_metagene_creator,
-    plot_metagene_coverage,
+    metagene_coverage_payload,
     metagene_profile_to_phase_score_matrix,
     plot_phase_score_heatmap,
 )
 
 from project_helper import (
     get_projects,
-    get_srp_table,
     get_srp_read_lengths,
     get_project_summary_file,
     get_summarized_phase_scores,
     get_summarized_orf_counts,
+    read_phase_score_matrix,
 )
 
 from orf_helper import plot_orf_counts_stacked_bar, plot_phase_scores_violin
+from plot_helper import __SAMPLES_PER_PAGE__, page_count, paginate
+
+# Cached data of unchanged projects survives a reload of datasets.tsv
+__DATASETS__.add_reload_listener(invalidate_projects)
+# Milliseconds between polls of a background job
+JOB_POLL_INTERVAL = 1000
+# Lets other hosts call the maintenance routes when sent in the
+# X-Ribopod-Token header, otherwise only this machine may call them
+ADMIN_TOKEN = os.environ.get("RIBOPOD_ADMIN_TOKEN")
+
+
+def job_components(name):
+    """Progress message, job id and polling timer of a background job."""
+    return [
+        html.Div(id="{}-progress".format(name), style={"font-family": "Droid Serif"}),
+        dcc.Store(id="{}-job".format(name)),
+        dcc.Interval(
+            id="{}-interval".format(name), interval=JOB_POLL_INTERVAL, disabled=True
+        ),
+    ]
+
+
+def run_figure_job(name, args, file_paths, render, job):
+    """Serve a figure, rendering it in a background job on a miss.
+
+    Callbacks using this are triggered by their inputs and by the
+    {name}-interval timer, which is only enabled while a job runs.
+
+    Parameters
+    ----------
+    name: string
+          Name of the callback, see get_cached_figure
+    args: list
+          Input values of the callback, starting with srp and species
+    file_paths: list
+                Files the figure is drawn from
+    render: function
+            Returns the figure, must be picklable
+    job: dict
+         Value of {name}-job, the job started by a previous call
+
+    Returns
+    -------
+    figure: dict
+            dash.no_update while the job runs
+    job: dict
+         Job to poll, None once there is nothing left to poll
+    disabled: bool
+              Whether polling stops
+    progress: string
+              Message shown below the figure
+    """
+    polling = any(
+        trigger["prop_id"].endswith(".n_intervals")
+        for trigger in dash.callback_context.triggered
+    )
+    key = json.dumps([name] + list(args), sort_keys=True, default=str)
+    if job and job["key"] != key:
+        # Selection changed before the previous job finished
+        cancel_job(job["id"])
+        job = None
+    if not job:
+        if polling:
+            raise PreventUpdate
+        figure = get_fresh_figure(name, args, file_paths)
+        if figure is not None:
+            return figure, None, True, ""
+        if not background_jobs_enabled():
+            return get_cached_figure(name, args, file_paths, render), None, True, ""
+        job_id = submit_job(name, prerender_figure, (name, args, file_paths, render))
+        return no_update, {"id": job_id, "key": key}, False, "Queued"
+    status = job_status(job["id"]) or {"state": FAILED, "message": "job was lost"}
+    if status["state"] == DONE:
+        return get_cached_figure(name, args, file_paths, render), None, True, ""
+    if status["state"] in [FAILED, CANCELLED]:
+        return no_update, None, True, "Unable to draw: {}".format(status["message"])
+    if status.get("total"):
+        progress = "{} ({}/{})".format(
+            status["message"], status["done"], status["total"]
+        )
+    else:
+        progress = status["state"].capitalize()
+    return no_update, job, False, progress
+
 
 layout = html.Div(
     [
@@ -45,6 +166,8 @@ layout = html.Div(
             style={"text-align": "center"},
         ),
         html.Div(id="datatable-interactivity-container"),
+        # Payload of the selected project, see load_project
+        dcc.Store(id="project-store"),
         html.Div(
             [
                 html.Div(
@@ -133,6 +256,42 @@ layout = html.Div(
                                 "align": "center",
                             },
                         ),
+                        html.Div(
+                            [
+                                html.Label("Samples per page: "),
+                                dcc.Dropdown(
+                                    options=[
+                                        {"label": str(n), "value": n}
+                                        for n in [10, 20, 50, 100]
+                                    ]
+                                    + [{"label": "All", "value": 0}],
+                                    value=__SAMPLES_PER_PAGE__,
+                                    clearable=False,
+                                    id="samples-per-page",
+                                ),
+                            ],
+                            style={
+                                "width": "20%",
+                                "display": "inline-block",
+                                "font-family": "Droid Serif",
+                            },
+                        ),
+                        html.Div(
+                            [
+                                html.Label("Page: "),
+                                dcc.Dropdown(
+                                    options=[{"label": "1", "value": 1}],
+                                    value=1,
+                                    clearable=False,
+                                    id="sample-page",
+                                ),
+                            ],
+                            style={
+                                "width": "20%",
+                                "display": "inline-block",
+                                "font-family": "Droid Serif",
+                            },
+                        ),
                     ]
                 )
             ],
@@ -168,6 +327,9 @@ layout = html.Div(
                                                                             },
                                                                         )
                                                                     ]
+                                                                    + job_components(
+                                                                        "coherence"
+                                                                    )
                                                                 )
                                                             ],
                                                             type="circle",
@@ -251,6 +413,9 @@ layout = html.Div(
                                     children=[
                                         html.Div(
                                             html.Div(
+                                                generate_datatable(
+                                                    "srametadata-datatable"
+                                                ),
                                                 id="srametadata-table",
                                                 style={
                                                     # "overflowX": "scroll",
@@ -300,7 +465,13 @@ layout = html.Div(
                                 dcc.Loading(
                                     id="loading-metagene-plot",
                                     children=[
-                                        html.Div([dcc.Graph(id="metagene-plot")])
+                                        html.Div(
+                                            [
+                                                dcc.Graph(id="metagene-plot"),
+                                                dcc.Store(id="metagene-store"),
+                                            ]
+                                            + job_components("metagene")
+                                        )
                                     ],
                                     type="graph",
                                 )
@@ -320,14 +491,76 @@ layout = html.Div(
 
 
 @app.callback(
-    Output("srametadata-table", "children"),
-    [Input("srp", "value"), Input("assembly", "value")],
+    Output("project-store", "data"),
+    [Input("srp", "value")],
+    [State("assembly", "value")],
 )
-def display_datatable(srp, assembly):  # , gene_name):
+def load_project(srp, assembly):
+    """Resolve the selected project and load what its plots share.
+
+    This is the only callback listening to the project selection.
+    A species change only reaches it through update_srp_value, so
+    each selection is loaded once and every plot callback derives
+    from the payload written to project-store.
+    """
     if isinstance(srp, dict):
         srp = srp["value"]
-    df = get_srp_table(__DATASETS__, srp)
-    return generate_table(df)  # .to_dict("rows")
+    if isinstance(assembly, dict):
+        assembly = assembly["value"]
+    if not srp:
+        raise PreventUpdate
+    project_summary_file = get_project_summary_file(__DATASETS__, srp, assembly)
+    # Warm the caches the callbacks below read from
+    get_project_table(project_summary_file)
+    n_samples = max(
+        len(get_project_metagene_paths(project_summary_file)),
+        len(get_project_bam_summary_paths(project_summary_file)),
+    )
+    return {
+        "srp": srp,
+        "assembly": assembly,
+        "read_lengths": get_srp_read_lengths(__DATASETS__, srp, assembly),
+        "n_samples": n_samples,
+    }
+
+
+def get_project_selection(project):
+    """srp and assembly of a project-store payload."""
+    if not project:
+        raise PreventUpdate
+    return project["srp"], project["assembly"]
+
+
+@app.callback(
+    [
+        Output("srametadata-datatable", "data"),
+        Output("srametadata-datatable", "page_count"),
+    ],
+    [
+        Input("srametadata-datatable", "page_current"),
+        Input("srametadata-datatable", "page_size"),
+        Input("srametadata-datatable", "sort_by"),
+    ],
+    # Changes of these reset page_current, which triggers this
+    [State("project-store", "data"), State("srametadata-datatable", "filter_query")],
+)
+def display_datatable(
+    page_current, page_size, sort_by, project, filter_query
+):  # , gene_name):
+    srp, assembly = get_project_selection(project)
+    project_summary_file = get_project_summary_file(__DATASETS__, srp, assembly)
+    df = get_project_table(project_summary_file)
+    df = sort_table(filter_table(df, filter_query), sort_by)
+    return table_page(df, page_current or 0, page_size)
+
+
+@app.callback(
+    Output("srametadata-datatable", "page_current"),
+    [Input("project-store", "data"), Input("srametadata-datatable", "filter_query")],
+)
+def reset_datatable_page(project, filter_query):
+    get_project_selection(project)
+    return 0
 
 
 @app.callback(Output("srp", "options"), [Input("assembly", "value")])
@@ -346,49 +579,117 @@ def update_srp_value(srp):
         return []
 
 
+@app.callback(Output("read_length", "options"), [Input("project-store", "data")])
+def generate_read_length_dropdown(project):
+    get_project_selection(project)
+    return project["read_lengths"]
+
+
 @app.callback(
-    Output("read_length", "options"),
-    [Input("srp", "value"), Input("assembly", "value")],
+    [Output("sample-page", "options"), Output("sample-page", "value")],
+    [Input("project-store", "data"), Input("samples-per-page", "value")],
 )
-def generate_read_length_dropdown(srp, assembly):
-    if isinstance(assembly, dict):
-        assembly = assembly["value"]
-    if isinstance(srp, dict):
-        srp = srp["value"]
-    options = get_srp_read_lengths(__DATASETS__, srp)
-    return options
+def update_page_dropdown(project, samples_per_page):
+    get_project_selection(project)
+    pages = page_count(project["n_samples"], samples_per_page)
+    options = [
+        {"label": "{} of {}".format(page, pages), "value": page}
+        for page in range(1, pages + 1)
+    ]
+    return options, 1
 
 
 @app.callback(
+    [
+        Output("metagene-store", "data"),
+        Output("metagene-job", "data"),
+        Output("metagene-interval", "disabled"),
+        Output("metagene-progress", "children"),
+    ],
+    [Input("sample-page", "value"), Input("metagene-interval", "n_intervals")],
+    # Changes of these reset sample-page, which triggers this
+    [
+        State("project-store", "data"),
+        State("samples-per-page", "value"),
+        State("metagene-job", "data"),
+    ],
+)
+def load_metagene_matrix(page, n_intervals, project, samples_per_page, job):
+    srp, assembly = get_project_selection(project)
+    return run_figure_job(
+        "metagene_matrix",
+        [srp, assembly, page, samples_per_page],
+        metagene_plot_files(srp, assembly),
+        render_metagene_matrix,
+        job,
+    )
+
+
+# Fragment length and normalization changes are drawn in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace="ribopod", function_name="renderMetagene"),
     Output("metagene-plot", "figure"),
     [
-        Input("srp", "value"),
-        Input("assembly", "value"),
+        Input("metagene-store", "data"),
         Input("normalize-chk", "value"),
         Input("read_length", "value"),
     ],
 )
-def display_metagene_plot(srp, assembly, normalize, length):  # gene_name, n_clicks):
-    if isinstance(srp, dict):
-        srp = srp["value"]
+
+
+def metagene_plot_files(srp, assembly):
     project_summary_file = get_project_summary_file(__DATASETS__, srp, assembly)
-    metagene_dfs = project_summary_metagene_creator(project_summary_file)
-    return plot_metagene_coverage(metagene_dfs, length, normalize_per_codon=normalize)
+    return [project_summary_file] + get_project_metagene_paths(project_summary_file)
+
+
+def render_metagene_matrix(srp, assembly, page, samples_per_page):
+    project_summary_file = get_project_summary_file(__DATASETS__, srp, assembly)
+    metagene_dfs = get_project_metagene_page(
+        project_summary_file, page, samples_per_page
+    )
+    return metagene_coverage_payload(metagene_dfs)
 
 
 @app.callback(
     Output("length-dist-plot", "figure"),
-    [Input("srp", "value"), Input("assembly", "value")],
+    [Input("sample-page", "value")],
+    [State("project-store", "data"), State("samples-per-page", "value")],
 )
-def display_read_length_dist_plot(srp, assembly):
-    if isinstance(srp, dict):
-        srp = srp["value"]
-    if isinstance(assembly, dict):
-        assembly = assembly["value"]
-    project_summary_file = get_project_summary_file(__DATASETS__, srp, assembly)
-    read_length_dist = project_summary_read_length_creator(project_summary_file)
+def display_read_length_dist_plot(page, project, samples_per_page):
+    srp, assembly = get_project_selection(project)
+    return get_cached_figure(
+        "read_length",
+        [srp, assembly, page, samples_per_page],
+        read_length_dist_plot_files(srp, assembly),
+        render_read_length_dist_plot,
+    )
+
+
+def read_length_dist_plot_files(srp, assembly):
+    dataset = __DATASETS__.get(assembly, srp)
+    file_paths = [dataset.read_length_matrix, dataset.project_metadata_path]
+    if dataset.read_length_matrix is None:
+        file_paths += get_project_bam_summary_paths(dataset.project_metadata_path)
+    return file_paths
+
+
+def render_read_length_dist_plot(srp, assembly, page, samples_per_page):
+    dataset = __DATASETS__.get(assembly, srp)
+    read_length_df = get_precomputed_matrix(
+        "read_length_matrix",
+        dataset.project_metadata_path,
+        dataset.read_length_matrix,
+        read_read_length_matrix,
+    )
+    if read_length_df is None:
+        read_length_df = get_project_read_length_matrix(dataset.project_metadata_path)
+    read_length_df = read_length_df.loc[
+        paginate(read_length_df.index, page, samples_per_page)
+    ]
     return plot_read_length_distribution(
-        read_length_dist, shared_yaxes=False, plot_ridge=False
+        matrix_to_read_length_distributions(read_length_df),
+        shared_yaxes=False,
+        plot_ridge=False,
     )
 
 
@@ -401,32 +702,105 @@ def serve_static():
     )
 
 
+def admin_only(view):
+    """Answer 403 unless the request comes from this machine or has ADMIN_TOKEN."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request = flask.request
+        token = request.headers.get("X-Ribopod-Token", "")
+        if ADMIN_TOKEN and hmac.compare_digest(
+            token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")
+        ):
+            return view(*args, **kwargs)
+        # A reverse proxy on this machine connects from localhost too
+        if (
+            request.remote_addr in ["127.0.0.1", "::1"]
+            and "X-Forwarded-For" not in request.headers
+        ):
+            return view(*args, **kwargs)
+        flask.abort(403)
+
+    return wrapper
+
+
+@app.server.route("/cache-stats")
+@admin_only
+def serve_cache_stats():
+    return flask.jsonify(cache_stats())
+
+
+@app.server.route("/reload-datasets", methods=["POST"])
+@admin_only
+def reload_datasets():
+    changed = __DATASETS__.reload()
+    return flask.jsonify(
+        projects=len(__DATASETS__.records),
+        changed=["{}/{}".format(record.species, record.srp) for record in changed],
+    )
+
+
 @app.callback(
-    Output("coherence-heatmap", "figure"),
-    [Input("srp", "value"), Input("assembly", "value")],
+    [
+        Output("coherence-heatmap", "figure"),
+        Output("coherence-job", "data"),
+        Output("coherence-interval", "disabled"),
+        Output("coherence-progress", "children"),
+    ],
+    [Input("project-store", "data"), Input("coherence-interval", "n_intervals")],
+    [State("coherence-job", "data")],
     # [State("gene-input", "value")],
     # [Input("gene-submit", "n_clicks")],
 )
-def display_coherence_plot(srp, assembly):  # , state, n_clicks):
-    if isinstance(srp, dict):
-        srp = srp["value"]
-    if isinstance(assembly, dict):
-        assembly = assembly["value"]
-    project_summary_file = get_project_summary_file(__DATASETS__, srp, assembly)
-    metagene_dfs = project_summary_metagene_creator(project_summary_file)
-    phase_score_df = metagene_profile_to_phase_score_matrix(metagene_dfs)
+def display_coherence_plot(project, n_intervals, job):  # , state, n_clicks):
+    srp, assembly = get_project_selection(project)
+    return run_figure_job(
+        "coherence",
+        [srp, assembly],
+        coherence_plot_files(srp, assembly),
+        render_coherence_plot,
+        job,
+    )
+
+
+def coherence_plot_files(srp, assembly):
+    dataset = __DATASETS__.get(assembly, srp)
+    file_paths = [dataset.phase_score_matrix, dataset.project_metadata_path]
+    if dataset.phase_score_matrix is None:
+        file_paths += get_project_metagene_paths(dataset.project_metadata_path)
+    return file_paths
+
+
+def render_coherence_plot(srp, assembly):
+    dataset = __DATASETS__.get(assembly, srp)
+    phase_score_df = get_precomputed_matrix(
+        "phase_score_matrix",
+        dataset.project_metadata_path,
+        dataset.phase_score_matrix,
+        read_phase_score_matrix,
+    )
+    if phase_score_df is None:
+        metagene_dfs = get_project_metagenes(dataset.project_metadata_path)
+        phase_score_df = metagene_profile_to_phase_score_matrix(metagene_dfs)
     return plot_phase_score_heatmap(phase_score_df)
 
 
-@app.callback(
-    Output("orf-count-dist-plot", "figure"),
-    [Input("srp", "value"), Input("assembly", "value")],
-)
-def display_orf_count_dist_plot(srp, assembly):  # , state, n_clicks):
-    if isinstance(srp, dict):
-        srp = srp["value"]
-    if isinstance(assembly, dict):
-        assembly = assembly["value"]
+@app.callback(Output("orf-count-dist-plot", "figure"), [Input("project-store", "data")])
+def display_orf_count_dist_plot(project):  # , state, n_clicks):
+    srp, assembly = get_project_selection(project)
+    return get_cached_figure(
+        "orf_count",
+        [srp, assembly],
+        orf_count_dist_plot_files(srp, assembly),
+        render_orf_count_dist_plot,
+    )
+
+
+def orf_count_dist_plot_files(srp, assembly):
+    return [__DATASETS__.get(assembly, srp).summarized_orfs]
+
+
+def render_orf_count_dist_plot(srp, assembly):
     # get_summarized_phase_scores,
     orf_df = get_summarized_orf_counts(__DATASETS__, srp, assembly)
     if orf_df is not None:
@@ -434,15 +808,50 @@ def display_orf_count_dist_plot(srp, assembly):  # , state, n_clicks):
 
 
 @app.callback(
-    Output("phase-score-dist-plot", "figure"),
-    [Input("srp", "value"), Input("assembly", "value")],
+    Output("phase-score-dist-plot", "figure"), [Input("project-store", "data")]
 )
-def display_phase_score_dist_plot(srp, assembly):  # , state, n_clicks):
-    if isinstance(srp, dict):
-        srp = srp["value"]
-    if isinstance(assembly, dict):
-        assembly = assembly["value"]
+def display_phase_score_dist_plot(project):  # , state, n_clicks):
+    srp, assembly = get_project_selection(project)
+    return get_cached_figure(
+        "phase_score",
+        [srp, assembly],
+        phase_score_dist_plot_files(srp, assembly),
+        render_phase_score_dist_plot,
+    )
+
+
+def phase_score_dist_plot_files(srp, assembly):
+    return [__DATASETS__.get(assembly, srp).summarized_phase_scores]
+
+
+def render_phase_score_dist_plot(srp, assembly):
     # get_summarized_phase_scores,
     phase_scores_df = get_summarized_phase_scores(__DATASETS__, srp, assembly)
     if phase_scores_df is not None:
-        return plot_phase_scores_violin(phase_scores_df)
+        return plot_phase_scores_violin(phase_scores_df, mode="density")
+
+
+# Figures written by scripts/prerender_figures.py as name: (render function,
+# files function, input values after srp and assembly in the default view)
+PRERENDERED_FIGURES = OrderedDict(
+    [
+        ("coherence", (render_coherence_plot, coherence_plot_files, [])),
+        ("orf_count", (render_orf_count_dist_plot, orf_count_dist_plot_files, [])),
+        (
+            "phase_score",
+            (render_phase_score_dist_plot, phase_score_dist_plot_files, []),
+        ),
+        (
+            "read_length",
+            (
+                render_read_length_dist_plot,
+                read_length_dist_plot_files,
+                [1, __SAMPLES_PER_PAGE__],
+            ),
+        ),
+        (
+            "metagene_matrix",
+            (render_metagene_matrix, metagene_plot_files, [1, __SAMPLES_PER_PAGE__]),
+        ),
+    ]
+)
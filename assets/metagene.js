@@ -0,0 +1,92 @@
+/*
+ * Clientside rendering of the metagene plot.
+ *
+ * load_metagene_matrix sends the coverage of the samples on the current
+ * page once (metagene_helper.metagene_coverage_payload). Switching the
+ * fragment length or codon level normalization redraws the figure here
+ * without a round trip to the server.
+ */
+(function() {
+    var decoded = {payload: null, coverage: null};
+
+    function decodeFloat32(data) {
+        var binary = window.atob(data);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new Float32Array(bytes.buffer);
+    }
+
+    function getCoverage(payload) {
+        // Decoded once per payload, not on every toggle
+        if (decoded.payload !== payload) {
+            decoded.payload = payload;
+            decoded.coverage = decodeFloat32(payload.coverage);
+        }
+        return decoded.coverage;
+    }
+
+    // Same as metagene_helper.normalize_codon_matrix for one profile
+    function normalizeCodons(values) {
+        for (var i = 0; i < values.length; i += 3) {
+            var first = values[i];
+            if (first === 0) {
+                continue;
+            }
+            for (var j = i + 1; j < Math.min(i + 3, values.length); j++) {
+                values[j] = values[j] / first;
+            }
+            values[i] = 1.0;
+        }
+        return values;
+    }
+
+    function renderMetagene(payload, normalize, fragmentLength) {
+        if (!payload) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var coverage = getCoverage(payload);
+        var positions = payload.positions;
+        var nPositions = positions.length;
+        var nLengths = payload.fragment_lengths.length;
+        var lengthIndex = payload.fragment_lengths.indexOf(Number(fragmentLength));
+        var data = [];
+        for (var s = 0; s < payload.subplot_axes.length; s++) {
+            if (lengthIndex < 0 || !payload.available[s][lengthIndex]) {
+                continue;
+            }
+            var offset = (s * nLengths + lengthIndex) * nPositions;
+            var values = Array.prototype.slice.call(
+                coverage.subarray(offset, offset + nPositions)
+            );
+            if (normalize && normalize.length) {
+                values = normalizeCodons(values);
+            }
+            for (var frame = 0; frame < 3; frame++) {
+                var x = [];
+                var y = [];
+                for (var p = 0; p < nPositions; p++) {
+                    if ((positions[p] % 3 + 3) % 3 === frame) {
+                        x.push(positions[p]);
+                        y.push(isNaN(values[p]) ? null : values[p]);
+                    }
+                }
+                data.push({
+                    type: "bar",
+                    x: x,
+                    y: y,
+                    name: "Frame " + frame,
+                    marker: {color: payload.frame_colors[frame]},
+                    xaxis: payload.subplot_axes[s][0],
+                    yaxis: payload.subplot_axes[s][1]
+                });
+            }
+        }
+        // A new layout object so that the graph redraws
+        return {data: data, layout: JSON.parse(JSON.stringify(payload.layout))};
+    }
+
+    window.dash_clientside = window.dash_clientside || {};
+    window.dash_clientside.ribopod = {renderMetagene: renderMetagene};
+})();
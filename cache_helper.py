@@ -0,0 +1,998 @@
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+from fragment_length_helper import (
+    get_project_bam_summary_files,
+    load_read_length_matrix,
+)
+from metagene_helper import (
+    get_project_metagene_files,
+    load_metagene_profiles,
+    PackedMetageneProfiles,
+    pack_metagene_profiles,
+)
+from job_helper import report_progress
+from plot_helper import __SAMPLES_PER_PAGE__, paginate
+
+# Memory budget for parsed projects held by each server process
+__PROJECT_CACHE_MAX_BYTES__ = (
+    int(os.environ.get("RIBOPOD_PROJECT_CACHE_MB", 1024)) * 1024 * 1024
+)
+# Memory budget for serialized figures held by each server process
+__FIGURE_CACHE_MAX_BYTES__ = (
+    int(os.environ.get("RIBOPOD_FIGURE_CACHE_MB", 256)) * 1024 * 1024
+)
+# Memory budget for project matrices shared by all server processes,
+# 0 keeps them in each process
+__SHARED_CACHE_MAX_BYTES__ = (
+    int(os.environ.get("RIBOPOD_SHARED_CACHE_MB", 2048)) * 1024 * 1024
+)
+# Files of the shared project matrices, on tmpfs so that they are held
+# in memory once for all processes
+__SHARED_DIR__ = os.environ.get(
+    "RIBOPOD_SHARED_DIR",
+    (
+        "/dev/shm/ribopod"
+        if os.path.isdir("/dev/shm")
+        else os.path.join(tempfile.gettempdir(), "ribopod-shared")
+    ),
+)
+# Figures rendered ahead of time by scripts/prerender_figures.py
+__FIGURE_DIR__ = os.environ.get(
+    "RIBOPOD_FIGURE_DIR", "/data2/re-ribo-analysis-metadata/figures"
+)
+
+
+def estimate_nbytes(value):
+    """Estimate memory held by a cached value.
+
+    Parameters
+    ----------
+    value: object
+           dict/list of DataFrames, Series or arrays
+
+    Returns
+    -------
+    nbytes: int
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        # Recurses into the Series held in the metagene profile column
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, (np.ndarray, PackedMetageneProfiles)):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def file_signature(file_paths):
+    """Get modification times of a list of files.
+
+    Parameters
+    ----------
+    file_paths: list
+                List of file paths, missing files are allowed
+
+    Returns
+    -------
+    signature: tuple
+               Tuple of (path, mtime) with mtime as None for missing files
+    """
+    signature = []
+    for file_path in file_paths:
+        try:
+            mtime = os.path.getmtime(file_path)
+        except (OSError, TypeError, ValueError):
+            mtime = None
+        signature.append((file_path, mtime))
+    return tuple(signature)
+
+
+def prerendered_figure_path(name, args):
+    """Location of a figure rendered by prerender_figure.
+
+    Each set of input values gets its own file, so that figures of
+    different pages of a project do not replace each other.
+
+    Parameters
+    ----------
+    name: string
+          Name of the callback
+    args: list
+          Input values of the callback, starting with srp and species
+    """
+    key = json.dumps(args, sort_keys=True, default=str)
+    return os.path.join(
+        __FIGURE_DIR__,
+        args[1],
+        args[0],
+        "{}-{}.json".format(name, hashlib.sha1(key.encode("utf-8")).hexdigest()),
+    )
+
+
+def write_prerendered_figure(file_path, key, signature, figure_json):
+    """Write a serialized figure along with what it was rendered from.
+
+    The file is written to a temporary file first and renamed so
+    that a running server never reads a partially written figure.
+
+    Parameters
+    ----------
+    file_path: string
+               Path as returned by prerendered_figure_path
+    key: string
+         Serialized input values of the callback
+    signature: tuple
+               file_signature of the files the figure is drawn from
+    figure_json: string
+                 Figure serialized with PlotlyJSONEncoder
+    """
+    dirname = os.path.dirname(file_path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    with os.fdopen(fd, "w") as fh:
+        fh.write(
+            '{{"key": {}, "signature": {}, "figure": {}}}'.format(
+                json.dumps(key), json.dumps(signature), figure_json
+            )
+        )
+    os.replace(tmp_path, file_path)
+
+
+def read_prerendered_figure(file_path, key, signature):
+    """Read a prerendered figure if it is still fresh.
+
+    Parameters
+    ----------
+    file_path: string
+               Path as returned by prerendered_figure_path
+    key: string
+         Serialized input values of the callback
+    signature: tuple
+               Current file_signature of the files the figure is drawn from
+
+    Returns
+    -------
+    figure: dict
+            None if the file is missing, was rendered for other input
+            values or any of its files changed since
+    """
+    try:
+        with open(file_path) as fh:
+            entry = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if entry.get("key") != key:
+        return None
+    if [tuple(item) for item in entry.get("signature", [])] != list(signature):
+        return None
+    return entry["figure"]
+
+
+class LRUCache(object):
+    """Thread-safe least recently used cache with a memory budget.
+
+    Parameters
+    ----------
+    max_bytes: int
+               Entries are evicted, least recently used first,
+               once their estimated size exceeds this
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Get value for key, None if it is not cached."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def count_stale(self):
+        """Count the last get as stale rather than a hit.
+
+        For subclasses that find a returned entry out of date.
+        """
+        with self._lock:
+            self.hits -= 1
+            self.stale += 1
+
+    def put(self, key, value, nbytes=None):
+        """Cache value under key, evicting entries to stay within budget."""
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def pop(self, key):
+        """Remove key from the cache."""
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def stats(self):
+        """Summary of cache usage."""
+        return {
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
+
+
+class SharedMatrixStore(object):
+    """Project matrices in .npy files memory mapped by all server processes.
+
+    Each entry is a set of arrays plus JSON metadata, keyed by the kind
+    of data and the project summary file like ProjectCache. Processes
+    map the arrays read-only, so on tmpfs an entry is held in memory
+    once however many processes use it. Entries are only served while
+    the files they were built from are unchanged, and the least
+    recently used ones are removed once the files exceed max_bytes.
+
+    Arrays are written under a new name every time and the metadata
+    file pointing to them is replaced atomically, so a process never
+    maps a partially written entry. Removed files stay readable by
+    processes that still have them mapped.
+
+    Parameters
+    ----------
+    store_dir: string
+               Directory holding the files, ideally on tmpfs
+    max_bytes: int
+               Size of all entries, as used on tmpfs
+    """
+
+    def __init__(self, store_dir, max_bytes):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _entry_id(self, kind, project_summary_file):
+        return hashlib.sha1(
+            json.dumps([kind, project_summary_file]).encode("utf-8")
+        ).hexdigest()
+
+    def _meta_path(self, entry_id):
+        return os.path.join(self.store_dir, "{}.json".format(entry_id))
+
+    def _array_files(self):
+        """Map entry id to the array files of the directory."""
+        array_files = {}
+        try:
+            names = os.listdir(self.store_dir)
+        except OSError:
+            return array_files
+        for name in names:
+            if name.endswith(".npy"):
+                array_files.setdefault(name.split(".")[0], []).append(name)
+        return array_files
+
+    def _read_meta(self, meta_path):
+        try:
+            with open(meta_path) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, kind, project_summary_file):
+        """Map the arrays of an entry.
+
+        Returns
+        -------
+        entry: tuple
+               arrays, meta, signature and the path of one of the
+               array files, which is removed once the entry is
+               replaced or evicted. None if there is no fresh entry.
+        """
+        meta_path = self._meta_path(self._entry_id(kind, project_summary_file))
+        entry = self._read_meta(meta_path)
+        if entry is None:
+            return None
+        signature = tuple(tuple(item) for item in entry["signature"])
+        if file_signature([path for path, _ in signature]) != signature:
+            self.stale += 1
+            return None
+        arrays = OrderedDict()
+        try:
+            for name, file_name in entry["arrays"].items():
+                file_path = os.path.join(self.store_dir, file_name)
+                try:
+                    arrays[name] = np.load(file_path, mmap_mode="r")
+                except ValueError:
+                    # Empty arrays can not be mapped
+                    arrays[name] = np.load(file_path)
+            # Recently used entries are evicted last
+            os.utime(meta_path)
+        except OSError:
+            # Replaced or evicted meanwhile
+            return None
+        return arrays, entry["meta"], signature, file_path
+
+    @contextmanager
+    def lock(self, kind, project_summary_file):
+        """Hold an exclusive lock on an entry across processes.
+
+        Taken while loading an entry so that processes missing it at
+        the same time wait for the first one instead of all parsing it.
+        """
+        lock_path = os.path.join(
+            self.store_dir,
+            "{}.lock".format(self._entry_id(kind, project_summary_file)),
+        )
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            fh = open(lock_path, "a")
+        except OSError:
+            # put fails as well, every process loads on its own
+            yield
+            return
+        with fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def get_or_load(self, kind, project_summary_file, load):
+        """Map an entry, creating it with load if there is no fresh one.
+
+        Parameters
+        ----------
+        kind: string
+        project_summary_file: string
+        load: function
+              Returns arrays, meta and signature as passed to put
+
+        Returns
+        -------
+        entry: tuple
+               As returned by get, None if the loaded entry could not
+               be stored
+        """
+        entry = self.get(kind, project_summary_file)
+        if entry is None:
+            with self.lock(kind, project_summary_file):
+                # Loaded by another process while waiting for the lock
+                entry = self.get(kind, project_summary_file)
+                if entry is None:
+                    self.misses += 1
+                    self.put(kind, project_summary_file, *load())
+                    return self.get(kind, project_summary_file)
+        self.hits += 1
+        return entry
+
+    def put(self, kind, project_summary_file, arrays, meta, signature):
+        """Write an entry, replacing the previous one.
+
+        Parameters
+        ----------
+        kind: string
+        project_summary_file: string
+        arrays: dict
+                Name to np.ndarray, without object dtypes
+        meta: dict
+              Anything JSON serializable
+        signature: tuple
+                   file_signature of the files the arrays are built from
+
+        Returns
+        -------
+        stored: bool
+                False if the entry is larger than max_bytes or could
+                not be written
+        """
+        if sum(array.nbytes for array in arrays.values()) > self.max_bytes:
+            return False
+        entry_id = self._entry_id(kind, project_summary_file)
+        version = uuid.uuid4().hex
+        array_files = OrderedDict(
+            (name, "{}.{}.{}.npy".format(entry_id, version, name)) for name in arrays
+        )
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            for name, array in arrays.items():
+                np.save(os.path.join(self.store_dir, array_files[name]), array)
+            fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as fh:
+                json.dump(
+                    {
+                        "kind": kind,
+                        "project_summary_file": project_summary_file,
+                        "signature": signature,
+                        "arrays": array_files,
+                        "meta": meta,
+                    },
+                    fh,
+                )
+            os.replace(tmp_path, self._meta_path(entry_id))
+        except (OSError, TypeError, ValueError) as e:
+            # Out of space on tmpfs or meta not serializable
+            print("Unable to share {} of {}: {}".format(kind, project_summary_file, e))
+            for file_name in array_files.values():
+                self._remove(file_name)
+            return False
+        # Arrays of the replaced entry
+        for file_name in self._array_files().get(entry_id, []):
+            if file_name not in array_files.values():
+                self._remove(file_name)
+        self.evict()
+        return True
+
+    def _remove(self, file_name):
+        try:
+            os.remove(os.path.join(self.store_dir, file_name))
+        except OSError:
+            pass
+
+    def _remove_entry(self, entry_id, array_files):
+        self._remove("{}.json".format(entry_id))
+        for file_name in array_files:
+            self._remove(file_name)
+
+    def _entry_sizes(self):
+        """Map entry id to last use, bytes and array files of each entry."""
+        sizes = {}
+        for entry_id, file_names in self._array_files().items():
+            try:
+                used_at = os.path.getmtime(self._meta_path(entry_id))
+            except OSError:
+                # Being written or removed
+                continue
+            nbytes = 0
+            for file_name in file_names:
+                try:
+                    nbytes += os.path.getsize(os.path.join(self.store_dir, file_name))
+                except OSError:
+                    pass
+            sizes[entry_id] = (used_at, nbytes, file_names)
+        return sizes
+
+    def evict(self):
+        """Remove least recently used entries until within max_bytes."""
+        sizes = self._entry_sizes()
+        nbytes = sum(entry_nbytes for _, entry_nbytes, _ in sizes.values())
+        for entry_id, (_, entry_nbytes, file_names) in sorted(
+            sizes.items(), key=lambda item: item[1][0]
+        ):
+            if nbytes <= self.max_bytes:
+                break
+            self._remove_entry(entry_id, file_names)
+            nbytes -= entry_nbytes
+
+    def invalidate(self, project_summary_file):
+        """Remove all entries of a project."""
+        for entry_id, (_, _, file_names) in self._entry_sizes().items():
+            entry = self._read_meta(self._meta_path(entry_id))
+            if (
+                entry is not None
+                and entry["project_summary_file"] == project_summary_file
+            ):
+                self._remove_entry(entry_id, file_names)
+
+    def stats(self):
+        """Memory used by the entries of each project.
+
+        Sizes are those of the files, which on tmpfs are resident in
+        memory once for all processes.
+        """
+        projects = OrderedDict()
+        nbytes = 0
+        for entry_id, (_, entry_nbytes, _) in sorted(self._entry_sizes().items()):
+            entry = self._read_meta(self._meta_path(entry_id))
+            if entry is None:
+                continue
+            project = projects.setdefault(
+                entry["project_summary_file"], {"nbytes": 0, "kinds": OrderedDict()}
+            )
+            project["nbytes"] += entry_nbytes
+            project["kinds"][entry["kind"]] = entry_nbytes
+            nbytes += entry_nbytes
+        return {
+            "store_dir": self.store_dir,
+            "entries": sum(len(project["kinds"]) for project in projects.values()),
+            "nbytes": nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "projects": projects,
+        }
+
+
+class ProjectCache(LRUCache):
+    """Cache of parsed project files shared by all callbacks of a process.
+
+    Entries are keyed by the kind of data and the project summary file.
+    An entry is only served while the modification times of the summary
+    file and of every sample file it was built from are unchanged.
+
+    Kinds loaded with a codec are kept in shared_store as well, so a
+    project loaded by one process is mapped by the others instead of
+    being parsed again. Their local entries count towards max_bytes
+    as they keep the mapped arrays alive.
+
+    Parameters
+    ----------
+    max_bytes: int
+    shared_store: SharedMatrixStore
+                  Optional
+    """
+
+    def __init__(self, max_bytes, shared_store=None):
+        super(ProjectCache, self).__init__(max_bytes)
+        self.shared_store = shared_store
+
+    def get_or_load(self, kind, project_summary_file, loader, codec=None):
+        """Get parsed project data, loading it on a miss.
+
+        Parameters
+        ----------
+        kind: string
+              Name of the data being cached, e.g. 'metagene'
+        project_summary_file: string
+                              Path to project summary file
+        loader: function
+                Called with project_summary_file, returns a tuple of
+                the parsed data and the list of files it was read from
+        codec: tuple
+               Optional pair of functions converting the parsed data
+               to (arrays, meta) and back, to keep it in shared_store
+
+        Returns
+        -------
+        value: object
+               Parsed data as returned by loader
+        """
+        key = (kind, project_summary_file)
+        entry = self.get(key)
+        if entry is not None:
+            value, signature, shared_path = entry
+            if file_signature([path for path, _ in signature]) == signature and (
+                shared_path is None or os.path.exists(shared_path)
+            ):
+                return value
+            self.count_stale()
+        if codec is not None and self.shared_store is not None:
+            value, signature, shared_path = self._load_shared(
+                kind, project_summary_file, loader, codec
+            )
+        else:
+            signature = file_signature([project_summary_file])
+            value, file_paths = loader(project_summary_file)
+            signature += file_signature(file_paths)
+            shared_path = None
+        self.put(key, (value, signature, shared_path), estimate_nbytes(value))
+        return value
+
+    def _load_shared(self, kind, project_summary_file, loader, codec):
+        encode, decode = codec
+        loaded = []
+
+        def load():
+            signature = file_signature([project_summary_file])
+            value, file_paths = loader(project_summary_file)
+            signature += file_signature(file_paths)
+            loaded.append((value, signature))
+            return encode(value) + (signature,)
+
+        entry = self.shared_store.get_or_load(kind, project_summary_file, load)
+        if entry is None:
+            # Could not be shared, keep the parsed copy
+            value, signature = loaded[0]
+            return value, signature, None
+        # Mapped like in the other processes, so the parsed copy is freed
+        arrays, meta, signature, shared_path = entry
+        return decode(arrays, meta), signature, shared_path
+
+    def invalidate(self, project_summary_file):
+        """Drop all entries of a project."""
+        for key in self.keys():
+            if key[1] == project_summary_file:
+                self.pop(key)
+        if self.shared_store is not None:
+            self.shared_store.invalidate(project_summary_file)
+
+
+class FigureCache(LRUCache):
+    """Cache of figures returned by callbacks, stored as serialized JSON.
+
+    Entries are keyed by the callback name and its input values. An
+    entry is only served while the modification times of the files
+    the figure was drawn from are unchanged. On a miss, a fresh
+    prerendered figure is read from disk before rendering.
+    """
+
+    def __init__(self, max_bytes):
+        super(FigureCache, self).__init__(max_bytes)
+        self.prerendered = 0
+
+    def get_fresh(self, name, args, file_paths, prerendered_path=None):
+        """Get a figure without rendering it.
+
+        Parameters are the same as for get_or_render.
+
+        Returns
+        -------
+        figure: dict
+                None if neither the cache nor prerendered_path hold
+                a fresh figure
+        """
+        key = (name, json.dumps(args, sort_keys=True, default=str))
+        signature = file_signature(file_paths)
+        entry = self.get(key)
+        if entry is not None:
+            figure_json, entry_signature = entry
+            if entry_signature == signature:
+                return json.loads(figure_json)
+            self.count_stale()
+        if prerendered_path is not None:
+            figure = read_prerendered_figure(prerendered_path, key[1], signature)
+            if figure is not None:
+                self.prerendered += 1
+                figure_json = json.dumps(figure)
+                self.put(key, (figure_json, signature), len(figure_json))
+                return figure
+        return None
+
+    def get_or_render(self, name, args, file_paths, render, prerendered_path=None):
+        """Get a figure, rendering it on a miss.
+
+        Parameters
+        ----------
+        name: string
+              Name of the callback
+        args: list
+              Input values of the callback, render is called with these
+        file_paths: list
+                    Files the figure is drawn from
+        render: function
+                Returns the figure, or any other value Dash can serialize
+        prerendered_path: string
+                          Optional path of a prerendered figure
+
+        Returns
+        -------
+        figure: dict
+                Figure as deserialized JSON
+        """
+        figure = self.get_fresh(name, args, file_paths, prerendered_path)
+        if figure is not None:
+            return figure
+        key = (name, json.dumps(args, sort_keys=True, default=str))
+        # Taken before rendering so that files changing meanwhile make it stale
+        signature = file_signature(file_paths)
+        figure_json = json.dumps(render(*args), cls=PlotlyJSONEncoder)
+        self.put(key, (figure_json, signature), len(figure_json))
+        return json.loads(figure_json)
+
+    def stats(self):
+        stats = super(FigureCache, self).stats()
+        stats["prerendered"] = self.prerendered
+        return stats
+
+
+__SHARED_STORE__ = (
+    SharedMatrixStore(__SHARED_DIR__, __SHARED_CACHE_MAX_BYTES__)
+    if __SHARED_CACHE_MAX_BYTES__
+    else None
+)
+__PROJECT_CACHE__ = ProjectCache(__PROJECT_CACHE_MAX_BYTES__, __SHARED_STORE__)
+__FIGURE_CACHE__ = FigureCache(__FIGURE_CACHE_MAX_BYTES__)
+
+
+def _pack_matrix(matrix):
+    return (
+        {"values": matrix.values},
+        {
+            "index": matrix.index.tolist(),
+            "index_name": matrix.index.name,
+            "columns": matrix.columns.tolist(),
+        },
+    )
+
+
+def _unpack_matrix(arrays, meta):
+    return pd.DataFrame(
+        arrays["values"],
+        index=pd.Index(meta["index"], name=meta["index_name"]),
+        columns=meta["columns"],
+        copy=False,
+    )
+
+
+# Conversions of cached values to the arrays of SharedMatrixStore and back
+__METAGENE_CODEC__ = (pack_metagene_profiles, PackedMetageneProfiles)
+__MATRIX_CODEC__ = (_pack_matrix, _unpack_matrix)
+
+
+def _load_project_metagenes(project_summary_file):
+    metagene_files = get_project_metagene_files(project_summary_file)
+    return (
+        load_metagene_profiles(metagene_files, progress=report_progress),
+        list(metagene_files.values()),
+    )
+
+
+def _load_project_read_length_matrix(project_summary_file):
+    bam_summary_files = get_project_bam_summary_files(project_summary_file)
+    return (
+        load_read_length_matrix(bam_summary_files),
+        list(bam_summary_files.values()),
+    )
+
+
+def _load_matrix_file(project_summary_file, matrix_file, reader):
+    return reader(matrix_file), [matrix_file]
+
+
+def _load_project_table(project_summary_file):
+    return pd.read_csv(project_summary_file, sep="\t"), []
+
+
+def _load_project_metagene_page(project_summary_file, page, samples_per_page):
+    metagene_files = get_project_metagene_files(project_summary_file)
+    metagene_files = OrderedDict(
+        (sample_name, metagene_files[sample_name])
+        for sample_name in paginate(metagene_files, page, samples_per_page)
+    )
+    return (
+        load_metagene_profiles(metagene_files, progress=report_progress),
+        list(metagene_files.values()),
+    )
+
+
+def _load_project_metagene_files(project_summary_file):
+    return list(get_project_metagene_files(project_summary_file).values()), []
+
+
+def _load_project_bam_summary_files(project_summary_file):
+    return list(get_project_bam_summary_files(project_summary_file).values()), []
+
+
+def get_project_metagene_paths(project_summary_file):
+    """Cached list of metagene 5p profiles of a project."""
+    return __PROJECT_CACHE__.get_or_load(
+        "metagene_files", project_summary_file, _load_project_metagene_files
+    )
+
+
+def get_project_bam_summary_paths(project_summary_file):
+    """Cached list of bam_summary files of a project."""
+    return __PROJECT_CACHE__.get_or_load(
+        "bam_summary_files", project_summary_file, _load_project_bam_summary_files
+    )
+
+
+def get_project_metagenes(project_summary_file):
+    """Cached version of project_summary_metagene_creator.
+
+    Parameters
+    ----------
+    project_summary_file: string
+                          Path to project summary file
+
+    Returns
+    -------
+    metagene_dfs: dict
+                  Keys as sample name, value as df loaded through load_metagene_profile
+    """
+    return __PROJECT_CACHE__.get_or_load(
+        "metagene",
+        project_summary_file,
+        _load_project_metagenes,
+        codec=__METAGENE_CODEC__,
+    )
+
+
+def get_project_table(project_summary_file):
+    """Cached project summary table, see project_helper.get_srp_table."""
+    return __PROJECT_CACHE__.get_or_load(
+        "table", project_summary_file, _load_project_table
+    )
+
+
+def get_project_metagene_page(
+    project_summary_file, page=1, samples_per_page=__SAMPLES_PER_PAGE__
+):
+    """Cached metagene profiles of the samples shown on one page.
+
+    Only the profiles of those samples are loaded.
+
+    Parameters
+    ----------
+    project_summary_file: string
+                          Path to project summary file
+    page: int
+          Page number starting from 1
+    samples_per_page: int
+                      None or 0 to load all samples
+
+    Returns
+    -------
+    metagene_dfs: dict
+                  Keys as sample name, value as df loaded through load_metagene_profile
+    """
+    if not samples_per_page:
+        return get_project_metagenes(project_summary_file)
+    return __PROJECT_CACHE__.get_or_load(
+        "metagene_page_{}_{}".format(page, samples_per_page),
+        project_summary_file,
+        partial(
+            _load_project_metagene_page, page=page, samples_per_page=samples_per_page
+        ),
+        codec=__METAGENE_CODEC__,
+    )
+
+
+def get_project_read_length_matrix(project_summary_file):
+    """Cached read length matrix built from the bam_summary files of a project.
+
+    Parameters
+    ----------
+    project_summary_file: string
+                          Path to project summary file
+
+    Returns
+    -------
+    read_length_matrix: pd.DataFrame
+                        As returned by load_read_length_matrix
+    """
+    return __PROJECT_CACHE__.get_or_load(
+        "read_length",
+        project_summary_file,
+        _load_project_read_length_matrix,
+        codec=__MATRIX_CODEC__,
+    )
+
+
+def get_precomputed_matrix(kind, project_summary_file, matrix_file, reader):
+    """Cached matrix written for a project by create_project_summaries.py.
+
+    Parameters
+    ----------
+    kind: string
+          'phase_score_matrix' or 'read_length_matrix'
+    project_summary_file: string
+                          Path to project summary file
+    matrix_file: string
+                 Path to the matrix as listed in datasets.tsv
+    reader: function
+            Parses matrix_file into a DataFrame
+
+    Returns
+    -------
+    matrix: pd.DataFrame
+            None if the matrix was not created for the project
+    """
+    if matrix_file is None:
+        return None
+    try:
+        return __PROJECT_CACHE__.get_or_load(
+            kind,
+            project_summary_file,
+            partial(_load_matrix_file, matrix_file=matrix_file, reader=reader),
+            codec=__MATRIX_CODEC__,
+        )
+    except (OSError, ValueError):
+        return None
+
+
+def invalidate_projects(records):
+    """Drop cached data of projects whose datasets.tsv entry changed.
+
+    Parameters
+    ----------
+    records: list
+             DatasetRecords as passed to DatasetRegistry reload listeners
+    """
+    for record in records:
+        __PROJECT_CACHE__.invalidate(record.project_metadata_path)
+
+
+def get_cached_figure(name, args, file_paths, render):
+    """Memoized render(*args), see FigureCache.get_or_render.
+
+    args start with the srp and species of the project, which with
+    the other args locate figures written by prerender_figure.
+    """
+    return __FIGURE_CACHE__.get_or_render(
+        name,
+        args,
+        file_paths,
+        render,
+        prerendered_path=prerendered_figure_path(name, args),
+    )
+
+
+def get_fresh_figure(name, args, file_paths):
+    """Cached or prerendered figure, None if it has to be rendered."""
+    return __FIGURE_CACHE__.get_fresh(
+        name, args, file_paths, prerendered_path=prerendered_figure_path(name, args)
+    )
+
+
+def prerender_figure(name, args, file_paths, render, force=False):
+    """Render a figure to disk for get_cached_figure to serve.
+
+    Parameters
+    ----------
+    name: string
+          Name of the callback
+    args: list
+          Input values of the callback, starting with srp and species
+    file_paths: list
+                Files the figure is drawn from
+    render: function
+            Returns the figure
+    force: bool
+           Render even if the file on disk is still fresh
+
+    Returns
+    -------
+    rendered: bool
+              False if the existing figure was fresh and kept
+    """
+    key = json.dumps(args, sort_keys=True, default=str)
+    # Taken before rendering so that files changing meanwhile make it stale
+    signature = file_signature(file_paths)
+    file_path = prerendered_figure_path(name, args)
+    if not force and read_prerendered_figure(file_path, key, signature) is not None:
+        return False
+    figure_json = json.dumps(render(*args), cls=PlotlyJSONEncoder)
+    write_prerendered_figure(file_path, key, signature, figure_json)
+    return True
+
+
+def cache_stats():
+    """Usage of the project and figure caches of this process and of
+    the matrices shared by all processes."""
+    return {
+        "projects": __PROJECT_CACHE__.stats(),
+        "figures": __FIGURE_CACHE__.stats(),
+        "shared": __SHARED_STORE__.stats() if __SHARED_STORE__ is not None else None,
+    }
@@ -1,5 +1,10 @@
 import ntpath
-import dash_html_components as html
+import re
+from urllib.parse import quote
+
+import dash_table
+import numpy as np
+import pandas as pd
 
 
 def path_leaf(path):
@@ -8,68 +13,236 @@ def path_leaf(path):
     return tail or ntpath.basename(head)
 
 
-def generate_table(dataframe):
-    """Generate dash table for pandas dataframe.
+# Columns of the project metadata table
+__TABLE_COLUMNS__ = [
+    "experiment_accession",
+    "experiment_title",
+    "run_accession",
+    "ribotricer_orfs",
+    "ribotricer_metagene_5p",
+    "ribotricer_metagene_3p",
+    "ribotricer_metagene_plot",
+    "ribotricer_protocol",
+    "ribotricer_bam_summary",
+]
+# Columns holding paths served through /download
+__DOWNLOAD_COLUMNS__ = [
+    "ribotricer_orfs",
+    "ribotricer_metagene_5p",
+    "ribotricer_metagene_3p",
+    "ribotricer_metagene_plot",
+    "ribotricer_protocol",
+    "ribotricer_bam_summary",
+]
+__TABLE_PAGE_SIZE__ = 25
+# DataTable filter operators and the name filter_table knows them by
+__FILTER_OPERATORS__ = {
+    "ge": "ge",
+    ">=": "ge",
+    "le": "le",
+    "<=": "le",
+    "lt": "lt",
+    "<": "lt",
+    "gt": "gt",
+    ">": "gt",
+    "ne": "ne",
+    "!=": "ne",
+    "eq": "eq",
+    "=": "eq",
+    "contains": "contains",
+    "datestartswith": "datestartswith",
+}
+# One clause of a filter_query, '{column} operator value'
+__FILTER_PART__ = re.compile(r"^\{(?P<col>[^}]+)\}\s+(?P<op>\S+)\s+(?P<value>.*)$")
+
+
+def generate_datatable(table_id, page_size=__TABLE_PAGE_SIZE__):
+    """Generate an empty DataTable for project metadata.
+
+    Paging, sorting and filtering are all done by a callback on
+    the server, see filter_table, sort_table and table_page.
+
+    Parameters
+    ----------
+    table_id: string
+              id of the DataTable
+    page_size: int
+               Number of rows per page
+
+    Returns
+    -------
+    table: dash_table.DataTable
+    """
+    columns = []
+    for col in __TABLE_COLUMNS__:
+        column = {"name": col, "id": col}
+        if col in __DOWNLOAD_COLUMNS__:
+            column["presentation"] = "markdown"
+        columns.append(column)
+    return dash_table.DataTable(
+        id=table_id,
+        columns=columns,
+        data=[],
+        page_action="custom",
+        page_current=0,
+        page_size=page_size,
+        sort_action="custom",
+        sort_mode="multi",
+        sort_by=[],
+        filter_action="custom",
+        filter_query="",
+        style_table={"overflowX": "auto"},
+        style_cell={"textAlign": "left", "font-family": "Droid Serif"},
+        style_cell_conditional=[
+            {"if": {"column_id": col}, "textAlign": "center"}
+            for col in __DOWNLOAD_COLUMNS__
+        ],
+    )
+
+
+def split_filter_part(filter_part):
+    """Parse one clause of a DataTable filter_query.
+
+    Parameters
+    ----------
+    filter_part: string
+                 Clause such as '{run_accession} contains SRR1'
+
+    Returns
+    -------
+    column: string
+            None if the clause could not be parsed
+    operator: string
+    value: string or float
+    """
+    match = __FILTER_PART__.match(filter_part.strip())
+    if match is None or match.group("op") not in __FILTER_OPERATORS__:
+        return None, None, None
+    operator = __FILTER_OPERATORS__[match.group("op")]
+    value_part = match.group("value").strip()
+    if value_part and value_part[0] == value_part[-1] and value_part[0] in "'\"`":
+        value = value_part[1:-1].replace("\\" + value_part[0], value_part[0])
+    elif operator not in ["contains", "datestartswith"]:
+        # Comparisons are numeric where possible
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    else:
+        value = value_part
+    return match.group("col"), operator, value
+
+
+def filter_table(dataframe, filter_query):
+    """Apply a DataTable filter_query to a dataframe.
+
+    Parameters
+    ----------
+    dataframe: pandas.DataFrame
+    filter_query: string
+                  Clauses joined by ' && ', unparsable clauses are ignored
+
+    Returns
+    -------
+    dataframe: pandas.DataFrame
+    """
+    if not filter_query:
+        return dataframe
+    for filter_part in filter_query.split(" && "):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in dataframe.columns:
+            continue
+        column = dataframe[col_name]
+        if operator == "contains":
+            mask = column.astype(str).str.contains(str(filter_value), regex=False)
+        elif operator == "datestartswith":
+            mask = column.astype(str).str.startswith(str(filter_value))
+        elif isinstance(filter_value, float) and column.dtype.kind not in "if":
+            # Numeric filter on a text column, e.g. an accession
+            mask = _compare(
+                pd.to_numeric(column, errors="coerce"), operator, filter_value
+            )
+        else:
+            mask = _compare(column, operator, filter_value)
+        dataframe = dataframe.loc[mask.fillna(False).values]
+    return dataframe
+
+
+def _compare(column, operator, value):
+    if operator == "eq":
+        return column == value
+    if operator == "ne":
+        return column != value
+    if operator == "lt":
+        return column < value
+    if operator == "le":
+        return column <= value
+    if operator == "gt":
+        return column > value
+    return column >= value
+
+
+def sort_table(dataframe, sort_by):
+    """Sort a dataframe by DataTable sort_by.
+
+    Parameters
+    ----------
+    dataframe: pandas.DataFrame
+    sort_by: list
+             dicts with column_id and direction ('asc' or 'desc')
+
+    Returns
+    -------
+    dataframe: pandas.DataFrame
+    """
+    sort_by = [col for col in sort_by or [] if col["column_id"] in dataframe.columns]
+    if not sort_by:
+        return dataframe
+    return dataframe.sort_values(
+        [col["column_id"] for col in sort_by],
+        ascending=[col["direction"] == "asc" for col in sort_by],
+        kind="mergesort",
+        na_position="last",
+    )
+
+
+def table_page(dataframe, page_current=0, page_size=__TABLE_PAGE_SIZE__):
+    """Get the rows of a page as DataTable records.
+
+    Only the rows of the page are converted, with paths in
+    __DOWNLOAD_COLUMNS__ turned into markdown download links.
 
     Parameters
     ----------
     dataframe: pandas.DataFrame
+               Filtered and sorted table
+    page_current: int
+                  Page number starting from 0
+    page_size: int
+               Number of rows per page
 
     Returns
     -------
-    table: html.Table
+    records: list
+             List of dicts, one per row
+    page_count: int
+                Total number of pages
     """
-    rows = []
-    cols_to_retain = [
-        "experiment_accession",
-        "experiment_title",
-        "run_accession",
-        "ribotricer_orfs",
-        "ribotricer_metagene_5p",
-        "ribotricer_metagene_3p",
-        "ribotricer_metagene_plot",
-        "ribotricer_protocol",
-        "ribotricer_bam_summary",
-    ]
-    dataframe = dataframe.loc[:, cols_to_retain]
-    for i in range(len(dataframe)):
-        row = []
-        for col in dataframe.columns:
-            value = dataframe.iloc[i][col]
-            if (
-                col
-                in [
-                    "ribotricer_orfs",
-                    "ribotricer_metagene_5p",
-                    "ribotricer_metagene_3p",
-                    "ribotricer_metagene_plot",
-                    "ribotricer_protocol",
-                    "ribotricer_bam_summary",
-                ]
-                and str(value) != "nan"
-            ):
-                try:
-                    cell = html.Td(
-                        html.A(
-                            href="/download?value=" + value,
-                            children=[html.I(className="fa fa-download")],
-                        ),
-                        style={"text-align": "center"},
-                    )
-                except:
-                    print(value)
-            else:
-                cell = html.Td(children=value)
-            row.append(cell)
-        rows.append(html.Tr(row))
-    return html.Table(
-        # Header
-        [html.Tr([html.Th(col) for col in dataframe.columns])] + rows,
-        style={
-            "width": "100%",
-            "margin-right": "auto",
-            "margin-left": "10%",
-            "align": "center",
-            "display": "inline-block",
-        },
+    page_count = max(int(np.ceil(len(dataframe) / float(page_size))), 1)
+    start = page_current * page_size
+    page_df = (
+        dataframe.iloc[start : start + page_size]
+        .reindex(columns=__TABLE_COLUMNS__)
+        .astype(object)
     )
+    for col in __DOWNLOAD_COLUMNS__:
+        if col not in page_df.columns:
+            continue
+        paths = page_df[col]
+        links = [
+            "[download](/download?value={})".format(quote(str(path), safe="/"))
+            for path in paths
+        ]
+        page_df[col] = np.where(paths.notnull(), links, "")
+    page_df = page_df.where(page_df.notnull(), None)
+    return page_df.to_dict("records"), page_count
@@ -2,8 +2,8 @@ from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
-from plotly import subplots
-from plotly.graph_objs import Bar
+
+from plot_helper import subplot_grid_layout
 
 
 def parse_ribotricer_bam_summary(file_path):
@@ -58,8 +58,56 @@ def parse_ribotricer_bam_summary(file_path):
     return summary_dict, pd.Series(fragment_len_dist_dict).sort_index()
 
 
-def project_summary_read_length_creator(project_summary_file):
-    """Parse project summary file to prepare project for read length distribution analysis.
+def _read_bam_summary_length_counts(file_path):
+    with open(file_path) as fh:
+        _, _, length_dist = fh.read().partition("length dist:")
+    # Alternating fragment length and read count
+    values = np.array(length_dist.replace(":", " ").split(), dtype=np.int64)
+    values = values.reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+
+def matrix_to_read_length_distributions(read_length_matrix):
+    """Split a read length matrix into read length distributions of samples.
+
+    Parameters
+    ----------
+    read_length_matrix: pd.DataFrame
+                        As returned by load_read_length_matrix
+
+    Returns
+    -------
+    read_length_dist_dict: dict
+                           Keys as sample name, value as series of read counts
+                           indexed by fragment length
+    """
+    fragment_lengths = read_length_matrix.columns.values.astype(np.int64)
+    counts = read_length_matrix.values
+    read_length_dist_dict = OrderedDict()
+    for sample_name, sample_counts in zip(read_length_matrix.index, counts):
+        listed = ~np.isnan(sample_counts)
+        read_length_dist_dict[sample_name] = pd.Series(
+            sample_counts[listed].astype(np.int64), index=fragment_lengths[listed]
+        )
+    return read_length_dist_dict
+
+
+def write_read_length_matrix(read_length_matrix, file_path):
+    """Write a read length matrix as tsv."""
+    read_length_matrix.to_csv(
+        file_path, sep="\t", index_label="experiment_accession", float_format="%.0f"
+    )
+
+
+def read_read_length_matrix(file_path):
+    """Read a read length matrix written by write_read_length_matrix."""
+    read_length_matrix = pd.read_csv(file_path, sep="\t", index_col=0)
+    read_length_matrix.columns = read_length_matrix.columns.astype(int)
+    return read_length_matrix
+
+
+def get_project_bam_summary_files(project_summary_file):
+    """Get ribotricer bam_summary of each sample in a project.
 
     Parameters
     ----------
@@ -68,8 +116,8 @@ def project_summary_read_length_creator(project_summary_file):
 
     Returns
     -------
-    read_length_dist_dict: dict
-                           Keys as sample name, value as series returned by parse_ribotricer_bam_summary
+    bam_summary_files: dict
+                       Keys as sample name, value as path to bam_summary.txt
 
     """
     summary_df = (
@@ -84,16 +132,86 @@ def project_summary_read_length_creator(project_summary_file):
     # summary_df = summary_df.loc[
     #    summary_df.ribotricer_orfs == summary_df.ribotricer_orfs
     # ]
-    read_length_dist_dict = OrderedDict()
+    bam_summary_files = OrderedDict()
     for sample_name, row in summary_df.iterrows():
-        # Load the 5' tsv
-        if row.ribotricer_bam_summary:
-            _, read_length_dist_dict[sample_name] = parse_ribotricer_bam_summary(
-                row.ribotricer_bam_summary
-            )
+        bam_summary_files[sample_name] = row.ribotricer_bam_summary
+    return bam_summary_files
+
+
+def load_read_length_matrix(bam_summary_files):
+    """Load read length distributions of a list of samples as a matrix.
+
+    Parameters
+    ----------
+    bam_summary_files: dict
+                       Keys as sample name, value as path to bam_summary.txt
+
+    Returns
+    -------
+    read_length_matrix: pd.DataFrame
+                        Samples x fragment lengths, NaN where a sample has
+                        no reads of that length listed or no bam_summary
+
+    """
+    length_counts = []
+    for bam_summary_file in bam_summary_files.values():
+        if isinstance(bam_summary_file, str) and bam_summary_file:
+            length_counts.append(_read_bam_summary_length_counts(bam_summary_file))
         else:
-            read_length_dist_dict[sample_name] = pd.Series()
-    return read_length_dist_dict
+            length_counts.append((np.array([], dtype=np.int64), np.array([])))
+    fragment_lengths = np.unique(
+        np.concatenate(
+            [np.array([], dtype=np.int64)]
+            + [sample_lengths for sample_lengths, _ in length_counts]
+        )
+    )
+    read_length_matrix = np.full((len(length_counts), len(fragment_lengths)), np.nan)
+    for row, (sample_lengths, counts) in zip(read_length_matrix, length_counts):
+        row[np.searchsorted(fragment_lengths, sample_lengths)] = counts
+    return pd.DataFrame(
+        read_length_matrix,
+        index=list(bam_summary_files.keys()),
+        columns=fragment_lengths,
+    )
+
+
+def load_read_length_distributions(bam_summary_files):
+    """Load read length distributions of a list of samples.
+
+    Parameters
+    ----------
+    bam_summary_files: dict
+                       Keys as sample name, value as path to bam_summary.txt
+
+    Returns
+    -------
+    read_length_dist_dict: dict
+                           Keys as sample name, value as series returned by parse_ribotricer_bam_summary
+
+    """
+    # Goes through the matrix so this matches a precomputed read length matrix
+    return matrix_to_read_length_distributions(
+        load_read_length_matrix(bam_summary_files)
+    )
+
+
+def project_summary_read_length_creator(project_summary_file):
+    """Parse project summary file to prepare project for read length distribution analysis.
+
+    Parameters
+    ----------
+    project_summary_file: string
+                          Path to project summary file
+
+    Returns
+    -------
+    read_length_dist_dict: dict
+                           Keys as sample name, value as series returned by parse_ribotricer_bam_summary
+
+    """
+    return load_read_length_distributions(
+        get_project_bam_summary_files(project_summary_file)
+    )
 
 
 def plot_read_length_distribution(
@@ -107,74 +225,34 @@ def plot_read_length_distribution(
     read_lengths : dict
                        Keys as sample name, value as series of read lengths
     """
-    fig = subplots.make_subplots(
-        rows=int(np.ceil(len(list(read_lengths.keys())) / samples_per_row)),
-        cols=samples_per_row,
-        subplot_titles=list(read_lengths.keys()),
-        print_grid=False,
+    layout, subplot_axes = subplot_grid_layout(
+        list(read_lengths.keys()), samples_per_row
     )
 
-    index = 1
+    fig_data = []
     if plot_ridge:
         pass
         # df = pd.DataFrame(read_lengths)
         # fig = draw_ridge_plot(df)
 
     else:
-        for sample in list(read_lengths.keys()):
-            trace = Bar(
+        for sample, (xaxis, yaxis) in zip(list(read_lengths.keys()), subplot_axes):
+            trace = dict(
+                type="bar",
                 x=read_lengths[sample].index.tolist(),
                 y=read_lengths[sample].sort_index().values.tolist(),
                 name=sample,
+                xaxis=xaxis,
+                yaxis=yaxis,
             )
-            fig.append_trace(
-                trace,
-                (index - 1) // samples_per_row + 1,
-                (index - 1) % samples_per_row + 1,
-            )
-            index += 1
-    fig["layout"].update(
+            fig_data.append(trace)
+    layout.update(
         height=max(200 * len(list(read_lengths.keys())), 400),
-        title="Read length distribution",
+        title=dict(text="Read length distribution"),
         paper_bgcolor="rgba(0,0,0,0)",
         plot_bgcolor="rgba(0,0,0,0)",
-        yaxis=dict(showgrid=True, gridwidth=1, gridcolor="Gray"),
+        font=dict(family="Arial", size=18, color="#000000"),
+        showlegend=False,
     )
     # fig['layout'].update(scene=dict(aspectmode="data"))
-    fig["layout"].update(font=dict(family="Arial", size=18, color="#000000"))
-    fig["layout"].update(showlegend=False)
-    for i in range(1, index + 1):
-        row = (i - 1) // samples_per_row + 1
-        col = (i - 1) % samples_per_row + 1
-        fig.update_yaxes(
-            showgrid=True,
-            showline=True,
-            linewidth=2,
-            linecolor="black",
-            gridwidth=1,
-            gridcolor="Gray",
-            row=row,
-            col=col,
-            tickwidth=1,
-            ticklen=10,
-            ticks="outside",
-            tickcolor="black",
-        )
-    for i in range(1, index + 1):
-        row = (i - 1) // samples_per_row + 1
-        col = (i - 1) % samples_per_row + 1
-        fig.update_xaxes(
-            showgrid=False,
-            showline=True,
-            linewidth=2,
-            linecolor="black",
-            gridwidth=1,
-            gridcolor="Gray",
-            row=row,
-            col=col,
-            tickwidth=1,
-            ticklen=10,
-            ticks="outside",
-            tickcolor="black",
-        )
-    return fig
+    return {"data": fig_data, "layout": layout}
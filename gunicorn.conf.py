@@ -0,0 +1,43 @@
+"""gunicorn settings for wsgi:server.
+
+Every setting can be overridden by an environment variable:
+
+    RIBOPOD_BIND     address to listen on, default 0.0.0.0:8050
+    RIBOPOD_WORKERS  worker processes, default 2 * CPUs + 1
+    RIBOPOD_THREADS  threads per worker, default 4
+    RIBOPOD_TIMEOUT  seconds before a silent worker is restarted, default 120
+
+Project tables and figures are cached per worker process, so each
+worker adds up to RIBOPOD_PROJECT_CACHE_MB + RIBOPOD_FIGURE_CACHE_MB
+of memory on top of what it shares with the master. Metagene profiles
+and read length and phase score matrices are held once for all workers
+in RIBOPOD_SHARED_DIR, up to RIBOPOD_SHARED_CACHE_MB, see
+cache_helper.SharedMatrixStore.
+
+On its first background job, each worker also starts a forkserver and
+RIBOPOD_JOB_WORKERS job processes, see job_helper.JobRunner. These
+import the app themselves rather than sharing the preloaded pages, and
+took about 130 MB each on the test fixture.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("RIBOPOD_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("RIBOPOD_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# More than one thread switches the sync worker to gthread. Callbacks
+# mostly wait on disk or numpy, which release the GIL.
+threads = int(os.environ.get("RIBOPOD_THREADS", 4))
+# Heavy figures render in background jobs, so callbacks should not
+# come close to this
+timeout = int(os.environ.get("RIBOPOD_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Import wsgi.py, and with it datasets.tsv and the helper modules, in
+# the master so the workers share it. The background job pool is only
+# started on first use, inside the workers.
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
@@ -1,7 +1,213 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
 import pandas as pd
 
 __DATASET_PATH__ = "/data2/datasets.tsv"
-__DATASETS__ = pd.read_csv(__DATASET_PATH__, sep="\t").set_index("species")
+# Seconds between checks of datasets.tsv for changes
+__DATASET_RELOAD_INTERVAL__ = 5
+
+
+def _parse_fragment_lengths(fragment_lengths):
+    """Parse fragment lengths written as '[28, 29, 30]' to a list of ints."""
+    if not isinstance(fragment_lengths, str):
+        return []
+    fragment_lengths = fragment_lengths.strip("[] ")
+    return [int(length) for length in fragment_lengths.split(",") if length.strip()]
+
+
+class DatasetRecord(object):
+    """A single project of datasets.tsv.
+
+    Missing paths are stored as None and fragment_lengths as a list of ints.
+    """
+
+    __slots__ = (
+        "species",
+        "srp",
+        "project_output_path",
+        "project_metadata_path",
+        "fragment_lengths",
+        "summarized_orfs",
+        "summarized_phase_scores",
+        "phase_score_matrix",
+        "read_length_matrix",
+    )
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            value = row.get(field)
+            if value != value:
+                # NaN for missing files
+                value = None
+            setattr(self, field, value)
+        self.fragment_lengths = _parse_fragment_lengths(self.fragment_lengths)
+
+    def __eq__(self, other):
+        return isinstance(other, DatasetRecord) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(
+            tuple(
+                tuple(value) if isinstance(value, list) else value
+                for value in (getattr(self, field) for field in self.__slots__)
+            )
+        )
+
+    def __repr__(self):
+        return "DatasetRecord({}, {})".format(self.species, self.srp)
+
+
+def _index_datasets(datasets):
+    records = OrderedDict()
+    projects = OrderedDict()
+    for row in datasets.to_dict("records"):
+        record = DatasetRecord(row)
+        key = (record.species, record.srp)
+        if key in records:
+            continue
+        records[key] = record
+        projects.setdefault(record.species, []).append(
+            {"label": record.srp, "value": record.srp}
+        )
+    return records, projects
+
+
+class DatasetRegistry(object):
+    """Index of datasets.tsv that follows changes to the file.
+
+    The file's mtime is checked at most every reload_interval seconds.
+    When it changed, a new index is built and swapped in as a whole,
+    so lookups never see a partially loaded index.
+
+    Parameters
+    ----------
+    dataset_path: string
+                  Path to datasets.tsv
+    reload_interval: int
+                     Seconds between checks of datasets.tsv for changes
+    """
+
+    def __init__(self, dataset_path, reload_interval=__DATASET_RELOAD_INTERVAL__):
+        self.dataset_path = dataset_path
+        self.reload_interval = reload_interval
+        self._index = (OrderedDict(), OrderedDict())
+        self._mtime = None
+        self._checked_at = time.time()
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self.reload()
+
+    @property
+    def records(self):
+        self.reload_if_changed()
+        return self._index[0]
+
+    @property
+    def projects(self):
+        self.reload_if_changed()
+        return self._index[1]
+
+    def add_reload_listener(self, listener):
+        """Register a function called with the list of records that
+        changed or were removed whenever datasets.tsv is reloaded."""
+        self._listeners.append(listener)
+
+    def reload(self):
+        """Re-read datasets.tsv and swap in the new index.
+
+        Returns
+        -------
+        changed: list
+                 Records of the previous index that changed or were removed
+        """
+        with self._reload_lock:
+            mtime = os.path.getmtime(self.dataset_path)
+            records, projects = _index_datasets(
+                pd.read_csv(self.dataset_path, sep="\t")
+            )
+            previous_records = self._index[0]
+            self._index = (records, projects)
+            self._mtime = mtime
+        changed = [
+            record
+            for key, record in previous_records.items()
+            if records.get(key) != record
+        ]
+        for listener in self._listeners:
+            listener(changed)
+        return changed
+
+    def reload_if_changed(self):
+        """Reload datasets.tsv if it was modified since the last load.
+
+        Returns
+        -------
+        reloaded: bool
+        """
+        now = time.time()
+        if now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        try:
+            if os.path.getmtime(self.dataset_path) == self._mtime:
+                return False
+            self.reload()
+        except Exception as e:
+            # Keep serving the current index if the new file is unreadable
+            print("Unable to reload {}: {}".format(self.dataset_path, e))
+            return False
+        return True
+
+    def get(self, species, srp):
+        """Get record of a project.
+
+        Parameters
+        ----------
+        species: string
+        srp: string
+             SRP ID
+
+        Returns
+        -------
+        record: DatasetRecord
+        """
+        return self.records[(species, srp)]
+
+    def get_projects(self, species):
+        """Get dropdown options of projects available for a species."""
+        return self.projects.get(species, [])
+
+    def species_counts(self):
+        """Get number of projects per species."""
+        return OrderedDict(
+            (species, len(projects)) for species, projects in self.projects.items()
+        )
+
+
+def load_datasets(dataset_path=__DATASET_PATH__):
+    """Build dataset registry from datasets.tsv.
+
+    Parameters
+    ----------
+    dataset_path: string
+                  Path to datasets.tsv
+
+    Returns
+    -------
+    registry: DatasetRegistry
+    """
+    return DatasetRegistry(dataset_path)
+
+
+__DATASETS__ = load_datasets()
 __SPECIES__ = sorted(
     [
         {"label": "H.sapiens (human)", "value": "hg38"},
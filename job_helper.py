@@ -0,0 +1,274 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Status files of background jobs, shared by all server processes
+__JOB_DIR__ = os.environ.get(
+    "RIBOPOD_JOB_DIR", os.path.join(tempfile.gettempdir(), "ribopod-jobs")
+)
+# Processes rendering figures in the background per server process,
+# 0 renders in the callback itself. Each imports the app on its own,
+# so this is kept low as every gunicorn worker starts its own pool
+__JOB_WORKERS__ = int(os.environ.get("RIBOPOD_JOB_WORKERS", 1))
+# Status files older than this are removed
+__JOB_MAX_AGE__ = 24 * 60 * 60
+# Pending or running jobs without an update for this many seconds are
+# considered lost, e.g. because the process running them died
+__JOB_STALE_AFTER__ = int(os.environ.get("RIBOPOD_JOB_STALE_AFTER", 10 * 60))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it was cancelled."""
+
+
+class JobStore(object):
+    """Disk backed status, progress and cancellation flags of jobs.
+
+    Each job has a JSON status file, replaced atomically on every
+    update, and a cancel flag file, so that any process on the box
+    can follow or cancel a job without a broker.
+
+    Parameters
+    ----------
+    job_dir: string
+             Directory holding the status files
+    """
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+
+    def _status_path(self, job_id):
+        return os.path.join(self.job_dir, "{}.json".format(job_id))
+
+    def _cancel_path(self, job_id):
+        return os.path.join(self.job_dir, "{}.cancel".format(job_id))
+
+    def create(self, name):
+        """Register a new pending job.
+
+        Returns
+        -------
+        job_id: string
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        self.update(job_id, state=PENDING, name=name, done=0, total=0, message="")
+        return job_id
+
+    def update(self, job_id, **fields):
+        """Merge fields into the status of a job."""
+        status = self.status(job_id) or {"created_at": time.time()}
+        status.update(fields, updated_at=time.time())
+        fd, tmp_path = tempfile.mkstemp(dir=self.job_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(status, fh)
+        os.replace(tmp_path, self._status_path(job_id))
+
+    def status(self, job_id):
+        """Status of a job, None if it is unknown.
+
+        Returns
+        -------
+        status: dict
+                Keys state, name, done, total, message and timestamps
+        """
+        try:
+            with open(self._status_path(job_id)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self, job_id):
+        """Flag a job as cancelled, it stops at its next progress report."""
+        try:
+            open(self._cancel_path(job_id), "w").close()
+        except OSError:
+            pass
+
+    def is_cancelled(self, job_id):
+        return os.path.exists(self._cancel_path(job_id))
+
+    def is_stale(self, status, max_age=__JOB_STALE_AFTER__):
+        """Whether a pending or running job was not updated for max_age seconds."""
+        return (
+            status["state"] in [PENDING, RUNNING]
+            and time.time() - status["updated_at"] > max_age
+        )
+
+    def cleanup(self, max_age=__JOB_MAX_AGE__):
+        """Remove files of jobs last updated longer than max_age seconds ago."""
+        now = time.time()
+        try:
+            names = os.listdir(self.job_dir)
+        except OSError:
+            return
+        for name in names:
+            file_path = os.path.join(self.job_dir, name)
+            try:
+                if now - os.path.getmtime(file_path) > max_age:
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+
+__JOB_STORE__ = JobStore(__JOB_DIR__)
+# Job run by this process, set in pool workers only
+__CURRENT_JOB__ = threading.local()
+
+
+def report_progress(done, total, message=""):
+    """Report progress of the job running in this process.
+
+    A no-op outside of background jobs, so loaders can call it
+    unconditionally.
+
+    Raises
+    ------
+    JobCancelled
+        If the job was cancelled
+    """
+    job_id = getattr(__CURRENT_JOB__, "job_id", None)
+    if job_id is None:
+        return
+    if __JOB_STORE__.is_cancelled(job_id):
+        raise JobCancelled(job_id)
+    __JOB_STORE__.update(job_id, done=done, total=total, message=message)
+
+
+def _run_job(job_id, function, args):
+    if __JOB_STORE__.is_cancelled(job_id):
+        __JOB_STORE__.update(job_id, state=CANCELLED)
+        return
+    __JOB_STORE__.update(job_id, state=RUNNING)
+    __CURRENT_JOB__.job_id = job_id
+    try:
+        function(*args)
+    except JobCancelled:
+        __JOB_STORE__.update(job_id, state=CANCELLED)
+    except Exception as e:
+        traceback.print_exc()
+        __JOB_STORE__.update(job_id, state=FAILED, message=str(e))
+    else:
+        __JOB_STORE__.update(job_id, state=DONE)
+    finally:
+        __CURRENT_JOB__.job_id = None
+
+
+class JobRunner(object):
+    """Run functions in a local process pool and track them in a JobStore.
+
+    The pool is created on first use so that it is started after a
+    preloading server has forked its workers. Its processes are started
+    from a forkserver rather than forked from the server process, whose
+    other threads may hold locks, e.g. of the caches, at the time.
+
+    Parameters
+    ----------
+    store: JobStore
+    max_workers: int
+                 Number of processes of the pool
+    """
+
+    def __init__(self, store, max_workers):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _new_executor(self):
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            try:
+                return ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            except TypeError:
+                # mp_context is only accepted from Python 3.7 on
+                pass
+        return ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, name, function, args):
+        """Run function(*args) in the background.
+
+        function and args must be picklable. Whatever function returns
+        is discarded, it is expected to write its result to disk.
+
+        Returns
+        -------
+        job_id: string
+        """
+        job_id = self.store.create(name)
+        with self._lock:
+            if self._executor is None:
+                self.store.cleanup()
+                self._executor = self._new_executor()
+            try:
+                future = self._executor.submit(_run_job, job_id, function, args)
+            except BrokenProcessPool:
+                # A pool process died, e.g. killed for running out of
+                # memory, which leaves the pool unusable. Start a new one
+                self._executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+                future = self._executor.submit(_run_job, job_id, function, args)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda future: self._job_done(job_id, future))
+        return job_id
+
+    def _job_done(self, job_id, future):
+        self._futures.pop(job_id, None)
+        # _run_job records the outcome of the job itself, an exception
+        # here means it never ran to completion, e.g. its process died
+        if not future.cancelled() and future.exception() is not None:
+            self.store.update(job_id, state=FAILED, message=str(future.exception()))
+
+    def cancel(self, job_id):
+        """Cancel a job, dropping it from the queue if it did not start."""
+        self.store.cancel(job_id)
+        future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self.store.update(job_id, state=CANCELLED)
+
+    def status(self, job_id):
+        """Status of a job, see JobStore.status.
+
+        Jobs that stopped reporting are marked as failed.
+        """
+        status = self.store.status(job_id)
+        if status is not None and self.store.is_stale(status):
+            self.store.update(job_id, state=FAILED, message="job stopped responding")
+            status = self.store.status(job_id)
+        return status
+
+
+__JOB_RUNNER__ = JobRunner(__JOB_STORE__, __JOB_WORKERS__)
+
+
+def background_jobs_enabled():
+    return __JOB_WORKERS__ > 0
+
+
+def submit_job(name, function, args):
+    """Run function(*args) in the background, see JobRunner.submit."""
+    return __JOB_RUNNER__.submit(name, function, args)
+
+
+def cancel_job(job_id):
+    __JOB_RUNNER__.cancel(job_id)
+
+
+def job_status(job_id):
+    return __JOB_RUNNER__.status(job_id)
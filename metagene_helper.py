@@ -1,52 +1,88 @@
 from collections import OrderedDict
+from collections.abc import Mapping
+import base64
+import os
 
 import numpy as np
 import pandas as pd
-from plotly import subplots
-from plotly.graph_objs import Scatter, Bar  # , Heatmap Figure,
+
+from plot_helper import subplot_grid_layout
 
 import plotly.figure_factory as ff
 
 __FRAME_COLORS__ = ["#fc8d62", "#66c2a5", "#8da0cb"]
+# Binary store written next to each *_metagene_profiles_5p.tsv
+__METAGENE_PROFILE_SUFFIX__ = ".profile.npy"
+__METAGENE_INDEX_SUFFIX__ = ".index.npy"
+
+
+def normalize_codon_matrix(values):
+    """Normalize coverage to the first position of each codon.
+
+    Positions are grouped in codons starting at the first position.
+    Codons with a non-zero first position are divided by it, codons
+    starting with zero are left as they are. A trailing partial codon
+    is treated the same way.
+
+    Parameters
+    ----------
+    values: np.ndarray
+            Coverage with positions along the last axis, for example
+            a samples x fragment length x position matrix
+
+    Returns
+    -------
+    normalized_values: np.ndarray
+                       Array of the same shape as values
+    """
+    values = np.asarray(values, dtype=float)
+    length = values.shape[-1]
+    padding = -length % 3
+    if padding:
+        pad_width = [(0, 0)] * (values.ndim - 1) + [(0, padding)]
+        values = np.pad(values, pad_width, mode="constant", constant_values=np.nan)
+    codons = values.reshape(values.shape[:-1] + (-1, 3))
+    first = codons[..., :1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = np.where(first == 0, codons, codons / first)
+    normalized[..., 0] = np.where(first[..., 0] == 0, first[..., 0], 1.0)
+    return normalized.reshape(values.shape)[..., :length]
 
 
 def _normalize_profile_values(profile):
-    normalized_values = []
-    coverage_list = profile.values.tolist()
-    for i in np.arange(0, len(coverage_list), 3):
-        if i + 2 < len(coverage_list):
-            if coverage_list[i] == 0:
-                normalized_values += [
-                    coverage_list[i],
-                    coverage_list[i + 1],
-                    coverage_list[i + 2],
-                ]
-            else:
-                normalized_values += [
-                    1.0,
-                    coverage_list[i + 1] / coverage_list[i],
-                    coverage_list[i + 2] / coverage_list[i],
-                ]
-
-        elif i + 2 <= len(coverage_list):
-            if coverage_list[i] == 0:
-                normalized_values += [coverage_list[i], coverage_list[i + 1]]
-            else:
-                normalized_values += [1.0, coverage_list[i + 1] / coverage_list[i]]
-        elif i + 1 <= len(coverage_list):
-            if coverage_list[i] == 0:
-                normalized_values += [0]
-            else:
-                normalized_values += [1.0]
-        elif i <= len(coverage_list):
-            profile = pd.Series(normalized_values, index=profile.index.tolist())
-            break
-    normalized_profile = pd.Series(normalized_values, index=profile.index.tolist())
-    return normalized_profile
+    return pd.Series(normalize_codon_matrix(profile.values), index=profile.index)
+
+
+def _normalize_profiles(profiles):
+    """Codon level normalization of a list of profiles in one pass."""
+    lengths = [len(profile) for profile in profiles]
+    profile_matrix = np.full((len(profiles), max(lengths)), np.nan)
+    for i, profile in enumerate(profiles):
+        profile_matrix[i, : lengths[i]] = profile.values
+    profile_matrix = normalize_codon_matrix(profile_matrix)
+    return [
+        pd.Series(profile_matrix[i, : lengths[i]], index=profile.index)
+        for i, profile in enumerate(profiles)
+    ]
 
 
-def parse_metagene_profile(file_path):
-    """Parse metagene profile file
+def _profile_matrix_to_series(profile_matrix, offsets, lengths):
+    """Slice rows of an offset aligned profile matrix back into Series."""
+    max_offset = offsets.max() if len(offsets) else 0
+    return [
+        pd.Series(
+            profile_matrix[i, max_offset - offset_5p : max_offset - offset_5p + length],
+            index=range(-offset_5p, length - offset_5p),
+        )
+        for i, (offset_5p, length) in enumerate(zip(offsets, lengths))
+    ]
+
+
+def read_metagene_profile_matrix(file_path):
+    """Parse metagene profile file into a padded profile matrix.
+
+    The profile list literals are parsed in a single numpy pass
+    instead of evaluating each of them.
 
     Parameters
     ----------
@@ -55,28 +91,240 @@ def parse_metagene_profile(file_path):
 
     Returns
     -------
-    fragment_length_profile: dict
-                             An OrderedDict of
-
+    metagene_df: pd.DataFrame
+                 All columns except profile, indexed on fragment length
+    profile_matrix: np.ndarray
+                    fragment length x position matrix with rows aligned
+                    on offset_5p and padded with NaN
+    lengths: np.ndarray
+             Length of each profile
     """
     # fragment_length	offset_5p	profile	phase_score	valid_codons
-    # Set the index on fragment length for easy retrieval
-    metagene_df = pd.read_csv(file_path, sep="\t")
-    if len(metagene_df.columns) == 3:
-        # Re-read the tsv this time with no headers
+    with open(file_path) as fh:
+        has_header = fh.readline().startswith("fragment_length")
+    if has_header:
+        metagene_df = pd.read_csv(file_path, sep="\t")
+    else:
         # old ribotricer output came with no headers
         metagene_df = pd.read_csv(file_path, header=None, sep="\t")
         metagene_df.columns = ["fragment_length", "offset_5p", "profile"]
     metagene_df["fragment_length"] = metagene_df["fragment_length"].astype(int)
+    # Set the index on fragment length for easy retrieval
     metagene_df = metagene_df.set_index("fragment_length")
-    metagene_df["profile"] = [eval(profile) for profile in metagene_df.profile]
-    metagene_df["profile"] = [
-        pd.Series(profile, index=range(-offset_5p, len(profile) - offset_5p))
-        for offset_5p, profile in zip(metagene_df.offset_5p, metagene_df.profile)
+
+    profiles = [profile.strip("[] ") for profile in metagene_df.pop("profile")]
+    lengths = np.array(
+        [profile.count(",") + 1 if profile else 0 for profile in profiles], dtype=int
+    )
+    values = np.fromstring(
+        ",".join([profile for profile in profiles if profile]), sep=","
+    )
+    if len(values) != lengths.sum():
+        raise Exception("Unable to parse profiles in {}".format(file_path))
+
+    offsets = metagene_df.offset_5p.values.astype(int)
+    max_offset = offsets.max() if len(offsets) else 0
+    starts = max_offset - offsets
+    width = (starts + lengths).max() if len(offsets) else 0
+    profile_matrix = np.full((len(metagene_df), width), np.nan)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    # Position of each value within its own profile
+    positions = np.arange(len(values)) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    profile_matrix[rows, np.repeat(starts, lengths) + positions] = values
+    return metagene_df, profile_matrix, lengths
+
+
+def parse_metagene_profile(file_path):
+    """Parse metagene profile file
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    metagene_df: pd.DataFrame
+                 Indexed on fragment length with profile column
+                 holding a Series of coverage indexed by position
+
+    """
+    metagene_df, profile_matrix, lengths = read_metagene_profile_matrix(file_path)
+    profiles = _profile_matrix_to_series(
+        profile_matrix, metagene_df.offset_5p.values, lengths
+    )
+    metagene_df.insert(1, "profile", profiles)
+    return metagene_df
+
+
+def metagene_store_paths(file_path):
+    """Get location of the binary store for a metagene profile.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    profile_path: string
+                  Path to float32 matrix of fragment length x position
+    index_path: string
+                Path to per fragment length offset_5p/phase_score records
+    """
+    prefix = os.path.splitext(file_path)[0]
+    return prefix + __METAGENE_PROFILE_SUFFIX__, prefix + __METAGENE_INDEX_SUFFIX__
+
+
+def _save_npy_atomic(path, array):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as fh:
+        np.save(fh, array)
+    os.rename(tmp_path, path)
+
+
+def write_metagene_store(file_path):
+    """Convert a metagene profile tsv to the binary store.
+
+    The profiles are stored as a single float32 matrix with one row per
+    fragment length. Rows are aligned on offset_5p and padded with NaN.
+    The remaining columns are stored as a structured array alongside.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    store_paths: tuple
+                 Paths as returned by metagene_store_paths
+    """
+    metagene_df, profile_matrix, lengths = read_metagene_profile_matrix(file_path)
+    profile_matrix = profile_matrix.astype(np.float32)
+    offsets = metagene_df.offset_5p.values.astype(int)
+
+    fields = [
+        ("fragment_length", np.int64),
+        ("offset_5p", np.int64),
+        ("length", np.int64),
     ]
+    for column in ["phase_score", "valid_codons"]:
+        if column in metagene_df.columns:
+            fields.append((column, metagene_df[column].values.dtype))
+    index = np.zeros(len(metagene_df), dtype=fields)
+    index["fragment_length"] = metagene_df.index.values
+    index["offset_5p"] = offsets
+    index["length"] = lengths
+    for column, _ in fields[3:]:
+        index[column] = metagene_df[column].values
+
+    profile_path, index_path = metagene_store_paths(file_path)
+    _save_npy_atomic(profile_path, profile_matrix)
+    _save_npy_atomic(index_path, index)
+    return profile_path, index_path
+
+
+def metagene_store_exists(file_path):
+    """Check if an up to date binary store exists for a metagene profile.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    exists: bool
+    """
+    profile_path, index_path = metagene_store_paths(file_path)
+    try:
+        store_mtime = min(os.path.getmtime(profile_path), os.path.getmtime(index_path))
+    except OSError:
+        return False
+    try:
+        return store_mtime >= os.path.getmtime(file_path)
+    except OSError:
+        # Only the converted copy is around
+        return True
+
+
+def read_metagene_store(file_path):
+    """Read binary store of a metagene profile.
+
+    The profile matrix is memory mapped, so only the rows
+    that are actually plotted are read from disk.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    metagene_df: pd.DataFrame
+                 Same structure as returned by parse_metagene_profile
+    """
+    profile_path, index_path = metagene_store_paths(file_path)
+    profile_matrix = np.load(profile_path, mmap_mode="r")
+    index = np.load(index_path)
+    offsets = index["offset_5p"]
+
+    metagene_df = pd.DataFrame(
+        {"offset_5p": offsets},
+        index=pd.Index(index["fragment_length"], name="fragment_length"),
+    )
+    metagene_df["profile"] = _profile_matrix_to_series(
+        profile_matrix, offsets, index["length"]
+    )
+    for column in index.dtype.names[3:]:
+        metagene_df[column] = index[column]
     return metagene_df
 
 
+def load_metagene_profile(file_path):
+    """Load metagene profile, preferring the binary store over the tsv.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    metagene_df: pd.DataFrame
+                 Same structure as returned by parse_metagene_profile
+    """
+    if metagene_store_exists(file_path):
+        return read_metagene_store(file_path)
+    return parse_metagene_profile(file_path)
+
+
+def phase_scores_to_matrix(phase_scores):
+    """Combine phase scores of samples into a matrix.
+
+    Parameters
+    ----------
+    phase_scores: dict(pd.Series)
+                  Keys as sample name, value as phase scores
+                  indexed by fragment length
+
+    Returns
+    -------
+    phase_score_matrix: pd.DataFrame
+                        Samples as rows (in descending order) and
+                        fragment lengths as columns
+
+    """
+    if not phase_scores:
+        return pd.DataFrame()
+    phase_score_merged_df = pd.concat(phase_scores, axis=1).sort_index()
+    # plotly does the other way round?
+    return phase_score_merged_df.T.sort_index(ascending=False)
+
+
 def metagene_profile_to_phase_score_matrix(metagene_dfs):
     """Convert metagene dataframe to a matrix with phase scores.
 
@@ -87,24 +335,22 @@ def metagene_profile_to_phase_score_matrix(metagene_dfs):
 
     Returns
     -------
-    phase_score_matrix: pd.Series
-                        A Series with metagene as s
+    phase_score_matrix: pd.DataFrame
+                        Samples as rows and fragment lengths as columns
 
     """
-    phase_score_merged_df = pd.DataFrame()
-    for sample_name, metagene_df in metagene_dfs.items():
-        # Pull out the profile of coverage
-        phase_score_df = metagene_df[["phase_score"]]
-        phase_score_df.columns = [sample_name]
-        phase_score_merged_df = phase_score_merged_df.join(
-            phase_score_df, how="outer"
-        ).sort_index()
-    # plotly does the other way round?
-    return phase_score_merged_df.T.sort_index(ascending=False)
+    if isinstance(metagene_dfs, PackedMetageneProfiles):
+        return phase_scores_to_matrix(metagene_dfs.column("phase_score"))
+    return phase_scores_to_matrix(
+        OrderedDict(
+            (sample_name, metagene_df["phase_score"])
+            for sample_name, metagene_df in metagene_dfs.items()
+        )
+    )
 
 
-def project_summary_metagene_creator(project_summary_file):
-    """Parse project summary file to prepare project for metagene analysis.
+def get_project_metagene_files(project_summary_file):
+    """Get metagene 5p profile of each sample in a project.
 
     Parameters
     ----------
@@ -113,8 +359,8 @@ def project_summary_metagene_creator(project_summary_file):
 
     Returns
     -------
-    metagene_dfs: dict
-                  Keys as sample name, value as df loaded through parse_metagene_profile_file
+    metagene_files: dict
+                    Keys as sample name, value as path to metagene 5p profile
 
     """
     summary_df = (
@@ -130,166 +376,358 @@ def project_summary_metagene_creator(project_summary_file):
     # summary_df = summary_df.loc[
     #    summary_df.ribotricer_orfs == summary_df.ribotricer_orfs
     # ]
-    metagene_dfs = OrderedDict()
+    metagene_files = OrderedDict()
     for sample_name, row in summary_df.iterrows():
-        # Load the 5' tsv
-        metagene_dfs[sample_name] = parse_metagene_profile(row.ribotricer_metagene_5p)
-    return metagene_dfs
+        metagene_files[sample_name] = row.ribotricer_metagene_5p
+    return metagene_files
 
 
-def plot_metagene_coverage(
-    metagene_dfs,
-    fragment_length,
-    position_range=range(-20, 121),
-    samples_per_row=1,
-    plot_type="bar",
-    normalize_per_codon=False,
-    shared_yaxes=False,
-):
-    """Plot metagene for a list of samples.
+def load_metagene_profiles(metagene_files, progress=None):
+    """Load metagene profiles of a list of samples.
 
     Parameters
     ----------
+    metagene_files: dict
+                    Keys as sample name, value as path to metagene 5p profile
+    progress: function
+              Optional, called with the number of samples loaded,
+              the number of samples and a message after each sample
 
+    Returns
+    -------
     metagene_dfs: dict
-                  Keys as sample name, value as df loaded through parse_metagene_profile_file
-    fragment_length: int
-                     Fragment length for plotting
-    position_range: range
-                    Range of position to plot
-    samples_per_row: int
-                     Number of samples to plot
-    plot_type: string
-               Options of bar or line
+                  Keys as sample name, value as df loaded through load_metagene_profile
+
     """
-    titles = list(metagene_dfs.keys())
+    metagene_dfs = OrderedDict()
+    for index, (sample_name, metagene_file) in enumerate(metagene_files.items(), 1):
+        # Load the 5' tsv
+        metagene_dfs[sample_name] = load_metagene_profile(metagene_file)
+        if progress is not None:
+            progress(
+                index, len(metagene_files), "Loaded metagene of {}".format(sample_name)
+            )
+    return metagene_dfs
+
+
+def pack_metagene_profiles(metagene_dfs):
+    """Pack metagene profiles of a list of samples into flat arrays.
+
+    Used to share loaded projects between server processes, see
+    cache_helper.SharedMatrixStore. PackedMetageneProfiles reads the
+    profiles back.
+
+    Parameters
+    ----------
+    metagene_dfs: dict
+                  Keys as sample name, value as df loaded through load_metagene_profile
 
-    fig = subplots.make_subplots(
-        rows=int(np.ceil(len(list(metagene_dfs.keys())) / samples_per_row)),
-        cols=samples_per_row,
-        subplot_titles=titles,
-        print_grid=False,
+    Returns
+    -------
+    arrays: dict
+            values holds all profiles back to back, index has a
+            sample, fragment_length, offset_5p, length record per
+            profile, other columns such as phase_score have an array each
+    meta: dict
+          Sample names and their other columns
+    """
+    metagene_dfs = list(metagene_dfs.items())
+    profiles = [
+        np.asarray(profile.values)
+        for _, metagene_df in metagene_dfs
+        for profile in metagene_df.profile
+    ]
+    index = np.zeros(
+        len(profiles),
+        dtype=[
+            ("sample", np.int64),
+            ("fragment_length", np.int64),
+            ("offset_5p", np.int64),
+            ("length", np.int64),
+        ],
     )
+    if profiles:
+        index["sample"] = np.repeat(
+            np.arange(len(metagene_dfs)),
+            [len(metagene_df) for _, metagene_df in metagene_dfs],
+        )
+        index["fragment_length"] = np.concatenate(
+            [metagene_df.index.values for _, metagene_df in metagene_dfs]
+        )
+        index["offset_5p"] = np.concatenate(
+            [metagene_df.offset_5p.values for _, metagene_df in metagene_dfs]
+        )
+        index["length"] = [len(profile) for profile in profiles]
+    arrays = {
+        "values": np.concatenate(profiles) if profiles else np.zeros(0),
+        "index": index,
+    }
+
+    columns = [
+        [
+            column
+            for column in metagene_df.columns
+            if column not in ("offset_5p", "profile")
+        ]
+        for _, metagene_df in metagene_dfs
+    ]
+    dtypes = OrderedDict()
+    for (_, metagene_df), sample_columns in zip(metagene_dfs, columns):
+        for column in sample_columns:
+            dtypes.setdefault(column, metagene_df[column].dtype.str)
+    for column in dtypes:
+        # NaN for samples from old ribotricer output without the column
+        arrays[column] = np.concatenate(
+            [
+                (
+                    metagene_df[column].values.astype(np.float64)
+                    if column in metagene_df.columns
+                    else np.full(len(metagene_df), np.nan)
+                )
+                for _, metagene_df in metagene_dfs
+            ]
+        )
+    meta = {
+        "samples": [sample_name for sample_name, _ in metagene_dfs],
+        "columns": columns,
+        "dtypes": dtypes,
+    }
+    return arrays, meta
 
-    index = 1
-    for sample_name, metagene_df in metagene_dfs.items():
-        # Pull out the profile of coverage
-        try:
-            row = metagene_df.loc[fragment_length]
-            print(sample_name, fragment_length)
-        except KeyError:
-            index += 1
-            print("Skipped {} for {}".format(fragment_length, sample_name))
-            continue
-
-        profile = row.profile
-        if position_range != "default":
-            profile = profile.loc[position_range]
-        else:
-            position_range = profile.index
-        if plot_type == "bar":
-
-            if normalize_per_codon:
-                profile = _normalize_profile_values(profile)
-
-            frame0 = profile[profile.index % 3 == 0]
-            frame1 = profile[profile.index % 3 == 1]
-            frame2 = profile[profile.index % 3 == 2]
-            trace0 = Bar(
-                x=frame0.index,
-                y=frame0.values,
-                name="Frame 0",
-                marker=dict(color=__FRAME_COLORS__[0]),
-            )
-            trace1 = Bar(
-                x=frame1.index,
-                y=frame1.values,
-                name="Frame 1",
-                marker=dict(color=__FRAME_COLORS__[1]),
-            )
-            trace2 = Bar(
-                x=frame2.index,
-                y=frame2.values,
-                name="Frame 2",
-                marker=dict(color=__FRAME_COLORS__[2]),
-            )
-            trace = [trace0, trace1, trace2]
-            fig.append_trace(
-                trace0,
-                (index - 1) // samples_per_row + 1,
-                (index - 1) % samples_per_row + 1,
-            )
 
-            fig.append_trace(
-                trace1,
-                (index - 1) // samples_per_row + 1,
-                (index - 1) % samples_per_row + 1,
+class PackedMetageneProfiles(Mapping):
+    """Read-only dict of metagene profiles packed by pack_metagene_profiles.
+
+    The DataFrame of a sample is built when it is accessed, with the
+    profiles as views of arrays["values"], so memory mapped arrays are
+    not copied. metagene_coverage_matrix and
+    metagene_profile_to_phase_score_matrix read the arrays directly
+    instead of building the DataFrames.
+
+    Parameters
+    ----------
+    arrays: dict
+    meta: dict
+          As returned by pack_metagene_profiles
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        index = arrays["index"]
+        self.starts = np.cumsum(index["length"]) - index["length"]
+        # Profiles of each sample are consecutive
+        bounds = np.searchsorted(index["sample"], np.arange(len(meta["samples"]) + 1))
+        self._rows = OrderedDict(
+            (sample_name, (i, slice(bounds[i], bounds[i + 1])))
+            for i, sample_name in enumerate(meta["samples"])
+        )
+
+    def __getitem__(self, sample_name):
+        i, rows = self._rows[sample_name]
+        index = self.arrays["index"][rows]
+        metagene_df = pd.DataFrame(
+            {"offset_5p": index["offset_5p"]},
+            index=pd.Index(index["fragment_length"], name="fragment_length"),
+        )
+        values = self.arrays["values"]
+        metagene_df["profile"] = [
+            pd.Series(
+                values[start : start + length],
+                index=range(-offset_5p, length - offset_5p),
+                copy=False,
             )
-            fig.append_trace(
-                trace2,
-                (index - 1) // samples_per_row + 1,
-                (index - 1) % samples_per_row + 1,
+            for start, length, offset_5p in zip(
+                self.starts[rows], index["length"], index["offset_5p"]
             )
-        elif plot_type == "line":
-            trace = Scatter(x=position_range, y=profile.values, mode="lines")
-            fig.append_trace(
-                trace,
-                (index - 1) // samples_per_row + 1,
-                (index - 1) % samples_per_row + 1,
+        ]
+        for column in self.meta["columns"][i]:
+            metagene_df[column] = self.arrays[column][rows].astype(
+                self.meta["dtypes"][column]
             )
-        else:
-            raise Exception(
-                "Unknown plot_type '{}' selected. Possible options: 'bar' or 'line'.".format(
-                    plot_type
-                )
+        return metagene_df
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def column(self, column):
+        """Get a column other than profile of every sample.
+
+        Returns
+        -------
+        columns: dict
+                 Keys as sample name, value as Series indexed by
+                 fragment length, same as metagene_df[column]
+        """
+        fragment_lengths = self.arrays["index"]["fragment_length"]
+        columns = OrderedDict()
+        for sample_name, (i, rows) in self._rows.items():
+            if column not in self.meta["columns"][i]:
+                raise KeyError(column)
+            columns[sample_name] = pd.Series(
+                self.arrays[column][rows].astype(self.meta["dtypes"][column]),
+                index=pd.Index(fragment_lengths[rows], name="fragment_length"),
+                name=column,
             )
-        index += 1
-    fig["layout"].update(
-        height=max(200 * len(list(metagene_dfs.keys())), 400),
+        return columns
+
+
+def project_summary_metagene_creator(project_summary_file):
+    """Parse project summary file to prepare project for metagene analysis.
+
+    Parameters
+    ----------
+    project_summary_file: string
+                          Path to project summary file
+
+    Returns
+    -------
+    metagene_dfs: dict
+                  Keys as sample name, value as df loaded through parse_metagene_profile_file
+
+    """
+    return load_metagene_profiles(get_project_metagene_files(project_summary_file))
+
+
+def metagene_coverage_layout(titles, samples_per_row=1):
+    """Layout of the metagene plot drawn by assets/metagene.js.
+
+    Parameters
+    ----------
+    titles: list
+            Sample names
+    samples_per_row: int
+                     Number of samples to plot
+
+    Returns
+    -------
+    layout: dict
+    subplot_axes: list
+                  (xaxis, yaxis) references for the traces of each sample
+    """
+    layout, subplot_axes = subplot_grid_layout(titles, samples_per_row)
+    for annotation in layout["annotations"]:
+        annotation["font"] = dict(size=18)  # ,color='#ff0000')
+    layout.update(
+        height=max(200 * len(titles), 400),
         width=1000,
-        title="Metagene distribution",
+        title=dict(text="Metagene distribution"),
         paper_bgcolor="rgba(0,0,0,0)",
         plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(family="Arial", size=18, color="#000000"),
+        showlegend=False,
     )
-    fig["layout"].update(font=dict(family="Arial", size=18, color="#000000"))
-    for i in fig["layout"]["annotations"]:
-        i["font"] = dict(size=18)  # ,color='#ff0000')
-    fig["layout"].update(showlegend=False)
-    for i in range(1, index + 1):
-        row = (i - 1) // samples_per_row + 1
-        col = (i - 1) % samples_per_row + 1
-        fig.update_yaxes(
-            showgrid=True,
-            showline=True,
-            linewidth=2,
-            linecolor="black",
-            gridwidth=1,
-            gridcolor="Gray",
-            row=row,
-            col=col,
-            tickwidth=1,
-            ticklen=10,
-            ticks="outside",
-            tickcolor="black",
-        )
-    for i in range(1, index + 1):
-        row = (i - 1) // samples_per_row + 1
-        col = (i - 1) % samples_per_row + 1
-        fig.update_xaxes(
-            showgrid=False,
-            showline=True,
-            linewidth=2,
-            linecolor="black",
-            gridwidth=1,
-            gridcolor="Gray",
-            row=row,
-            col=col,
-            tickwidth=1,
-            ticklen=10,
-            ticks="outside",
-            tickcolor="black",
+    return layout, subplot_axes
+
+
+def metagene_coverage_payload(metagene_dfs, position_range=range(-20, 121)):
+    """Everything the browser needs to draw the metagene plot.
+
+    Coverage is sent once as base64 encoded little endian float32 so
+    that switching fragment length or normalization is done by the
+    clientside callback in assets/metagene.js without a round trip.
+
+    Parameters
+    ----------
+    metagene_dfs: dict
+                  Keys as sample name, value as df loaded through parse_metagene_profile_file
+    position_range: range
+                    Range of position to plot
+
+    Returns
+    -------
+    payload: dict
+    """
+    coverage, fragment_lengths, available = metagene_coverage_matrix(
+        metagene_dfs, position_range
+    )
+    layout, subplot_axes = metagene_coverage_layout(list(metagene_dfs.keys()))
+    return {
+        "layout": layout,
+        "subplot_axes": subplot_axes,
+        "frame_colors": __FRAME_COLORS__,
+        "positions": list(position_range),
+        "fragment_lengths": fragment_lengths,
+        "available": available.tolist(),
+        "coverage": base64.b64encode(coverage.astype("<f4").tobytes()).decode("ascii"),
+    }
+
+
+def metagene_coverage_matrix(metagene_dfs, position_range=range(-20, 121)):
+    """Stack metagene profiles of a list of samples.
+
+    Parameters
+    ----------
+    metagene_dfs: dict
+                  Keys as sample name, value as df loaded through parse_metagene_profile_file
+    position_range: range
+                    Range of position to keep
+
+    Returns
+    -------
+    coverage: np.ndarray
+              float32 samples x fragment lengths x positions matrix,
+              NaN where a sample has no coverage for a position
+    fragment_lengths: list
+                      Sorted union of the fragment lengths of all samples
+    available: np.ndarray
+               bool samples x fragment lengths, False where a sample
+               has no profile for the fragment length
+    """
+    if isinstance(metagene_dfs, PackedMetageneProfiles):
+        return _packed_coverage_matrix(metagene_dfs, position_range)
+    fragment_lengths = sorted(
+        set(
+            int(length)
+            for metagene_df in metagene_dfs.values()
+            for length in metagene_df.index
         )
-    return fig
+    )
+    length_index = {length: i for i, length in enumerate(fragment_lengths)}
+    positions = pd.Index(position_range)
+    coverage = np.full(
+        (len(metagene_dfs), len(fragment_lengths), len(positions)),
+        np.nan,
+        dtype=np.float32,
+    )
+    available = np.zeros((len(metagene_dfs), len(fragment_lengths)), dtype=bool)
+    for i, metagene_df in enumerate(metagene_dfs.values()):
+        for length, profile in zip(metagene_df.index, metagene_df.profile):
+            j = length_index[int(length)]
+            coverage[i, j] = profile.reindex(positions).values
+            available[i, j] = True
+    return coverage, fragment_lengths, available
+
+
+def _packed_coverage_matrix(metagene_dfs, position_range):
+    """metagene_coverage_matrix of PackedMetageneProfiles in one pass."""
+    index = metagene_dfs.arrays["index"]
+    fragment_lengths = np.unique(index["fragment_length"])
+    length_index = np.searchsorted(fragment_lengths, index["fragment_length"])
+    positions = np.asarray(position_range)
+    coverage = np.full(
+        (len(metagene_dfs), len(fragment_lengths), len(positions)),
+        np.nan,
+        dtype=np.float32,
+    )
+    available = np.zeros((len(metagene_dfs), len(fragment_lengths)), dtype=bool)
+    available[index["sample"], length_index] = True
+    # Position of each plotted position within each profile
+    within = positions[np.newaxis, :] + index["offset_5p"][:, np.newaxis]
+    rows, columns = np.nonzero(
+        (within >= 0) & (within < index["length"][:, np.newaxis])
+    )
+    coverage[index["sample"][rows], length_index[rows], columns] = metagene_dfs.arrays[
+        "values"
+    ][metagene_dfs.starts[rows] + within[rows, columns]]
+    return coverage, fragment_lengths.tolist(), available
 
 
 def plot_phase_score_heatmap(phase_score_df):
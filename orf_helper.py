@@ -1,5 +1,14 @@
+import warnings
+
+import numpy as np
 import pandas as pd
-from plotly.graph_objs import Bar, Figure, Layout
+from plotly.colors import DEFAULT_PLOTLY_COLORS
+from plotly.graph_objs import Bar, Box, Figure, Layout, Scatter
+
+# Number of points the density of each violin is evaluated at
+__VIOLIN_POINTS__ = 100
+# Half width of a violin in units of the distance between samples
+__VIOLIN_HALF_WIDTH__ = 0.45
 
 
 def format_figure(fig):
@@ -78,16 +87,128 @@ def plot_orf_counts_stacked_bar(df):
     return fig
 
 
-def plot_phase_scores_violin(phase_score_df):
+def summarize_phase_scores(phase_score_df, points=__VIOLIN_POINTS__):
+    """Summarize positive phase scores of each sample for a violin plot.
+
+    Densities are Gaussian kernel estimates with the bandwidth plotly
+    uses for violins (Silverman's rule), computed from a histogram of
+    the scores so that the work and the output are independent of
+    the number of ORFs beyond a single pass over the table.
+
+    Parameters
+    ----------
+    phase_score_df: DataFrame
+                    table with index as ORF ID and columns as phase scores
+    points: int
+            Number of points each density is evaluated at
+
+    Returns
+    -------
+    summary: dict
+             Keys 'samples', 'grid' (samples x points), 'density'
+             (samples x points, peak scaled to 1), 'count', 'mean', 'q1',
+             'median', 'q3', 'lowerfence' and 'upperfence' (per sample).
+             Samples without positive scores have NaN statistics.
+    """
+    samples = sorted(phase_score_df.columns.tolist())
+    scores = phase_score_df[samples].values.astype(float).T
+    scores[~(scores > 0)] = np.nan
+    count = np.sum(~np.isnan(scores), axis=1)
+    if not count.any():
+        # No ORFs, or no sample with a positive score
+        missing = np.full(len(samples), np.nan)
+        return {
+            "samples": samples,
+            "grid": np.full((len(samples), points), np.nan),
+            "density": np.full((len(samples), points), np.nan),
+            "count": count,
+            "mean": missing,
+            "q1": missing,
+            "median": missing,
+            "q3": missing,
+            "lowerfence": missing,
+            "upperfence": missing,
+        }
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        # All-NaN rows of samples without positive scores
+        warnings.simplefilter("ignore", RuntimeWarning)
+        q1, median, q3 = np.nanpercentile(scores, [25, 50, 75], axis=1)
+        mean = np.nanmean(scores, axis=1)
+        std = np.nanstd(scores, axis=1)
+        low = np.nanmin(scores, axis=1)
+        high = np.nanmax(scores, axis=1)
+        iqr = q3 - q1
+        # Whiskers end at the most extreme scores within 1.5 IQR of the box
+        lowerfence = np.nanmin(
+            np.where(scores >= (q1 - 1.5 * iqr)[:, None], scores, np.nan), axis=1
+        )
+        upperfence = np.nanmax(
+            np.where(scores <= (q3 + 1.5 * iqr)[:, None], scores, np.nan), axis=1
+        )
+        # plotly.js violin default bandwidth
+        bandwidth = 1.059 * np.fmin(std, iqr / 1.349) * np.power(count, -0.2)
+        bins = 4 * points
+        # Samples without positive scores have NaN ranges
+        edges = np.linspace(np.nanmin(low), np.nanmax(high), bins + 1)
+    # Constant samples still get a visible violin
+    bandwidth[~(bandwidth > 0)] = 1e-3
+    # Densities are evaluated over the data range padded by two
+    # bandwidths, as plotly does with its default 'soft' span
+    start = low - 2 * bandwidth
+    stop = high + 2 * bandwidth
+    grid = np.linspace(0, 1, points)[None, :] * (stop - start)[:, None] + start[:, None]
+
+    centers = (edges[:-1] + edges[1:]) / 2
+    # One bincount over all samples with each sample's bins offset
+    sample_index, orf_index = np.nonzero(~np.isnan(scores))
+    bin_index = np.clip(
+        np.searchsorted(edges, scores[sample_index, orf_index], side="right") - 1,
+        0,
+        bins - 1,
+    )
+    histogram = np.bincount(
+        sample_index * bins + bin_index, minlength=len(samples) * bins
+    ).reshape(len(samples), bins)
+    density = np.empty((len(samples), points))
+    for i in range(len(samples)):
+        # One points x bins kernel at a time, a kernel for all samples at
+        # once takes hundreds of MB for large projects
+        distance = (grid[i, :, None] - centers[None, :]) / bandwidth[i]
+        density[i] = np.exp(-0.5 * distance ** 2).dot(histogram[i])
+    peak = density.max(axis=1)
+    peak[peak == 0] = 1
+    density = density / peak[:, None]
+    return {
+        "samples": samples,
+        "grid": grid,
+        "density": density,
+        "count": count,
+        "mean": mean,
+        "q1": q1,
+        "median": median,
+        "q3": q3,
+        "lowerfence": lowerfence,
+        "upperfence": upperfence,
+    }
+
+
+def plot_phase_scores_violin(phase_score_df, mode="raw"):
     """Create violoin plots for phase scores
 
     Parameters
     ----------
     phase_score_df: DataFrame
                     table withindex as ORF ID and columns as phase scores
+    mode: string
+          'raw' sends the positive phase scores of every ORF to the
+          browser which computes the violins, 'density' draws the
+          same violins from summarize_phase_scores with a payload
+          that does not grow with the number of ORFs
     """
     if phase_score_df is None:
         return None
+    if mode == "density":
+        return plot_phase_scores_violin_density(phase_score_df)
     columns = sorted(phase_score_df.columns.tolist())
     fig_data = []
     for column in columns:
@@ -117,3 +238,73 @@ def plot_phase_scores_violin(phase_score_df):
     format_figure(fig)
     fig["layout"].update(font=dict(family="Arial", size=18, color="#000000"))
     return fig
+
+
+def plot_phase_scores_violin_density(phase_score_df):
+    """Create violin plots for phase scores from server side summaries.
+
+    Each sample is drawn as a filled outline of its density and a box
+    built from its precomputed quartiles, whiskers and mean, placed at
+    integer positions labelled with the sample name.
+
+    Parameters
+    ----------
+    phase_score_df: DataFrame
+                    table with index as ORF ID and columns as phase scores
+    """
+    summary = summarize_phase_scores(phase_score_df)
+    fig_data = []
+    for i, sample in enumerate(summary["samples"]):
+        if not summary["count"][i]:
+            continue
+        color = DEFAULT_PLOTLY_COLORS[i % len(DEFAULT_PLOTLY_COLORS)]
+        half_width = __VIOLIN_HALF_WIDTH__ * summary["density"][i]
+        grid = summary["grid"][i]
+        fig_data.append(
+            Scatter(
+                x=np.round(np.concatenate([i - half_width, i + half_width[::-1]]), 4),
+                y=np.round(np.concatenate([grid, grid[::-1]]), 4),
+                mode="lines",
+                fill="toself",
+                line=dict(color=color, width=2),
+                name=sample,
+                legendgroup=sample,
+                hoverinfo="name",
+                hoveron="fills",
+            )
+        )
+        fig_data.append(
+            Box(
+                x=[i],
+                q1=[summary["q1"][i]],
+                median=[summary["median"][i]],
+                q3=[summary["q3"][i]],
+                mean=[summary["mean"][i]],
+                lowerfence=[summary["lowerfence"][i]],
+                upperfence=[summary["upperfence"][i]],
+                boxmean=True,
+                width=__VIOLIN_HALF_WIDTH__ / 2,
+                line=dict(color=color),
+                name=sample,
+                legendgroup=sample,
+                showlegend=False,
+            )
+        )
+    layout = Layout(
+        {
+            "title": "",
+            "xaxis": {
+                "tickmode": "array",
+                "tickvals": list(range(len(summary["samples"]))),
+                "ticktext": summary["samples"],
+                "zeroline": False,
+            },
+            "yaxis": {"zeroline": False},
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)",
+        }
+    )
+    fig = Figure(data=fig_data, layout=layout)
+    format_figure(fig)
+    fig["layout"].update(font=dict(family="Arial", size=18, color="#000000"))
+    return fig
@@ -0,0 +1,123 @@
+import numpy as np
+import plotly.io as pio
+
+# Axis lines and ticks shared by the per sample subplots
+__AXIS_STYLE__ = dict(
+    showline=True,
+    linewidth=2,
+    linecolor="black",
+    gridwidth=1,
+    gridcolor="Gray",
+    tickwidth=1,
+    ticklen=10,
+    ticks="outside",
+    tickcolor="black",
+)
+# Samples shown per page of the metagene and read length plots
+__SAMPLES_PER_PAGE__ = 20
+
+
+def subplot_grid_layout(titles, samples_per_row=1):
+    """Build the layout of a grid of subplots with styled axes.
+
+    Equivalent to plotly.subplots.make_subplots with subplot_titles
+    followed by update_xaxes and update_yaxes on every subplot, but
+    built as a single dict so the cost is linear in the number of
+    subplots.
+
+    Parameters
+    ----------
+    titles: list
+            Title of each subplot, filled row by row from the top left
+    samples_per_row: int
+                     Number of columns of the grid
+
+    Returns
+    -------
+    layout: dict
+            Layout with one xaxis/yaxis pair per grid cell, an
+            annotation per title and the default template
+    subplot_axes: list
+                  (xaxis, yaxis) references for the trace of each title
+    """
+    rows = max(int(np.ceil(len(titles) / samples_per_row)), 1)
+    cols = samples_per_row
+    horizontal_spacing = 0.2 / cols
+    # Room for the subplot titles
+    vertical_spacing = 0.5 / rows
+    width = (1.0 - horizontal_spacing * (cols - 1)) / cols
+    height = (1.0 - vertical_spacing * (rows - 1)) / rows
+
+    layout = {"annotations": [], "template": default_template()}
+    subplot_axes = []
+    for i in range(rows * cols):
+        row, col = divmod(i, cols)
+        suffix = str(i + 1) if i else ""
+        x_start = col * (width + horizontal_spacing)
+        # First row at the top
+        y_start = (rows - 1 - row) * (height + vertical_spacing)
+        x_domain = [max(0.0, x_start), min(1.0, x_start + width)]
+        y_domain = [max(0.0, y_start), min(1.0, y_start + height)]
+        layout["xaxis" + suffix] = dict(
+            __AXIS_STYLE__, domain=x_domain, anchor="y" + suffix, showgrid=False
+        )
+        layout["yaxis" + suffix] = dict(
+            __AXIS_STYLE__, domain=y_domain, anchor="x" + suffix, showgrid=True
+        )
+        subplot_axes.append(("x" + suffix, "y" + suffix))
+        if i < len(titles) and titles[i]:
+            layout["annotations"].append(
+                {
+                    "x": sum(x_domain) / 2.0,
+                    "y": y_domain[1],
+                    "xref": "paper",
+                    "yref": "paper",
+                    "text": titles[i],
+                    "showarrow": False,
+                    "font": dict(size=16),
+                    "xanchor": "center",
+                    "yanchor": "bottom",
+                }
+            )
+    return layout, subplot_axes[: len(titles)]
+
+
+def default_template():
+    """Layout template plotly applies to new figures, as a dict.
+
+    Figures built as plain dicts skip plotly's validation of every
+    trace, which dominates the cost of plots with many subplots, but
+    need the template set explicitly to look the same.
+    """
+    return pio.templates[pio.templates.default].to_plotly_json()
+
+
+def page_count(n_samples, samples_per_page=__SAMPLES_PER_PAGE__):
+    """Number of pages needed to show n_samples, at least one."""
+    if not samples_per_page:
+        return 1
+    return max(int(np.ceil(n_samples / samples_per_page)), 1)
+
+
+def paginate(items, page=1, samples_per_page=__SAMPLES_PER_PAGE__):
+    """Get the items shown on a page.
+
+    Parameters
+    ----------
+    items: list
+           Sample names in plotting order
+    page: int
+          Page number starting from 1, clipped to the available pages
+    samples_per_page: int
+                      None or 0 to show all items on a single page
+
+    Returns
+    -------
+    items: list
+    """
+    items = list(items)
+    if not samples_per_page:
+        return items
+    page = min(max(int(page or 1), 1), page_count(len(items), samples_per_page))
+    start = (page - 1) * samples_per_page
+    return items[start : start + samples_per_page]
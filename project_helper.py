@@ -7,7 +7,7 @@ def get_projects(datasets, species):
 
     Parameters
     ----------
-    datasets: pandas.DataFrame
+    datasets: DatasetRegistry
               datasets.tsv
     species: string
              species
@@ -17,17 +17,15 @@ def get_projects(datasets, species):
     projects: list
               List of projects available for given species
     """
-    projects = datasets.loc[datasets.index == species].srp.tolist()
-    projects = [{"label": project, "value": project} for project in projects]
-    return projects
+    return datasets.get_projects(species)
 
 
-def get_srp_table(datasets, srp):
+def get_srp_table(datasets, srp, species):
     """Get metadata table for SRP.
 
     Parameters
     ----------
-    datasets: pandas.DataFrame
+    datasets: DatasetRegistry
               datasets.tsv
     srp: string
          SRP ID
@@ -37,17 +35,17 @@ def get_srp_table(datasets, srp):
     table: dash.html_table
            Metadata table for SRP
     """
-    dataset = datasets[datasets.srp == srp].iloc[0]
+    dataset = datasets.get(species, srp)
     srp_metadata = pd.read_csv(dataset.project_metadata_path, sep="\t")
     return srp_metadata
 
 
-def get_srp_read_lengths(datasets, srp):
+def get_srp_read_lengths(datasets, srp, species):
     """Get fragment lengths for a SRP.
 
     Parameters
     ----------
-    datasets: pandas.DataFrame
+    datasets: DatasetRegistry
     srp: string
          SRP ID
 
@@ -55,9 +53,8 @@ def get_srp_read_lengths(datasets, srp):
     -------
     fragment_lengths: list(dict)
     """
-    dataset = datasets[datasets.srp == srp].iloc[0]
-    fragment_lengths = eval(dataset.fragment_lengths)
-    return [{"label": length, "value": length} for length in fragment_lengths]
+    dataset = datasets.get(species, srp)
+    return [{"label": length, "value": length} for length in dataset.fragment_lengths]
 
 
 def get_summarized_phase_scores(datasets, srp, species):
@@ -65,7 +62,7 @@ def get_summarized_phase_scores(datasets, srp, species):
 
     Parameters
     ----------
-    datasets: pandas.DataFrame
+    datasets: DatasetRegistry
     srp: string
          SRP ID
 
@@ -73,7 +70,7 @@ def get_summarized_phase_scores(datasets, srp, species):
     -------
     phase_scores_df: pd.DataFrame
     """
-    dataset = datasets[(datasets.srp == srp) & (datasets.index == species)].iloc[0]
+    dataset = datasets.get(species, srp)
     try:
         phase_scores_df = pd.read_csv(dataset.summarized_phase_scores, sep="\t")
         phase_scores_df = phase_scores_df.set_index("ORF_ID")
@@ -87,7 +84,7 @@ def get_summarized_orf_counts(datasets, srp, species):
 
     Parameters
     ----------
-    datasets: pandas.DataFrame
+    datasets: DatasetRegistry
     srp: string
          SRP ID
 
@@ -95,7 +92,7 @@ def get_summarized_orf_counts(datasets, srp, species):
     -------
     orf_counts_df: pd.DataFrame
     """
-    dataset = datasets[(datasets.srp == srp) & (datasets.index == species)].iloc[0]
+    dataset = datasets.get(species, srp)
     try:
         orf_counts_df = pd.read_csv(dataset.summarized_orfs, sep="\t").set_index(
             "experiment_accession"
@@ -110,7 +107,7 @@ def get_project_summary_file(datasets, srp, species):
 
     Parameters
     ----------
-    datasets: pandas.DataFrame
+    datasets: DatasetRegistry
     srp: string
          SRP ID
 
@@ -118,5 +115,13 @@ def get_project_summary_file(datasets, srp, species):
     -------
     file_path: string
     """
-    dataset = datasets[(datasets.srp == srp) & (datasets.index == species)].iloc[0]
+    dataset = datasets.get(species, srp)
     return dataset.project_metadata_path
+
+
+def read_phase_score_matrix(file_path):
+    """Read a phase score matrix written by create_project_summaries.py."""
+    phase_score_df = pd.read_csv(file_path, sep="\t", index_col=0)
+    phase_score_df.columns = phase_score_df.columns.astype(int)
+    # Same ordering as metagene_profile_to_phase_score_matrix
+    return phase_score_df.sort_index(ascending=False)
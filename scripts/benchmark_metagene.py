@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""Benchmark metagene parsing and normalization against the previous implementation.
+
+The test/data fixture is copied once per sample into a temporary
+directory to mimic a project with hundreds of samples.
+
+Usage:
+    python scripts/benchmark_metagene.py [--samples 300] [--benchmark parse]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from metagene_helper import parse_metagene_profile, write_metagene_store
+from metagene_helper import read_metagene_store, load_metagene_profiles
+from metagene_helper import _normalize_profiles, normalize_codon_matrix
+
+FIXTURE = os.path.join(ROOT_DIR, "test", "data", "SRX327686_metagene_profiles_5p.tsv")
+
+
+def legacy_parse_metagene_profile(file_path):
+    """parse_metagene_profile as it was before the numpy parser."""
+    metagene_df = pd.read_csv(file_path, sep="\t")
+    if len(metagene_df.columns) == 3:
+        metagene_df = pd.read_csv(file_path, header=None, sep="\t")
+        metagene_df.columns = ["fragment_length", "offset_5p", "profile"]
+    metagene_df["fragment_length"] = metagene_df["fragment_length"].astype(int)
+    metagene_df = metagene_df.set_index("fragment_length")
+    metagene_df["profile"] = [eval(profile) for profile in metagene_df.profile]
+    metagene_df["profile"] = [
+        pd.Series(profile, index=range(-offset_5p, len(profile) - offset_5p))
+        for offset_5p, profile in zip(metagene_df.offset_5p, metagene_df.profile)
+    ]
+    return metagene_df
+
+
+def legacy_normalize_profile_values(profile):
+    """_normalize_profile_values as it was before the numpy implementation."""
+    normalized_values = []
+    coverage_list = profile.values.tolist()
+    for i in np.arange(0, len(coverage_list), 3):
+        if i + 2 < len(coverage_list):
+            if coverage_list[i] == 0:
+                normalized_values += [
+                    coverage_list[i],
+                    coverage_list[i + 1],
+                    coverage_list[i + 2],
+                ]
+            else:
+                normalized_values += [
+                    1.0,
+                    coverage_list[i + 1] / coverage_list[i],
+                    coverage_list[i + 2] / coverage_list[i],
+                ]
+
+        elif i + 2 <= len(coverage_list):
+            if coverage_list[i] == 0:
+                normalized_values += [coverage_list[i], coverage_list[i + 1]]
+            else:
+                normalized_values += [1.0, coverage_list[i + 1] / coverage_list[i]]
+        elif i + 1 <= len(coverage_list):
+            if coverage_list[i] == 0:
+                normalized_values += [0]
+            else:
+                normalized_values += [1.0]
+    return pd.Series(normalized_values, index=profile.index.tolist())
+
+
+def time_per_project(function, file_paths, repeat):
+    """Best wall clock time of calling function on every file."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file_path in file_paths:
+            function(file_path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_parsers(file_paths, repeat):
+    for file_path in file_paths[:1]:
+        expected = legacy_parse_metagene_profile(file_path)
+        for parser in [parse_metagene_profile, read_metagene_store]:
+            parsed = parser(file_path)
+            assert expected.index.tolist() == parsed.index.tolist()
+            for profile, parsed_profile in zip(expected.profile, parsed.profile):
+                assert profile.index.tolist() == parsed_profile.index.tolist()
+                assert np.allclose(profile.values, parsed_profile.values, rtol=1e-6)
+
+    legacy = time_per_project(legacy_parse_metagene_profile, file_paths, repeat)
+    print("{:<32}{:>10}{:>10}".format("parser", "seconds", "speedup"))
+    print("{:<32}{:>10.3f}{:>10}".format("eval (legacy)", legacy, "1.0x"))
+    for name, parser in [
+        ("numpy tsv", parse_metagene_profile),
+        ("binary store (mmap)", read_metagene_store),
+    ]:
+        seconds = time_per_project(parser, file_paths, repeat)
+        print("{:<32}{:>10.3f}{:>9.1f}x".format(name, seconds, legacy / seconds))
+
+
+def benchmark_normalization(file_paths, repeat, position_range=range(-20, 121)):
+    # Zero first positions and partial trailing codons of every length
+    edge_cases = [
+        pd.Series([0.0, 2.0, 3.0, 4.0, 0.0, 5.0, 0.0]),
+        pd.Series([2.0, 1.0, 0.0, 0.0, 1.0]),
+        pd.Series([1.0, 2.0, 3.0, 0.0]),
+        pd.Series([0.0]),
+    ]
+    for expected, normalized in zip(
+        [legacy_normalize_profile_values(profile) for profile in edge_cases],
+        _normalize_profiles(edge_cases),
+    ):
+        assert np.allclose(expected.values, normalized.values, equal_nan=True)
+
+    metagene_dfs = load_metagene_profiles(dict(enumerate(file_paths)))
+    # Every fragment length of every sample, as redrawn per project
+    profiles = [
+        profile.loc[position_range]
+        for metagene_df in metagene_dfs.values()
+        for profile in metagene_df.profile
+    ]
+
+    profile_matrix = np.vstack([profile.values for profile in profiles])
+    timings = []
+    for normalize in [
+        lambda: [legacy_normalize_profile_values(profile) for profile in profiles],
+        lambda: _normalize_profiles(profiles),
+        lambda: normalize_codon_matrix(profile_matrix),
+    ]:
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            normalize()
+            best = min(best, time.perf_counter() - start)
+        timings.append(best)
+
+    print("{:<32}{:>10}{:>10}".format("normalization", "seconds", "speedup"))
+    print("{:<32}{:>10.3f}{:>10}".format("per codon loop (legacy)", timings[0], "1.0x"))
+    for name, seconds in zip(
+        ["codon reshape", "codon reshape (matrix only)"], timings[1:]
+    ):
+        print("{:<32}{:>10.3f}{:>9.1f}x".format(name, seconds, timings[0] / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--samples", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--benchmark", choices=["all", "parse", "normalize"], default="all"
+    )
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        file_paths = []
+        for i in range(args.samples):
+            file_path = os.path.join(
+                tmpdir, "SRX{:06d}_metagene_profiles_5p.tsv".format(i)
+            )
+            shutil.copyfile(FIXTURE, file_path)
+            write_metagene_store(file_path)
+            file_paths.append(file_path)
+        if args.benchmark in ["all", "parse"]:
+            print("Parsing {} metagene profiles".format(args.samples))
+            benchmark_parsers(file_paths, args.repeat)
+        if args.benchmark in ["all", "normalize"]:
+            print("Normalizing {} metagene profiles".format(args.samples))
+            benchmark_normalization(file_paths, args.repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Benchmark merging run results into project metadata against the previous implementation.
+
+A synthetic project with --runs runs, two per experiment, is
+filled with the same collected results by the per-run df.loc
+assignments get_srp_table used to make and by merge_run_records.
+
+Usage:
+    python scripts/benchmark_project_summaries.py [--runs 5000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from create_project_summaries import EXPERIMENT_COLUMNS, RUN_COLUMNS
+from create_project_summaries import merge_run_records
+
+
+def make_project(n_runs, runs_per_experiment=2):
+    """Synthetic SRA metadata and collected results of a project."""
+    srrs = ["SRR{:07d}".format(i) for i in range(n_runs)]
+    srxs = ["SRX{:07d}".format(i // runs_per_experiment) for i in range(n_runs)]
+    srp_df = pd.DataFrame(
+        {
+            "study_accession": "SRP000001",
+            "experiment_title": ["Ribo-seq {}".format(srx) for srx in srxs],
+            "experiment_accession": srxs,
+            "run_accession": srrs,
+            "library_layout": "SINGLE",
+            "bases": np.arange(n_runs) * 1000,
+            "spots": np.arange(n_runs) * 20,
+        }
+    )
+    experiment_records = []
+    for i, srx in enumerate(sorted(set(srxs))):
+        record = {"experiment_accession": srx}
+        for column in EXPERIMENT_COLUMNS:
+            # Every tenth experiment is missing its ribotricer results
+            if i % 10:
+                record[column] = "/data2/re-ribo-analysis/{}_{}".format(srx, column)
+            else:
+                record[column] = None
+        experiment_records.append(record)
+    run_records = []
+    for i, srr in enumerate(srrs):
+        record = {"run_accession": srr}
+        # Every seventh run has no STAR or cutadapt reports
+        if i % 7:
+            for column in RUN_COLUMNS:
+                record[column] = "AGATCGGAAGAGC" if column.endswith("adapter") else i
+        run_records.append(record)
+    return srp_df, experiment_records, run_records
+
+
+def legacy_merge_run_records(srp_df, experiment_records, run_records):
+    """get_srp_table's per run df.loc assignments before merge_run_records."""
+    srp_df = srp_df.copy()
+    for column in RUN_COLUMNS + EXPERIMENT_COLUMNS:
+        srp_df[column] = None
+    for record in experiment_records:
+        srx = record["experiment_accession"]
+        if record["ribotricer_orfs"]:
+            srp_df.loc[srp_df.experiment_accession == srx, "ribotricer_orfs"] = record[
+                "ribotricer_orfs"
+            ]
+        for column in EXPERIMENT_COLUMNS[1:]:
+            srp_df.loc[srp_df.experiment_accession == srx, column] = record[column]
+    for record in run_records:
+        srr = record["run_accession"]
+        for column in RUN_COLUMNS:
+            if column in record:
+                srp_df.loc[srp_df.run_accession == srr, column] = record[column]
+    return srp_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    srp_df, experiment_records, run_records = make_project(args.runs)
+    timings = []
+    results = []
+    for merge in [legacy_merge_run_records, merge_run_records]:
+        best = np.inf
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = merge(srp_df, experiment_records, run_records)
+            best = min(best, time.perf_counter() - start)
+        timings.append(best)
+        results.append(result)
+    assert results[0].columns.tolist() == results[1].columns.tolist()
+    assert results[0].astype(str).equals(results[1].astype(str))
+
+    print("Merging results of {} runs".format(args.runs))
+    print("{:<32}{:>10}{:>10}".format("merge", "seconds", "speedup"))
+    print("{:<32}{:>10.3f}{:>10}".format("df.loc per run (legacy)", timings[0], "1.0x"))
+    print(
+        "{:<32}{:>10.3f}{:>9.1f}x".format(
+            "merge_run_records", timings[1], timings[0] / timings[1]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
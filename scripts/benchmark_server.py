@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""Benchmark request throughput of the debug server against gunicorn.
+
+Each server is started on a local port and sent the requests a
+visitor of the visualize page makes for one project: the page layout,
+loading the project, a page of the metadata table and a cached
+figure. Requests are sent from concurrent clients and the throughput
+and latencies are printed per server.
+
+Usage:
+    python scripts/benchmark_server.py [--server debug gunicorn] [--requests 400] [--concurrency 8]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from init import __DATASETS__
+
+# The debug server as app.py runs it, bound to localhost and without
+# the reloader, which would fork a second server process
+DEBUG_SERVER = (
+    "from app import app; "
+    "app.run_server(host='127.0.0.1', port={port}, debug=True, use_reloader=False)"
+)
+
+
+def start_server(server, port, workers, threads):
+    """Start a server in the background.
+
+    Returns
+    -------
+    process: subprocess.Popen
+    """
+    if server == "debug":
+        command = [sys.executable, "-c", DEBUG_SERVER.format(port=port)]
+    else:
+        command = [
+            os.path.join(os.path.dirname(sys.executable), "gunicorn"),
+            "--config",
+            "gunicorn.conf.py",
+            "--bind",
+            "127.0.0.1:{}".format(port),
+            "--workers",
+            str(workers),
+            "--threads",
+            str(threads),
+            "wsgi:server",
+        ]
+    return subprocess.Popen(
+        command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_for_server(process, url, timeout=120):
+    start = time.time()
+    while time.time() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited with code {}".format(process.returncode))
+        try:
+            urlopen(url + "/_dash-layout", timeout=5).read()
+            return
+        except (URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError("{} did not start within {}s".format(url, timeout))
+
+
+def callback_request(url, outputs, inputs, state=()):
+    """Build the request the browser sends to update outputs."""
+    outputs = [{"id": id, "property": prop} for id, prop in outputs]
+    if len(outputs) == 1:
+        output = "{id}.{property}".format(**outputs[0])
+        outputs = outputs[0]
+    else:
+        output = "..{}..".format(
+            "...".join("{id}.{property}".format(**o) for o in outputs)
+        )
+    body = {
+        "output": output,
+        "outputs": outputs,
+        "inputs": [
+            {"id": id, "property": prop, "value": value} for id, prop, value in inputs
+        ],
+        "state": [
+            {"id": id, "property": prop, "value": value} for id, prop, value in state
+        ],
+        "changedPropIds": ["{}.{}".format(inputs[0][0], inputs[0][1])],
+    }
+    return Request(
+        url + "/_dash-update-component",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+def visitor_requests(url, species, srp):
+    """Requests made when a project is opened on the visualize page."""
+    project = {"srp": srp, "assembly": species}
+    return [
+        url + "/_dash-layout",
+        callback_request(
+            url,
+            [("project-store", "data")],
+            [("srp", "value", srp)],
+            [("assembly", "value", species)],
+        ),
+        callback_request(
+            url,
+            [
+                ("srametadata-datatable", "data"),
+                ("srametadata-datatable", "page_count"),
+            ],
+            [
+                ("srametadata-datatable", "page_current", 0),
+                ("srametadata-datatable", "page_size", 25),
+                ("srametadata-datatable", "sort_by", []),
+            ],
+            [
+                ("project-store", "data", project),
+                ("srametadata-datatable", "filter_query", ""),
+            ],
+        ),
+        callback_request(
+            url,
+            [("orf-count-dist-plot", "figure")],
+            [("project-store", "data", project)],
+        ),
+    ]
+
+
+def timed_request(request):
+    start = time.perf_counter()
+    try:
+        urlopen(request, timeout=300).read()
+        ok = True
+    except (URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_benchmark(url, requests, n_requests, concurrency):
+    # Warm up caches so both servers are compared on cached responses
+    for request in requests:
+        timed_request(request)
+    batch = [requests[i % len(requests)] for i in range(n_requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_request, batch))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([latency for latency, ok in results]) * 1000
+    return {
+        "requests_per_second": n_requests / elapsed,
+        "p50": np.percentile(latencies, 50),
+        "p95": np.percentile(latencies, 95),
+        "errors": sum(not ok for latency, ok in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--server",
+        nargs="*",
+        default=["debug", "gunicorn"],
+        choices=["debug", "gunicorn"],
+    )
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="*", default=[1, 8], help="Concurrent clients"
+    )
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads")
+    parser.add_argument("--port", type=int, default=8051)
+    parser.add_argument("--species", help="Default: first project in datasets.tsv")
+    parser.add_argument("--srp")
+    args = parser.parse_args()
+
+    species, srp = next(iter(__DATASETS__.records))
+    species = args.species or species
+    srp = args.srp or srp
+    url = "http://127.0.0.1:{}".format(args.port)
+    requests = visitor_requests(url, species, srp)
+
+    print("{} {}, {} requests per run".format(species, srp, args.requests))
+    print("server\tclients\treq/s\tp50 ms\tp95 ms\terrors")
+    for server in args.server:
+        process = start_server(server, args.port, args.workers, args.threads)
+        try:
+            wait_for_server(process, url)
+            for concurrency in args.concurrency:
+                result = run_benchmark(url, requests, args.requests, concurrency)
+                print(
+                    "{}\t{}\t{requests_per_second:.1f}\t{p50:.1f}\t{p95:.1f}\t{errors}".format(
+                        server, concurrency, **result
+                    )
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Convert ribotricer metagene profiles to the binary store read by ribopod.
+
+Each *_metagene_profiles_5p.tsv listed in the project metadata files
+of datasets.tsv is written out as a float32 profile matrix and an index
+next to the tsv (see metagene_helper.write_metagene_store). Profiles
+that already have an up to date store are skipped.
+
+Usage:
+    python scripts/convert_metagene_profiles.py [--datasets /data2/datasets.tsv]
+    python scripts/convert_metagene_profiles.py SRX327686_metagene_profiles_5p.tsv
+"""
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metagene_helper import metagene_store_exists, write_metagene_store
+
+
+def get_metagene_files(datasets_path):
+    """Get all metagene 5p profiles listed in datasets.tsv.
+
+    Parameters
+    ----------
+    datasets_path: string
+                   Path to datasets.tsv
+
+    Returns
+    -------
+    metagene_files: list
+                    Sorted list of metagene 5p profile paths
+    """
+    datasets = pd.read_csv(datasets_path, sep="\t")
+    metagene_files = set()
+    for project_metadata_path in datasets.project_metadata_path:
+        if not os.path.exists(project_metadata_path):
+            continue
+        summary_df = pd.read_csv(project_metadata_path, sep="\t")
+        metagene_files.update(summary_df.ribotricer_metagene_5p.dropna().tolist())
+    return sorted(metagene_files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "metagene_files",
+        nargs="*",
+        help="Metagene profiles to convert (default: all in --datasets)",
+    )
+    parser.add_argument("--datasets", default="/data2/datasets.tsv")
+    parser.add_argument(
+        "--force", action="store_true", help="Rewrite stores that are up to date"
+    )
+    args = parser.parse_args()
+
+    metagene_files = args.metagene_files or get_metagene_files(args.datasets)
+    converted = 0
+    for file_path in metagene_files:
+        if not args.force and metagene_store_exists(file_path):
+            continue
+        try:
+            write_metagene_store(file_path)
+        except Exception as e:
+            print("Unable to convert {}: {}".format(file_path, e))
+            continue
+        converted += 1
+    print("Converted {} of {} metagene profiles".format(converted, len(metagene_files)))
+
+
+if __name__ == "__main__":
+    main()
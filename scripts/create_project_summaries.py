@@ -5,16 +5,31 @@
 
 
 from collections import defaultdict
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 #from pysradb import SRAdb
-from pysradb.sraweb import SRAweb
+import argparse
+import hashlib
+import itertools
+import json
 import os
 import glob
+import pickle
+import sys
+import numpy as np
 import pandas as pd
 from riboraptor.helpers import path_leaf, parse_star_logs, millify, order_dataframe
 from riboraptor.cutadapt_to_json import cutadapt_to_json
 from riboraptor.utils import summary_starlogs_over_runs, mkdir_p
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fragment_length_helper import get_project_bam_summary_files
+from fragment_length_helper import load_read_length_matrix, write_read_length_matrix
+from metagene_helper import phase_scores_to_matrix
+from sra_metadata_cache import SRAMetadataCache, SRA_METADATA_TTL_DAYS
+from sra_metadata_cache import add_fetch_arguments, get_fetcher, prefetch
+
 
 ROOT_DIRS = [
     "/data1/re-ribo-analysis",
@@ -27,17 +42,147 @@ ROOT_DIRS_SUMMARY = ["/data2/re-ribo-analysis-summary-tables"]
 ORF_TABLES_DIRNAME = "re-ribo-analysis-orf-tables"
 
 
+# Suffix of each ribotricer output inside ribotricer_results, by artifact type
+RIBOTRICER_ARTIFACTS = OrderedDict(
+    [
+        ("translating_orfs", "_translating_ORFs.tsv"),
+        ("metagene_5p", "_metagene_profiles_5p.tsv"),
+        ("metagene_3p", "_metagene_profiles_3p.tsv"),
+        ("metagene_plot", "_metagene_plots.pdf"),
+        ("protocol", "_protocol.txt"),
+        ("bam_summary", "_bam_summary.txt"),
+    ]
+)
+# Suffix of each project level table inside ORF_TABLES_DIRNAME
+SUMMARY_ARTIFACTS = OrderedDict(
+    [
+        ("summarized_orfs", "_summarized_orfs.tsv"),
+        ("summarized_phase_scores", "_summarized_phase_scores.tsv"),
+    ]
+)
+INVENTORY_CACHE_PATH = "/data2/re-ribo-analysis-metadata/inventory.pkl"
+
+# Keys as (assembly, srp, srx, artifact type), value as path.
+# srx is None for project level tables.
+__INVENTORY__ = {}
+# SRAMetadataCache used by get_srp_table, set by main
+__SRA_METADATA__ = None
+# Keys as metagene profile path, value as entry of scan_metagene_headers
+__METAGENE_HEADERS__ = {}
+
+
+def _scandir_names(path, directories=False):
+    """List entry names of a directory, empty if it does not exist."""
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return []
+    return [
+        entry.name
+        for entry in entries
+        if not entry.name.startswith(".") and (not directories or entry.is_dir())
+    ]
+
+
+def _match_artifact(filename, artifacts):
+    for artifact, suffix in artifacts.items():
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)], artifact
+    return None, None
+
+
+def build_inventory():
+    """Scan ROOT_DIRS and ROOT_DIRS_SUMMARY once for ribotricer outputs.
+
+    Each ribotricer_results directory is listed with a single
+    os.scandir call. When an output exists under more than one root
+    dir, the first one in ROOT_DIRS is kept.
+
+    Returns
+    -------
+    inventory: dict
+               Keys as (assembly, srp, srx, artifact type), value as path
+    assembly_wise_srp: dict
+                       Keys as assembly, value as list of SRPs
+    srp_to_root_dir_map: dict
+                         Keys as SRP, value as dict of assembly to SRP directory
+    """
+    inventory = {}
+    assembly_wise_srp = defaultdict(list)
+    srp_to_root_dir_map = defaultdict(dict)
+    for root_dir in ROOT_DIRS:
+        for assembly in _scandir_names(root_dir, directories=True):
+            assembly_dir = os.path.join(root_dir, assembly)
+            for srp in _scandir_names(assembly_dir, directories=True):
+                srp_dir = os.path.join(assembly_dir, srp)
+                assembly_wise_srp[assembly].append(srp)
+                srp_to_root_dir_map[srp][assembly] = srp_dir
+                results_dir = os.path.join(srp_dir, "ribotricer_results")
+                for filename in _scandir_names(results_dir):
+                    srx, artifact = _match_artifact(filename, RIBOTRICER_ARTIFACTS)
+                    if artifact:
+                        inventory.setdefault(
+                            (assembly, srp, srx, artifact),
+                            os.path.join(results_dir, filename),
+                        )
+    for root_dir in ROOT_DIRS_SUMMARY:
+        for assembly in _scandir_names(root_dir, directories=True):
+            tables_dir = os.path.join(root_dir, assembly, ORF_TABLES_DIRNAME)
+            for filename in _scandir_names(tables_dir):
+                srp, artifact = _match_artifact(filename, SUMMARY_ARTIFACTS)
+                if artifact:
+                    inventory.setdefault(
+                        (assembly, srp, None, artifact),
+                        os.path.join(tables_dir, filename),
+                    )
+    return inventory, assembly_wise_srp, srp_to_root_dir_map
+
+
+def save_inventory(inventory_path, inventory, assembly_wise_srp, srp_to_root_dir_map):
+    """Cache output of build_inventory to disk."""
+    tmp_path = "{}.{}.tmp".format(inventory_path, os.getpid())
+    with open(tmp_path, "wb") as fh:
+        pickle.dump((inventory, dict(assembly_wise_srp), dict(srp_to_root_dir_map)), fh)
+    os.rename(tmp_path, inventory_path)
+
+
+def load_inventory(inventory_path):
+    """Load inventory cached by save_inventory."""
+    with open(inventory_path, "rb") as fh:
+        inventory, assembly_wise_srp, srp_to_root_dir_map = pickle.load(fh)
+    return (
+        inventory,
+        defaultdict(list, assembly_wise_srp),
+        defaultdict(dict, srp_to_root_dir_map),
+    )
+
+
+def set_inventory(inventory):
+    """Set the inventory used by the check_* functions."""
+    global __INVENTORY__
+    __INVENTORY__ = inventory
+
+
+def set_sra_metadata_cache(sra_metadata_cache):
+    """Set the SRAMetadataCache used by get_srp_table."""
+    global __SRA_METADATA__
+    __SRA_METADATA__ = sra_metadata_cache
+
+
+def set_metagene_headers(metagene_headers):
+    """Set the scanned metagene profiles used by get_phase_scores."""
+    global __METAGENE_HEADERS__
+    __METAGENE_HEADERS__ = metagene_headers
+
+
+def _init_worker(inventory, sra_metadata_cache, metagene_headers):
+    set_inventory(inventory)
+    set_sra_metadata_cache(sra_metadata_cache)
+    set_metagene_headers(metagene_headers)
+
+
 def check_ribotricer_output_exists(srp, srx, assembly):
-    for rootdir in ROOT_DIRS:
-        path = os.path.join(
-            rootdir,
-            assembly,
-            srp,
-            "ribotricer_results",
-            "{}_translating_ORFs.tsv".format(srx),
-        )
-        if os.path.exists(path):
-            return path
+    return __INVENTORY__.get((assembly, srp, srx, "translating_orfs"))
 
 
 def summarise_ribotricer_output_exists(path):
@@ -46,86 +191,30 @@ def summarise_ribotricer_output_exists(path):
 
 
 def check_ribotricer_metagene_exists(srp, srx, assembly):
-    for rootdir in ROOT_DIRS:
-        path_5p = os.path.join(
-            rootdir,
-            assembly,
-            srp,
-            "ribotricer_results",
-            "{}_metagene_profiles_5p.tsv".format(srx),
-        )
-        path_3p = os.path.join(
-            rootdir,
-            assembly,
-            srp,
-            "ribotricer_results",
-            "{}_metagene_profiles_3p.tsv".format(srx),
-        )
-        path_5p_tsv = None
-        path_3p_tsv = None
-        if os.path.exists(path_5p):
-            path_5p_tsv = path_5p
-        if os.path.exists(path_3p):
-            path_3p_tsv = path_3p
-        if os.path.exists(path_5p) or os.path.exists(path_3p):
-            return path_5p_tsv, path_3p_tsv
-    return None, None
+    return (
+        __INVENTORY__.get((assembly, srp, srx, "metagene_5p")),
+        __INVENTORY__.get((assembly, srp, srx, "metagene_3p")),
+    )
 
 
 def check_ribotricer_metagene_plot_exists(srp, srx, assembly):
-    for rootdir in ROOT_DIRS:
-        path = os.path.join(
-            rootdir,
-            assembly,
-            srp,
-            "ribotricer_results",
-            "{}_metagene_plots.pdf".format(srx),
-        )
-        if os.path.exists(path):
-            return path
+    return __INVENTORY__.get((assembly, srp, srx, "metagene_plot"))
 
 
 def check_ribotricer_protocol_exists(srp, srx, assembly):
-    for rootdir in ROOT_DIRS:
-        path = os.path.join(
-            rootdir, assembly, srp, "ribotricer_results", "{}_protocol.txt".format(srx)
-        )
-        if os.path.exists(path):
-            return path
+    return __INVENTORY__.get((assembly, srp, srx, "protocol"))
 
 
 def check_ribotricer_bam_summary_exists(srp, srx, assembly):
-    for rootdir in ROOT_DIRS:
-        path = os.path.join(
-            rootdir,
-            assembly,
-            srp,
-            "ribotricer_results",
-            "{}_bam_summary.txt".format(srx),
-        )
-        if os.path.exists(path):
-            return path
+    return __INVENTORY__.get((assembly, srp, srx, "bam_summary"))
 
 
 def check_summarized_orfs_exists(srp, assembly):
-    for rootdir in ROOT_DIRS_SUMMARY:
-        path = os.path.join(
-            rootdir, assembly, ORF_TABLES_DIRNAME, "{}_summarized_orfs.tsv".format(srp)
-        )
-        if os.path.exists(path):
-            return path
+    return __INVENTORY__.get((assembly, srp, None, "summarized_orfs"))
 
 
 def check_summarized_phase_scores_exists(srp, assembly):
-    for rootdir in ROOT_DIRS_SUMMARY:
-        path = os.path.join(
-            rootdir,
-            assembly,
-            ORF_TABLES_DIRNAME,
-            "{}_summarized_phase_scores.tsv".format(srp),
-        )
-        if os.path.exists(path):
-            return path
+    return __INVENTORY__.get((assembly, srp, None, "summarized_phase_scores"))
 
 
 # In[14]:
@@ -172,9 +261,190 @@ def create_df_from_dir(rootdir):
 # In[15]:
 
 
+# Columns added to the SRA metadata, in order, from the results of each run
+RUN_COLUMNS = [
+    "pass1_reads_with_adapters",
+    "pass1_total_reads_processed",
+    "pass1_adapter",
+    "pass2_adapter",
+    "pass2_total_reads_processed",
+    "pass2_reads_with_adapters",
+    "mapping_total_reads_input",
+    "uniquely_mapped",
+    "uniquely_mapped_percent",
+]
+# and from the ribotricer results of each experiment
+EXPERIMENT_COLUMNS = [
+    "ribotricer_orfs",
+    "ribotricer_metagene_5p",
+    "ribotricer_metagene_3p",
+    "ribotricer_metagene_plot",
+    "ribotricer_protocol",
+    "ribotricer_bam_summary",
+]
+
+
+def collect_run_record(srr, starlogsdir, preprocess_step1_dir, preprocess_step2_dir):
+    """Collect cutadapt and STAR results of a run.
+
+    Returns
+    -------
+    record: dict
+            Keys as run_accession and the RUN_COLUMNS found for the run
+    """
+    record = {"run_accession": srr}
+    starlogs_df = None
+    if os.path.isfile(os.path.join(starlogsdir, srr + "Log.final.out")):
+        starlogs_df = parse_star_logs(os.path.join(starlogsdir, srr + "Log.final.out"))
+    # Preprocessed_step1 adapter info
+    step1_txt = os.path.join(
+        preprocess_step1_dir, srr + ".fastq.gz_trimming_report.txt"
+    )
+    step2_txt = os.path.join(
+        preprocess_step2_dir, srr + "_trimmed.fq.gz_trimming_report.txt"
+    )
+    step1_cutadapt_json = None
+    step2_cutadapt_json = None
+
+    if os.path.isfile(step1_txt):
+        step1_cutadapt_json = cutadapt_to_json(step1_txt)
+
+    if os.path.isfile(step2_txt):
+        step2_cutadapt_json = cutadapt_to_json(step2_txt)
+
+    if step1_cutadapt_json:
+        adapters = step1_cutadapt_json["adapters"]
+        if len(adapters) == 0:
+            record["pass1_adapter"] = "Empty?"
+        elif isinstance(adapters, str):
+            record["pass1_adapter"] = adapters
+        else:
+            record["pass1_adapter"] = adapters["{} - {}".format(srr, "Adapter 1")]
+            trim_info1 = step1_cutadapt_json["trim_info"][srr]
+            record["pass1_total_reads_processed"] = trim_info1["r_processed"]
+            record["pass1_reads_with_adapters"] = trim_info1["r_with_adapters"]
+    if step2_cutadapt_json:
+        adapters = step2_cutadapt_json["adapters"]
+        if len(adapters) == 0:
+            record["pass2_adapter"] = "Empty?"
+        elif isinstance(adapters, str):
+            record["pass2_adapter"] = adapters
+        else:
+            record["pass2_adapter"] = adapters[
+                "{} - {}".format(srr + "_trimmed", "Adapter 1")
+            ]
+            trim_info2 = step2_cutadapt_json["trim_info"][srr + "_trimmed"]
+            record["pass2_reads_with_adapters"] = trim_info2["r_with_adapters"]
+            record["pass2_total_reads_processed"] = trim_info2["r_processed"]
+
+    if starlogs_df:
+        record["mapping_total_reads_input"] = starlogs_df["total_reads"]
+        record["uniquely_mapped"] = starlogs_df["uniquely_mapped"]
+        record["uniquely_mapped_percent"] = starlogs_df["uniquely_mapped_percent"]
+    return record
+
+
+def collect_run_records(srp, assembly, srpdir, srp_df):
+    """Collect ribotricer, cutadapt and STAR results of every run in a project.
+
+    Parameters
+    ----------
+    srp: string
+         SRP ID
+    assembly: string
+              Assembly build
+    srpdir: string
+            Directory with the project's results
+    srp_df: pd.DataFrame
+            SRA metadata of the project
+
+    Returns
+    -------
+    experiment_records: list
+                        One dict per experiment, see EXPERIMENT_COLUMNS
+    run_records: list
+                 One dict per run, see collect_run_record
+    """
+    starlogsdir = os.path.join(srpdir, "starlogs")
+    preprocess_step1_dir = os.path.join(srpdir, "preprocessed_step1")
+    preprocess_step2_dir = os.path.join(srpdir, "preprocessed")
+    experiment_records = []
+    run_records = []
+    for srx, srx_group in srp_df.groupby("experiment_accession"):
+        (
+            ribotricer_metagene_5p,
+            ribotricer_metagene_3p,
+        ) = check_ribotricer_metagene_exists(srp, srx, assembly)
+        experiment_records.append(
+            {
+                "experiment_accession": srx,
+                "ribotricer_orfs": check_ribotricer_output_exists(srp, srx, assembly),
+                "ribotricer_metagene_5p": ribotricer_metagene_5p,
+                "ribotricer_metagene_3p": ribotricer_metagene_3p,
+                "ribotricer_metagene_plot": check_ribotricer_metagene_plot_exists(
+                    srp, srx, assembly
+                ),
+                "ribotricer_protocol": check_ribotricer_protocol_exists(
+                    srp, srx, assembly
+                ),
+                "ribotricer_bam_summary": check_ribotricer_bam_summary_exists(
+                    srp, srx, assembly
+                ),
+            }
+        )
+        for srr in srx_group["run_accession"].tolist():
+            run_records.append(
+                collect_run_record(
+                    srr, starlogsdir, preprocess_step1_dir, preprocess_step2_dir
+                )
+            )
+    return experiment_records, run_records
+
+
+def merge_run_records(srp_df, experiment_records, run_records):
+    """Add collected results to the SRA metadata of a project.
+
+    Parameters
+    ----------
+    srp_df: pd.DataFrame
+            SRA metadata of the project
+    experiment_records: list
+                        As returned by collect_run_records
+    run_records: list
+                 As returned by collect_run_records
+
+    Returns
+    -------
+    srp_df: pd.DataFrame
+            Copy of srp_df with RUN_COLUMNS and EXPERIMENT_COLUMNS,
+            None where a result is missing
+    """
+    # object dtype keeps counts as int instead of float next to missing values
+    experiment_df = pd.DataFrame(
+        experiment_records,
+        columns=["experiment_accession"] + EXPERIMENT_COLUMNS,
+        dtype=object,
+    ).dropna(subset=["experiment_accession"])
+    run_df = (
+        pd.DataFrame(run_records, columns=["run_accession"] + RUN_COLUMNS, dtype=object)
+        .dropna(subset=["run_accession"])
+        .drop_duplicates("run_accession", keep="last")
+    )
+    # A left merge keeps the rows of srp_df in order
+    merged = (
+        srp_df[["experiment_accession", "run_accession"]]
+        .merge(experiment_df, on="experiment_accession", how="left")
+        .merge(run_df, on="run_accession", how="left")
+    )
+    srp_df = srp_df.copy()
+    for column in RUN_COLUMNS + EXPERIMENT_COLUMNS:
+        values = merged[column].values
+        srp_df[column] = np.where(pd.isnull(values), None, values)
+    return srp_df
+
+
 def get_srp_table(srp, assembly, re_ribo_analysis_dir):
     #sradb = SRAdb("/data2/SRAmetadb.sqlite")
-    sradb = SRAweb()
     column_order = [
         "study_accession",
         "experiment_title",
@@ -205,10 +475,10 @@ def get_srp_table(srp, assembly, re_ribo_analysis_dir):
     if os.path.exists(filepath):
 
         try:
-            srp_df = sradb.sra_metadata(
-                srp.split("_")[0], detailed=True
-            )  # , expand_sample_attributes=True)
-        except:
+            sra_metadata = __SRA_METADATA__ or SRAMetadataCache()
+            srp_df = sra_metadata.get_or_fetch(srp.split("_")[0])
+        except Exception as e:
+            print("No SRA metadata for {}, using {}: {}".format(srp, filepath, e))
             if "Kadosh" in filepath and "Kadosh_30C_37C" not in filepath:
                 srp_df = pd.read_csv(
                     "/data2/Kadosh_design_files/{}.tsv".format(srp), sep="\t"
@@ -223,154 +493,11 @@ def get_srp_table(srp, assembly, re_ribo_analysis_dir):
             srp_df["library_layout"] = "SINGLE"
         srp_df = srp_df[srp_df.library_layout.str.contains("SINGLE")]
 
-        srp_df["pass1_reads_with_adapters"] = None
-        srp_df["pass1_total_reads_processed"] = None
-        srp_df["pass1_adapter"] = None
-        srp_df["pass2_adapter"] = None
-        srp_df["pass2_total_reads_processed"] = None
-        srp_df["pass2_reads_with_adapters"] = None
-        srp_df["mapping_total_reads_input"] = None
-        srp_df["uniquely_mapped"] = None
-        srp_df["uniquely_mapped_percent"] = None
-        srp_df["ribotricer_orfs"] = None
-        srp_df["ribotricer_metagene_5p"] = None
-        srp_df["ribotricer_metagene_3p"] = None
-
-        srp_df["ribotricer_metagene_plot"] = None
-        srp_df["ribotricer_protocol"] = None
-        srp_df["ribotricer_bam_summary"] = None
-        # srp_df["summarized_orfs"] = None
-        # srp_df["summarized_phase_scores"] = None
-
         srpdir = os.path.join(re_ribo_analysis_dir, assembly, srp)
-        starlogsdir = os.path.join(srpdir, "starlogs")
-        srp_srx_grouped = srp_df.groupby("experiment_accession")
-        preprocess_step1_dir = os.path.join(srpdir, "preprocessed_step1")
-        preprocess_step2_dir = os.path.join(srpdir, "preprocessed")
-        for srx, srx_group in srp_srx_grouped:
-            ribotricer_output = check_ribotricer_output_exists(srp, srx, assembly)
-            (
-                ribotricer_metagene_5p,
-                ribotricer_metagene_3p,
-            ) = check_ribotricer_metagene_exists(srp, srx, assembly)
-
-            ribotricer_bam_summary = check_ribotricer_bam_summary_exists(
-                srp, srx, assembly
-            )
-            ribotricer_protocol = check_ribotricer_protocol_exists(srp, srx, assembly)
-            ribotricer_metagene_plot = check_ribotricer_metagene_plot_exists(
-                srp, srx, assembly
-            )
-
-            # summarized_orfs = check_summarized_orfs_exists(srp, assembly)
-            # summarized_phase_score = check_summarized_orfs_exists(srp, assembly)
-
-            srrs = srx_group["run_accession"].tolist()
-            if ribotricer_output:
-                srp_df.loc[
-                    srp_df.experiment_accession == srx, "ribotricer_orfs"
-                ] = ribotricer_output
-
-            srp_df.loc[
-                srp_df.experiment_accession == srx, "ribotricer_metagene_5p"
-            ] = ribotricer_metagene_5p
-            srp_df.loc[
-                srp_df.experiment_accession == srx, "ribotricer_metagene_3p"
-            ] = ribotricer_metagene_3p
-
-            srp_df.loc[
-                srp_df.experiment_accession == srx, "ribotricer_bam_summary"
-            ] = ribotricer_bam_summary
-            srp_df.loc[
-                srp_df.experiment_accession == srx, "ribotricer_protocol"
-            ] = ribotricer_protocol
-            srp_df.loc[
-                srp_df.experiment_accession == srx, "ribotricer_metagene_plot"
-            ] = ribotricer_metagene_plot
-            # srp_df.loc[srp_df.experiment_accession == srx, "summarized_orfs"] = summarized_orfs
-            # srp_df.loc[srp_df.experiment_accession == srx, "summarized_phase_scores"] = summarized_phase_score
-
-            # starlogs_df = summary_starlogs_over_runs(starlogsdir, srrs)
-
-            for srr in srrs:
-                starlogs_df = None
-                if os.path.isfile(os.path.join(starlogsdir, srr + "Log.final.out")):
-                    starlogs_df = parse_star_logs(
-                        os.path.join(starlogsdir, srr + "Log.final.out")
-                    )
-                # Preprocessed_step1 adapter info
-                step1_txt = os.path.join(
-                    preprocess_step1_dir, srr + ".fastq.gz_trimming_report.txt"
-                )
-                step2_txt = os.path.join(
-                    preprocess_step2_dir, srr + "_trimmed.fq.gz_trimming_report.txt"
-                )
-                step1_cutadapt_json = None
-                step2_cutadapt_json = None
-
-                if os.path.isfile(step1_txt):
-                    step1_cutadapt_json = cutadapt_to_json(step1_txt)
-
-                if os.path.isfile(step2_txt):
-                    step2_cutadapt_json = cutadapt_to_json(step2_txt)
-
-                if step1_cutadapt_json:
-                    adapters = step1_cutadapt_json["adapters"]
-                    if len(step1_cutadapt_json["adapters"]) == 0:
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass1_adapter"
-                        ] = "Empty?"
-                    elif isinstance(adapters, str):
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass1_adapter"
-                        ] = step1_cutadapt_json["adapters"]
-                    else:
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass1_adapter"
-                        ] = step1_cutadapt_json["adapters"][
-                            "{} - {}".format(srr, "Adapter 1")
-                        ]
-                        trim_info1 = step1_cutadapt_json["trim_info"][srr]
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass1_total_reads_processed"
-                        ] = trim_info1["r_processed"]
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass1_reads_with_adapters"
-                        ] = trim_info1["r_with_adapters"]
-                if step2_cutadapt_json:
-                    adapters = step2_cutadapt_json["adapters"]
-                    if len(step2_cutadapt_json["adapters"]) == 0:
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass2_adapter"
-                        ] = "Empty?"
-                    elif isinstance(adapters, str):
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass2_adapter"
-                        ] = step2_cutadapt_json["adapters"]
-                    else:
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass2_adapter"
-                        ] = step2_cutadapt_json["adapters"][
-                            "{} - {}".format(srr + "_trimmed", "Adapter 1")
-                        ]
-                        trim_info2 = step2_cutadapt_json["trim_info"][srr + "_trimmed"]
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass2_reads_with_adapters"
-                        ] = trim_info2["r_with_adapters"]
-                        srp_df.loc[
-                            srp_df.run_accession == srr, "pass2_total_reads_processed"
-                        ] = trim_info2["r_processed"]
-
-                if starlogs_df:
-                    srp_df.loc[
-                        srp_df.run_accession == srr, "mapping_total_reads_input"
-                    ] = starlogs_df["total_reads"]
-                    srp_df.loc[
-                        srp_df.run_accession == srr, "uniquely_mapped"
-                    ] = starlogs_df["uniquely_mapped"]
-                    srp_df.loc[
-                        srp_df.run_accession == srr, "uniquely_mapped_percent"
-                    ] = starlogs_df["uniquely_mapped_percent"]
+        experiment_records, run_records = collect_run_records(
+            srp, assembly, srpdir, srp_df
+        )
+        srp_df = merge_run_records(srp_df, experiment_records, run_records)
 
         cols = [
             "bases",
@@ -387,7 +514,6 @@ def get_srp_table(srp, assembly, re_ribo_analysis_dir):
                 srp_df[col] = srp_df[col].apply(lambda z: millify(z))
             except:
                 pass
-        sradb.close()
         return order_dataframe(srp_df, column_order)
 
 
@@ -398,115 +524,495 @@ READ_LENGTH_DIRNAME = "read_lengths"
 METAGENE_COVERAGE_DIRNAME = "metagene_coverages"
 METAGENE_LENWISE_COVERAGE_DIRNAME = "metagene_coverage_lengthwise"
 
-# Top level directory of the directories inside each of the ROOT_DIRS
-__ASSEMBLIES__ = [os.listdir(dirname) for dirname in ROOT_DIRS]
 __SPECIES__ = [
     {"label": "H.sapiens", "value": "hg38"},
     {"label": "M.musculus", "value": "mm10"},
     {"label": "C.albicans", "value": "SC5314"},
 ]
-__ASSEMBLIES__ = list(
-    sorted(set([item for sublist in __ASSEMBLIES__ for item in sublist]))
-)
-__ASSEMBLY_WISE_SRP__ = defaultdict(list)
-__SRP_TO_ROOT_DIR_MAP__ = defaultdict(dict)
+METADATA_DIR = "/data2/re-ribo-analysis-metadata"
+DATASETS_PATH = "/data2/datasets.tsv"
+DATASETS_COLUMNS = [
+    "species",
+    "srp",
+    "project_output_path",
+    "project_metadata_path",
+    "fragment_lengths",
+    "summarized_orfs",
+    "summarized_phase_scores",
+    "phase_score_matrix",
+    "read_length_matrix",
+]
 
 # DATASETS = {"hg38": pd.read_csv("/data1/hg_datasets.tsv", sep="\t"),
 #            "mm10": pd.read_csv("/data1/mm_datasets.tsv", sep="\t")}
 
-for root_dir in ROOT_DIRS:
-    for assembly_build in os.listdir(root_dir):
-        for srp_dir in filter(
-            os.path.isdir, glob.glob(os.path.join(root_dir, assembly_build, "*"))
-        ):
-            srp = os.path.basename(srp_dir)
-            __ASSEMBLY_WISE_SRP__[assembly_build].append(srp)
-            __SRP_TO_ROOT_DIR_MAP__[srp][assembly_build] = os.path.join(
-                root_dir, assembly_build, srp
-            )
+MANIFEST_PATH = os.path.join(METADATA_DIR, "manifest.json")
+# Bump when DATASETS_COLUMNS or the files written per project change, so
+# that --incremental rebuilds projects summarized by an older version
+MANIFEST_VERSION = 2
+SRA_METADATA_CACHE_PATH = os.path.join(METADATA_DIR, "sra_metadata.sqlite")
+# Directories of a project whose contents go into its metadata table
+PROJECT_INPUT_DIRNAMES = [
+    "ribotricer_results",
+    "starlogs",
+    "preprocessed_step1",
+    "preprocessed",
+]
+
 
+def fingerprint_project(species, srp):
+    """Fingerprint the inputs of a project's metadata table.
 
-__ASSEMBLY_WISE_SRP__ = defaultdict(list)
-__SRP_TO_ROOT_DIR_MAP__ = defaultdict(dict)
-for root_dir in ROOT_DIRS:
-    for assembly_build in os.listdir(root_dir):
-        for srp_dir in filter(
-            os.path.isdir, glob.glob(os.path.join(root_dir, assembly_build, "*"))
+    The name, size and mtime of every file in the project's
+    PROJECT_INPUT_DIRNAMES, under every root dir, and of its
+    summary tables are hashed together.
+
+    Parameters
+    ----------
+    species: string
+             Assembly build
+    srp: string
+         SRP ID
+
+    Returns
+    -------
+    fingerprint: string
+                 Hex digest, changes whenever an input is added,
+                 removed or modified
+    """
+    stats = []
+    for root_dir in ROOT_DIRS:
+        for dirname in PROJECT_INPUT_DIRNAMES:
+            input_dir = os.path.join(root_dir, species, srp, dirname)
+            try:
+                entries = list(os.scandir(input_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                stats.append((input_dir, entry.name, stat.st_size, stat.st_mtime_ns))
+    for artifact in SUMMARY_ARTIFACTS:
+        path = __INVENTORY__.get((species, srp, None, artifact))
+        if not path:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Listed by a reused inventory but removed since
+            continue
+        stats.append((path, "", stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(sorted(stats)).encode("utf-8")).hexdigest()
+
+
+def load_manifest(manifest_path):
+    """Load the manifest written by the previous run.
+
+    Returns
+    -------
+    manifest: dict
+              'projects' with keys as 'species/srp' and value as
+              fingerprint, 'metagene_headers' as returned by
+              scan_metagene_headers. Both are empty if no manifest
+              was written yet, 'projects' also if it was written by
+              another MANIFEST_VERSION.
+    """
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    if manifest.get("version") != MANIFEST_VERSION:
+        manifest.pop("projects", None)
+    manifest.setdefault("projects", {})
+    manifest.setdefault("metagene_headers", {})
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    """Write the manifest for the next run."""
+    tmp_path = "{}.{}.tmp".format(manifest_path, os.getpid())
+    with open(tmp_path, "w") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.rename(tmp_path, manifest_path)
+
+
+def load_datasets_rows(datasets_path):
+    """Read rows of an existing datasets.tsv.
+
+    Returns
+    -------
+    rows: dict
+          Keys as (species, srp), value as row tuple in the
+          order of DATASETS_COLUMNS
+    """
+    if not os.path.exists(datasets_path):
+        return {}
+    datasets = pd.read_csv(datasets_path, sep="\t")
+    datasets = datasets.reindex(columns=DATASETS_COLUMNS)
+    return {
+        (row[0], row[1]): row for row in datasets.itertuples(index=False, name=None)
+    }
+
+
+def scan_metagene_header(file_path):
+    """Get phase score of each fragment length in a metagene profile.
+
+    Only the fragment length and the fields after the profile are split
+    out of each line, the profile itself is never parsed. Both the
+    headered layout and the old headerless fragment_length, offset_5p,
+    profile layout are handled in one pass.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to metagene 5p profile
+
+    Returns
+    -------
+    phase_scores: pd.Series
+                  Phase scores indexed by fragment length, NaN for
+                  old ribotricer output that did not report them
+    """
+    fragment_lengths = []
+    phase_scores = []
+    with open(file_path, "rb") as fh:
+        first_line = fh.readline()
+        if first_line.startswith(b"fragment_length"):
+            header = first_line.rstrip(b"\r\n").split(b"\t")
+            lines = fh
+        else:
+            header = [b"fragment_length", b"offset_5p", b"profile"]
+            lines = itertools.chain([first_line], fh)
+        # Fields after the profile are split from the right of each line
+        if b"profile" in header:
+            n_trailing = len(header) - header.index(b"profile") - 1
+        else:
+            n_trailing = len(header) - 1
+        phase_score_index = None
+        if b"phase_score" in header:
+            phase_score_index = header.index(b"phase_score") - len(header)
+        for line in lines:
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue
+            fragment_lengths.append(int(line[: line.index(b"\t")]))
+            phase_score = b""
+            if phase_score_index is not None:
+                phase_score = line.rsplit(b"\t", n_trailing)[phase_score_index]
+            phase_scores.append(float(phase_score) if phase_score else np.nan)
+    return pd.Series(
+        phase_scores,
+        index=pd.Index(fragment_lengths, name="fragment_length"),
+        name="phase_score",
+    )
+
+
+def _scan_metagene_header_entry(file_path):
+    try:
+        phase_scores = scan_metagene_header(file_path)
+    except Exception as e:
+        print("Unable to scan {}: {}".format(file_path, e))
+        return None
+    return {
+        "fragment_lengths": phase_scores.index.tolist(),
+        # NaN is not valid JSON
+        "phase_scores": [
+            None if np.isnan(phase_score) else phase_score
+            for phase_score in phase_scores
+        ],
+    }
+
+
+def scan_metagene_headers(file_paths, previous_headers, jobs=1):
+    """Scan metagene profiles, reusing results of unchanged files.
+
+    Parameters
+    ----------
+    file_paths: list
+                Paths to metagene 5p profiles
+    previous_headers: dict
+                      Keys as path, value as entry returned by a previous run
+    jobs: int
+          Number of files to scan in parallel
+
+    Returns
+    -------
+    metagene_headers: dict
+                      Keys as path, value as dict of size, mtime_ns,
+                      fragment_lengths and phase_scores. Files that could
+                      not be scanned are left out.
+    """
+    metagene_headers = {}
+    to_scan = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        entry = previous_headers.get(file_path)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
         ):
-            srp = os.path.basename(srp_dir)
-            __ASSEMBLY_WISE_SRP__[assembly_build].append(srp)
-            __SRP_TO_ROOT_DIR_MAP__[srp][assembly_build] = os.path.join(
-                root_dir, assembly_build, srp
+            metagene_headers[file_path] = entry
+        else:
+            to_scan.append((file_path, stat))
+    print("Scanning {} of {} metagene profiles".format(len(to_scan), len(file_paths)))
+    scan_paths = [file_path for file_path, _ in to_scan]
+    if jobs > 1 and len(scan_paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            entries = list(
+                executor.map(_scan_metagene_header_entry, scan_paths, chunksize=16)
             )
+    else:
+        entries = list(map(_scan_metagene_header_entry, scan_paths))
+    for (file_path, stat), entry in zip(to_scan, entries):
+        if entry is None:
+            continue
+        entry["size"] = stat.st_size
+        entry["mtime_ns"] = stat.st_mtime_ns
+        metagene_headers[file_path] = entry
+    return metagene_headers
 
 
+def get_phase_scores(file_path):
+    """Get phase score of each fragment length in a metagene profile.
 
-def get_fragment_lengths(file_path):
-    try:
-        return pd.read_csv(file_path, sep="\t").fragment_length.tolist()
-    except:
-        # Handle 3 headed files
-        df = pd.read_csv(file_path, header=None, sep="\t")
-        df.columns = ["fragment_length", "offset_5p", "profile"]
-        return df.fragment_length.tolist()
+    Uses the result of scan_metagene_headers when the file was scanned
+    in this run, see scan_metagene_header for the return value.
+    """
+    entry = __METAGENE_HEADERS__.get(file_path)
+    if entry is None:
+        return scan_metagene_header(file_path)
+    return pd.Series(
+        [np.nan if value is None else value for value in entry["phase_scores"]],
+        index=pd.Index(entry["fragment_lengths"], name="fragment_length"),
+        name="phase_score",
+        dtype=float,
+    )
 
 
 # In[21]:
 
 
-db = SRAweb()#SRAdb("/data2/SRAmetadb.sqlite")
-all_projects = []
+def process_project(species, srp, srp_dir):
+    """Create metadata table of a project and its row in datasets.tsv.
 
+    Writes the metadata table, phase score and read length matrices of the project
+    to METADATA_DIR, so it can be run independently for each project.
 
-for species, sample_list in __ASSEMBLY_WISE_SRP__.items():
-    mkdir_p("/data2/re-ribo-analysis-metadata/{}".format(species))
-    for srp in sample_list:
-        basedir = os.path.dirname(
-            os.path.dirname(__SRP_TO_ROOT_DIR_MAP__[srp][species])
+    Parameters
+    ----------
+    species: string
+             Assembly build
+    srp: string
+         SRP ID
+    srp_dir: string
+             Directory with the project's results
+
+    Returns
+    -------
+    row: tuple
+         Row of datasets.tsv in the order of DATASETS_COLUMNS,
+         None for empty project directories
+    """
+    basedir = os.path.dirname(os.path.dirname(srp_dir))
+    if not os.listdir(srp_dir):
+        return None
+    print(srp, basedir)
+    df = get_srp_table(srp, species, basedir)
+    project_filepath = "{}/{}/{}".format(basedir, species, srp)
+    metadata_filepath = "{}/{}/{}.tsv".format(METADATA_DIR, species, srp)
+    df_subset = df[
+        df.ribotricer_metagene_5p == df.ribotricer_metagene_5p
+    ].drop_duplicates("experiment_accession")
+    summarized_orfs = check_summarized_orfs_exists(srp, species)
+    summarized_phase_score = check_summarized_phase_scores_exists(srp, species)
+    fragment_lengths = []
+    phase_scores = OrderedDict()
+    for srx, f in zip(df_subset.experiment_accession, df_subset.ribotricer_metagene_5p):
+        srx_phase_scores = get_phase_scores(f)
+        fragment_lengths += srx_phase_scores.index.tolist()
+        if srx_phase_scores.notnull().any():
+            phase_scores[srx] = srx_phase_scores
+    fragment_lengths = list(sorted(list(set(fragment_lengths))))
+    # Samples x fragment lengths matrix for the phase score heatmap
+    phase_score_filepath = None
+    if phase_scores:
+        phase_score_filepath = "{}/{}/{}_phase_scores.tsv".format(
+            METADATA_DIR, species, srp
         )
-        if not os.listdir(__SRP_TO_ROOT_DIR_MAP__[srp][species]):
-            continue
-        print(srp, basedir)
-        df = get_srp_table(srp, species, basedir)
-        project_filepath = "{}/{}/{}".format(basedir, species, srp)
-        metadata_filepath = "/data2/re-ribo-analysis-metadata/{}/{}.tsv".format(
-            species, srp
+        phase_scores_to_matrix(phase_scores).to_csv(
+            phase_score_filepath, sep="\t", index_label="experiment_accession"
         )
-        df_subset = df[
-            df.ribotricer_metagene_5p == df.ribotricer_metagene_5p
-        ].ribotricer_metagene_5p.tolist()
-        summarized_orfs = check_summarized_orfs_exists(srp, species)
-        summarized_phase_score = check_summarized_phase_scores_exists(srp, species)
-        fragment_lengths = []
-        for f in df_subset:
-            fragment_lengths += get_fragment_lengths(f)
-        fragment_lengths = list(sorted(list(set(fragment_lengths))))
-        all_projects.append(
-            (
-                species,
-                srp,
-                project_filepath,
-                metadata_filepath,
-                str(fragment_lengths),
-                summarized_orfs,
-                summarized_phase_score,
+    df.to_csv(metadata_filepath, sep="\t", index=False, header=True)
+    # Samples x fragment lengths read counts for the read length plot,
+    # from the same samples the app would otherwise read
+    read_length_filepath = None
+    bam_summary_files = get_project_bam_summary_files(metadata_filepath)
+    if bam_summary_files:
+        try:
+            read_length_matrix = load_read_length_matrix(bam_summary_files)
+        except Exception as e:
+            print("Unable to create read length matrix of {}: {}".format(srp, e))
+        else:
+            read_length_filepath = "{}/{}/{}_read_lengths.tsv".format(
+                METADATA_DIR, species, srp
             )
-        )
-        df.to_csv(metadata_filepath, sep="\t", index=False, header=True)
+            write_read_length_matrix(read_length_matrix, read_length_filepath)
+    return (
+        species,
+        srp,
+        project_filepath,
+        metadata_filepath,
+        str(fragment_lengths),
+        summarized_orfs,
+        summarized_phase_score,
+        phase_score_filepath,
+        read_length_filepath,
+    )
 
 
-# In[22]:
+def _process_project(task):
+    return process_project(*task)
 
 
-summary_df = pd.DataFrame(all_projects)
-summary_df.columns = [
-    "species",
-    "srp",
-    "project_output_path",
-    "project_metadata_path",
-    "fragment_lengths",
-    "summarized_orfs",
-    "summarized_phase_scores",
-]
-summary_df = summary_df.sort_values(by=["species", "srp"])
-summary_df.to_csv("/data2/datasets.tsv", sep="\t", index=False, header=True)
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create project metadata tables and datasets.tsv"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of projects to process in parallel"
+    )
+    parser.add_argument(
+        "--reuse-inventory",
+        action="store_true",
+        help="Use the inventory cached by the previous run instead of rescanning",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only reprocess projects whose inputs changed since the last run "
+        "and update their rows in the existing datasets.tsv",
+    )
+    parser.add_argument(
+        "--sra-cache-ttl-days",
+        type=float,
+        default=SRA_METADATA_TTL_DAYS,
+        help="Refetch SRA metadata cached longer ago than this",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use SRA metadata from the local cache, "
+        "see sra_metadata_cache.py to fill it",
+    )
+    parser.add_argument(
+        "--sra-threads",
+        type=int,
+        default=8,
+        help="Maximum concurrent fetches when prefetching SRA metadata",
+    )
+    add_fetch_arguments(parser)
+    args = parser.parse_args()
+
+    if args.reuse_inventory and os.path.exists(INVENTORY_CACHE_PATH):
+        inventory, assembly_wise_srp, srp_to_root_dir_map = load_inventory(
+            INVENTORY_CACHE_PATH
+        )
+    else:
+        inventory, assembly_wise_srp, srp_to_root_dir_map = build_inventory()
+        mkdir_p(os.path.dirname(INVENTORY_CACHE_PATH))
+        save_inventory(
+            INVENTORY_CACHE_PATH, inventory, assembly_wise_srp, srp_to_root_dir_map
+        )
+    set_inventory(inventory)
+    mkdir_p(METADATA_DIR)
+    # Projects only read SRA metadata fetched by the prefetch stage
+    sra_metadata_cache = SRAMetadataCache(
+        SRA_METADATA_CACHE_PATH, ttl_days=args.sra_cache_ttl_days, offline=True
+    )
+    set_sra_metadata_cache(sra_metadata_cache)
+    previous_manifest = load_manifest(MANIFEST_PATH)
+    previous_rows = {}
+    if args.incremental:
+        previous_rows = load_datasets_rows(DATASETS_PATH)
+    manifest = {"version": MANIFEST_VERSION, "projects": {}, "metagene_headers": {}}
+    unchanged_projects = []
+    tasks = []
+    for species, sample_list in assembly_wise_srp.items():
+        mkdir_p("{}/{}".format(METADATA_DIR, species))
+        # An SRP present in more than one root dir is processed once
+        for srp in OrderedDict.fromkeys(sample_list):
+            key = "{}/{}".format(species, srp)
+            manifest["projects"][key] = fingerprint_project(species, srp)
+            if (
+                previous_manifest["projects"].get(key) == manifest["projects"][key]
+                and (species, srp) in previous_rows
+            ):
+                unchanged_projects.append(previous_rows[(species, srp)])
+                continue
+            tasks.append((species, srp, srp_to_root_dir_map[srp][species]))
+    if not args.offline:
+        prefetch(
+            SRAMetadataCache(
+                SRA_METADATA_CACHE_PATH,
+                ttl_days=args.sra_cache_ttl_days,
+                fetcher=get_fetcher(args.sra_url, args.sra_timeout),
+            ),
+            [srp.split("_")[0] for _, srp, _ in tasks],
+            threads=args.sra_threads,
+            retries=args.sra_retries,
+        )
+    if args.incremental:
+        print(
+            "Reprocessing {} of {} projects".format(
+                len(tasks), len(tasks) + len(unchanged_projects)
+            )
+        )
+
+    task_projects = set((species, srp) for species, srp, _ in tasks)
+    metagene_files = sorted(
+        path
+        for (species, srp, _, artifact), path in inventory.items()
+        if artifact == "metagene_5p" and (species, srp) in task_projects
+    )
+    metagene_headers = scan_metagene_headers(
+        metagene_files, previous_manifest["metagene_headers"], jobs=args.jobs
+    )
+    set_metagene_headers(metagene_headers)
+    # Keep scans of unchanged projects for the next run
+    metagene_paths = set(
+        path for key, path in inventory.items() if key[3] == "metagene_5p"
+    )
+    manifest["metagene_headers"] = {
+        path: entry
+        for path, entry in previous_manifest["metagene_headers"].items()
+        if path in metagene_paths
+    }
+    manifest["metagene_headers"].update(metagene_headers)
+
+    if args.jobs > 1:
+        with ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=_init_worker,
+            initargs=(inventory, sra_metadata_cache, metagene_headers),
+        ) as executor:
+            # map() returns rows in the order of tasks
+            all_projects = list(executor.map(_process_project, tasks))
+    else:
+        all_projects = list(map(_process_project, tasks))
+    # Projects no longer on disk are dropped along with their old rows
+    all_projects = unchanged_projects + [row for row in all_projects if row is not None]
+
+    summary_df = pd.DataFrame(all_projects, columns=DATASETS_COLUMNS)
+    summary_df = summary_df.sort_values(by=["species", "srp"])
+    summary_df.to_csv(DATASETS_PATH, sep="\t", index=False, header=True)
+    save_manifest(MANIFEST_PATH, manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Render the default figures of every project in datasets.tsv to disk.
+
+The visualize page serves these instead of rendering on first view
+for as long as the files a figure was drawn from are unchanged, so
+this can be rerun after create_project_summaries.py and only the
+figures of changed projects are rendered again.
+
+Usage:
+    python scripts/prerender_figures.py [--jobs 8] [--force] [--species SC5314] [--srp SRP000001]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps.visualize_page import PRERENDERED_FIGURES
+from cache_helper import __FIGURE_DIR__, prerender_figure
+from init import __DATASETS__
+
+
+def prerender_project(species, srp, force=False):
+    """Render all figures in PRERENDERED_FIGURES for a project.
+
+    Parameters
+    ----------
+    species: string
+    srp: string
+         SRP ID
+    force: bool
+           Render figures that are still fresh on disk too
+
+    Returns
+    -------
+    counts: dict
+            Number of figures rendered, kept and failed
+    """
+    counts = {"rendered": 0, "kept": 0, "failed": 0}
+    for name, (render, files, extra_args) in PRERENDERED_FIGURES.items():
+        try:
+            rendered = prerender_figure(
+                name,
+                [srp, species] + extra_args,
+                files(srp, species),
+                render,
+                force=force,
+            )
+        except Exception as e:
+            print("Unable to render {} of {}/{}: {}".format(name, species, srp, e))
+            counts["failed"] += 1
+            continue
+        counts["rendered" if rendered else "kept"] += 1
+    return counts
+
+
+def _prerender_project(task):
+    return prerender_project(*task)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of projects to render in parallel"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render figures even if the ones on disk are up to date",
+    )
+    parser.add_argument("--species", nargs="*", help="Only render these species")
+    parser.add_argument("--srp", nargs="*", help="Only render these projects")
+    args = parser.parse_args()
+
+    tasks = [
+        (species, srp, args.force)
+        for species, srp in __DATASETS__.records
+        if (not args.species or species in args.species)
+        and (not args.srp or srp in args.srp)
+    ]
+    print("Rendering figures of {} projects to {}".format(len(tasks), __FIGURE_DIR__))
+    start = time.time()
+    totals = {"rendered": 0, "kept": 0, "failed": 0}
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(_prerender_project, tasks))
+    else:
+        results = [_prerender_project(task) for task in tasks]
+    for counts in results:
+        for key, count in counts.items():
+            totals[key] += count
+    print(
+        "{rendered} rendered, {kept} up to date, {failed} failed".format(**totals)
+        + " in {:.1f}s".format(time.time() - start)
+    )
+
+
+if __name__ == "__main__":
+    main()
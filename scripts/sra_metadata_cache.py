@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+"""Local SQLite cache of SRA metadata tables keyed by study accession.
+
+create_project_summaries.py reads project metadata through this cache,
+so rebuilds only hit the network for studies that are missing or older
+than the TTL. With --offline it never hits the network at all.
+
+Usage:
+    python scripts/sra_metadata_cache.py prefetch SRP000001 SRP000002
+    python scripts/sra_metadata_cache.py prefetch --datasets /data2/datasets.tsv
+    python scripts/sra_metadata_cache.py --sra-url 'http://localhost:8000/{}.tsv' prefetch SRP000001
+    python scripts/sra_metadata_cache.py import sra_metadata_fixture.tsv
+    python scripts/sra_metadata_cache.py list
+"""
+
+import argparse
+import io
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+
+import pandas as pd
+
+SRA_METADATA_CACHE_PATH = "/data2/re-ribo-analysis-metadata/sra_metadata.sqlite"
+# Cached tables older than this are refetched unless running offline
+SRA_METADATA_TTL_DAYS = 30
+
+
+def fetch_sra_metadata(study_accession, timeout=None):
+    """Fetch detailed metadata of a study from SRA.
+
+    Parameters
+    ----------
+    study_accession: string
+                     SRP ID
+    timeout: float
+             Seconds to wait for the whole fetch, None to wait forever.
+             SRAweb passes no timeout to its requests, so the fetch
+             runs in a daemon thread that is abandoned once it is
+             exceeded.
+
+    Returns
+    -------
+    srp_df: pd.DataFrame
+            One row per run as returned by SRAweb
+
+    Raises
+    ------
+    TimeoutError
+        If the fetch took longer than timeout
+    """
+    from pysradb.sraweb import SRAweb
+
+    result = {}
+
+    def fetch():
+        sradb = SRAweb()
+        try:
+            result["srp_df"] = sradb.sra_metadata(study_accession, detailed=True)
+        except Exception as e:
+            result["error"] = e
+        finally:
+            sradb.close()
+
+    thread = threading.Thread(target=fetch, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(
+            "Fetching {} took longer than {}s".format(study_accession, timeout)
+        )
+    if "error" in result:
+        raise result["error"]
+    return result["srp_df"]
+
+
+def fetch_sra_metadata_url(study_accession, url_template, timeout=60):
+    """Fetch metadata of a study as a TSV table over HTTP.
+
+    Unlike SRAweb this enforces a timeout on every request.
+
+    Parameters
+    ----------
+    study_accession: string
+                     SRP ID
+    url_template: string
+                  URL with a {} placeholder for the study accession,
+                  e.g. an ENA filereport query or a local stub server
+    timeout: float
+             Seconds to wait for the server
+
+    Returns
+    -------
+    srp_df: pd.DataFrame
+            One row per run
+    """
+    import requests
+
+    response = requests.get(url_template.format(study_accession), timeout=timeout)
+    response.raise_for_status()
+    return pd.read_csv(io.StringIO(response.text), sep="\t", dtype=str)
+
+
+def get_fetcher(url_template=None, timeout=60):
+    """Get the fetcher used to fill the cache.
+
+    Parameters
+    ----------
+    url_template: string
+                  Fetch TSV tables from this URL instead of using SRAweb,
+                  see fetch_sra_metadata_url
+    timeout: float
+             Seconds to wait for each study
+
+    Returns
+    -------
+    fetcher: function
+    """
+    if url_template is None:
+        return partial(fetch_sra_metadata, timeout=timeout)
+    return partial(fetch_sra_metadata_url, url_template=url_template, timeout=timeout)
+
+
+class SRAMetadataCache(object):
+    """SRA metadata tables stored as TSV text in a SQLite database.
+
+    A new connection is opened for every operation, so one instance
+    can be shared by threads and copied to worker processes.
+
+    Parameters
+    ----------
+    db_path: string
+             Path to SQLite database, created if missing
+    ttl_days: float
+              Age after which a cached table is refetched,
+              None to never expire
+    offline: bool
+             Only read the cache, never call fetcher
+    fetcher: function
+             Called with a study accession, returns its metadata table
+    """
+
+    def __init__(
+        self,
+        db_path=SRA_METADATA_CACHE_PATH,
+        ttl_days=SRA_METADATA_TTL_DAYS,
+        offline=False,
+        fetcher=fetch_sra_metadata,
+    ):
+        self.db_path = db_path
+        self.ttl_days = ttl_days
+        self.offline = offline
+        self.fetcher = fetcher
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sra_metadata ("
+                "study_accession TEXT PRIMARY KEY, "
+                "fetched_at REAL NOT NULL, "
+                "metadata TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            # Commits on success, rolls back on error
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def is_fresh(self, fetched_at):
+        if self.ttl_days is None:
+            return True
+        return time.time() - fetched_at < self.ttl_days * 24 * 60 * 60
+
+    def get_entry(self, study_accession):
+        """Get cached table of a study regardless of its age.
+
+        Returns
+        -------
+        entry: tuple
+               (srp_df, fetched_at), None if the study is not cached
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT metadata, fetched_at FROM sra_metadata "
+                "WHERE study_accession = ?",
+                (study_accession,),
+            ).fetchone()
+        if row is None:
+            return None
+        srp_df = pd.read_csv(io.StringIO(row[0]), sep="\t", dtype=str)
+        return srp_df, row[1]
+
+    def get(self, study_accession):
+        """Get cached table of a study, None if missing or expired."""
+        entry = self.get_entry(study_accession)
+        if entry is None or not self.is_fresh(entry[1]):
+            return None
+        return entry[0]
+
+    def put(self, study_accession, srp_df, fetched_at=None):
+        """Cache the metadata table of a study."""
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sra_metadata VALUES (?, ?, ?)",
+                (study_accession, fetched_at, srp_df.to_csv(sep="\t", index=False)),
+            )
+
+    def accessions(self):
+        """List cached study accessions with the time they were fetched."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT study_accession, fetched_at FROM sra_metadata "
+                "ORDER BY study_accession"
+            ).fetchall()
+
+    def fetch(self, study_accession):
+        """Fetch a study with fetcher and cache it."""
+        srp_df = self.fetcher(study_accession)
+        if not isinstance(srp_df, pd.DataFrame):
+            raise ValueError("No SRA metadata found for {}".format(study_accession))
+        self.put(study_accession, srp_df)
+        # Read back so fresh and cached tables have the same dtypes
+        return self.get_entry(study_accession)[0]
+
+    def get_or_fetch(self, study_accession):
+        """Get metadata table of a study, fetching it on a miss.
+
+        An expired table is still returned when the fetch fails
+        or when running offline.
+
+        Parameters
+        ----------
+        study_accession: string
+                         SRP ID
+
+        Returns
+        -------
+        srp_df: pd.DataFrame
+                One row per run
+
+        Raises
+        ------
+        KeyError
+            If running offline and the study is not cached
+        """
+        entry = self.get_entry(study_accession)
+        if entry is not None and (self.offline or self.is_fresh(entry[1])):
+            return entry[0]
+        if self.offline:
+            raise KeyError(
+                "{} is not in the SRA metadata cache {}".format(
+                    study_accession, self.db_path
+                )
+            )
+        try:
+            return self.fetch(study_accession)
+        except Exception as e:
+            if entry is None:
+                raise
+            print("Using expired SRA metadata for {}: {}".format(study_accession, e))
+            return entry[0]
+
+    def import_tsv(self, file_path):
+        """Fill the cache from a local metadata table.
+
+        Parameters
+        ----------
+        file_path: string
+                   Tab separated table with a study_accession column,
+                   as written by pysradb
+
+        Returns
+        -------
+        study_accessions: list
+                          Studies added to the cache
+        """
+        metadata_df = pd.read_csv(file_path, sep="\t", dtype=str)
+        study_accessions = []
+        for study_accession, srp_df in metadata_df.groupby("study_accession"):
+            self.put(study_accession, srp_df)
+            study_accessions.append(study_accession)
+        return study_accessions
+
+
+def get_study_accessions(datasets_path):
+    """Get study accessions of all projects in datasets.tsv."""
+    datasets = pd.read_csv(datasets_path, sep="\t")
+    return sorted(set(srp.split("_")[0] for srp in datasets.srp))
+
+
+def fetch_with_retry(cache, study_accession, retries=3, backoff=1.0):
+    """Fetch a study into the cache, retrying with exponential backoff.
+
+    Parameters
+    ----------
+    cache: SRAMetadataCache
+    study_accession: string
+                     SRP ID
+    retries: int
+             Attempts after the first one fails
+    backoff: float
+             Seconds to wait before the first retry, doubled on every retry
+    """
+    for attempt in range(retries + 1):
+        try:
+            return cache.fetch(study_accession)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def prefetch(cache, study_accessions, force=False, threads=8, retries=3, backoff=1.0):
+    """Fetch every study that is missing or expired in the cache.
+
+    Studies are fetched concurrently by a bounded pool of threads,
+    each fetch is retried with backoff before it is reported failed.
+
+    Parameters
+    ----------
+    cache: SRAMetadataCache
+    study_accessions: list
+                      SRP IDs
+    force: bool
+           Refetch studies that are up to date
+    threads: int
+             Maximum number of concurrent fetches
+
+    Returns
+    -------
+    failed: list
+            Studies that could not be fetched
+    """
+    study_accessions = list(OrderedDict.fromkeys(study_accessions))
+    if not force:
+        study_accessions = [
+            study_accession
+            for study_accession in study_accessions
+            if cache.get(study_accession) is None
+        ]
+    if not study_accessions:
+        return []
+    print(
+        "Fetching SRA metadata of {} studies with {} threads".format(
+            len(study_accessions), threads
+        )
+    )
+    failed = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = {
+            executor.submit(
+                fetch_with_retry, cache, study_accession, retries, backoff
+            ): study_accession
+            for study_accession in study_accessions
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            study_accession = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("Unable to fetch {}: {}".format(study_accession, e))
+                failed.append(study_accession)
+            elapsed = max(time.time() - start, 1e-6)
+            print(
+                "[{}/{}] {:.2f} studies/s, {} failed".format(
+                    done, len(study_accessions), done / elapsed, len(failed)
+                )
+            )
+    return sorted(failed)
+
+
+def add_fetch_arguments(parser):
+    """Add options controlling how studies are fetched to an ArgumentParser."""
+    parser.add_argument(
+        "--sra-url",
+        help="Fetch TSV tables from this URL template instead of SRAweb, "
+        "with {} in place of the study accession",
+    )
+    parser.add_argument(
+        "--sra-timeout",
+        type=float,
+        default=60,
+        help="Seconds to wait for the metadata of each study",
+    )
+    parser.add_argument(
+        "--sra-retries",
+        type=int,
+        default=3,
+        help="Retries of a failed fetch, with exponential backoff",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cache", default=SRA_METADATA_CACHE_PATH)
+    parser.add_argument(
+        "--ttl-days",
+        type=float,
+        default=SRA_METADATA_TTL_DAYS,
+        help="Refetch cached studies older than this",
+    )
+    add_fetch_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command")
+    prefetch_parser = subparsers.add_parser(
+        "prefetch", help="Fetch missing and expired studies"
+    )
+    prefetch_parser.add_argument("study_accessions", nargs="*")
+    prefetch_parser.add_argument(
+        "--datasets", help="Prefetch every project in datasets.tsv"
+    )
+    prefetch_parser.add_argument(
+        "--force", action="store_true", help="Refetch studies that are up to date"
+    )
+    prefetch_parser.add_argument(
+        "--threads", type=int, default=8, help="Maximum concurrent fetches"
+    )
+    import_parser = subparsers.add_parser(
+        "import", help="Fill the cache from local metadata tables"
+    )
+    import_parser.add_argument("metadata_files", nargs="+")
+    subparsers.add_parser("list", help="List cached studies")
+    args = parser.parse_args()
+
+    cache = SRAMetadataCache(
+        args.cache,
+        ttl_days=args.ttl_days,
+        fetcher=get_fetcher(args.sra_url, args.sra_timeout),
+    )
+    if args.command == "prefetch":
+        study_accessions = list(args.study_accessions)
+        if args.datasets:
+            study_accessions += get_study_accessions(args.datasets)
+        failed = prefetch(
+            cache,
+            study_accessions,
+            force=args.force,
+            threads=args.threads,
+            retries=args.sra_retries,
+        )
+        print(
+            "{} of {} studies are cached".format(
+                len(study_accessions) - len(failed), len(study_accessions)
+            )
+        )
+    elif args.command == "import":
+        for file_path in args.metadata_files:
+            study_accessions = cache.import_tsv(file_path)
+            print(
+                "Imported {} studies from {}".format(len(study_accessions), file_path)
+            )
+    elif args.command == "list":
+        for study_accession, fetched_at in cache.accessions():
+            print(
+                "{}\t{}".format(
+                    study_accession,
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(fetched_at)),
+                )
+            )
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
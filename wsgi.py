@@ -0,0 +1,29 @@
+"""WSGI entry point for production servers.
+
+Run with gunicorn:
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+Importing this module loads the dataset registry, the helper modules
+and the plotly template once. gunicorn.conf.py sets preload_app so
+this happens in the master before it forks the workers, which then
+share these pages copy-on-write instead of each loading them again.
+"""
+
+import gc
+
+from app import app
+from init import __DATASETS__
+from plot_helper import default_template
+
+server = app.server
+
+# Build the dataset index and the lazily loaded plotly template now
+# rather than on the first request of every worker
+__DATASETS__.records
+default_template()
+
+# Keep the garbage collector from touching, and so copying, the
+# objects loaded above in every worker (Python 3.7+)
+if hasattr(gc, "freeze"):
+    gc.freeze()